@@ -6,5 +6,5 @@ source .venv/bin/activate
 # Export environment variables
 export DJANGO_SETTINGS_MODULE=core.settings
 
-# Run with gunicorn
-gunicorn --bind 0.0.0.0:8080 --workers 3 core.wsgi:application 
\ No newline at end of file
+# Run with gunicorn using uvicorn (ASGI) workers so async views share one event loop per worker
+gunicorn --bind 0.0.0.0:8080 --workers 3 -k uvicorn.workers.UvicornWorker core.asgi:application 
\ No newline at end of file
@@ -7,10 +7,10 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import asyncio
+import logging
 import os
 from django.core.asgi import get_asgi_application
-from django.urls import path, re_path
-from django.conf import settings
 from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -19,6 +19,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+logger = logging.getLogger(__name__)
+
 class CustomASGIHandler(ASGIHandler):
     """Custom ASGI handler to add CORS headers and handle async views"""
     async def __call__(self, scope, receive, send):
@@ -38,19 +40,45 @@ class CustomASGIHandler(ASGIHandler):
                 await send({"type": "http.response.body", "body": b""})
                 return
 
+            await self.handle_until_disconnect(scope, receive, send)
+            return
+
         await super().__call__(scope, receive, send)
 
-application = CustomASGIHandler()
+    async def handle_until_disconnect(self, scope, receive, send):
+        """Handle a request, cancelling it (and the upstream calls it awaits) if the client disconnects first"""
+        messages = asyncio.Queue()
+        response_sent = cancelled = False
 
+        async def tracked_send(message):
+            nonlocal response_sent
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
 
-from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from main.routing import websocket_urlpatterns
-
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(websocket_urlpatterns)
-    ),
-})
\ No newline at end of file
+        request = asyncio.ensure_future(super().__call__(scope, messages.get, tracked_send))
+
+        async def listen():
+            nonlocal cancelled
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    # The disconnect that follows a complete response must not cancel the cleanup after it
+                    if not request.done() and not response_sent:
+                        logger.info(f"Client disconnected, cancelling {scope.get('path')}")
+                        cancelled = True
+                        request.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await request
+        except asyncio.CancelledError:
+            # Swallow our own cancellation; re-raise when the server is cancelling us
+            if not cancelled:
+                raise
+        finally:
+            listener.cancel()
+
+application = CustomASGIHandler()
@@ -49,12 +49,8 @@ DATABASES = {
     }
 }
 
-# Cache settings
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
-}
+# Cache settings: CACHES comes from settings.py, set REDIS_URL (or MEMCACHED_LOCATION)
+# so every gunicorn worker shares one cache
 
 # Logging settings
 LOGGING = {
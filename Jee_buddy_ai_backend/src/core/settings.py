@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import dj_database_url
 import os
+import tempfile
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
 
@@ -33,6 +34,170 @@ SECRET_KEY = 'django-insecure-dd16kn&trh7p3@j5r8917v9ac4z4!2&49f-544+4d6f1#d)4uv
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Shared LLM provider connection pools (main/utils/llm_clients.py)
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', '100'))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', '20'))
+LLM_POOL_IDLE_TIMEOUT = float(os.getenv('LLM_POOL_IDLE_TIMEOUT', '60'))  # seconds
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'True') == 'True'
+
+# Upstream deadlines and retries (main/utils/deadlines.py)
+LLM_REQUEST_BUDGET = float(os.getenv('LLM_REQUEST_BUDGET', '120'))  # seconds for all upstream calls of a request
+LLM_STREAM_BUDGET = float(os.getenv('LLM_STREAM_BUDGET', '180'))  # seconds for a streamed response, which outlives the view
+LLM_CALL_TIMEOUT = float(os.getenv('LLM_CALL_TIMEOUT', '30'))  # Cap for a single provider call to models not listed below
+# Per-model caps as model=seconds pairs; long generations need longer than quick lookups
+LLM_MODEL_TIMEOUTS = {
+    model.strip(): float(seconds)
+    for model, _, seconds in (
+        pair.partition('=') for pair in os.getenv(
+            'LLM_MODEL_TIMEOUTS',
+            'gpt-4-turbo=110,deepseek-r1-distill-llama-70b=90,llama3-70b-8192=60,llama-3.1-8b-instant=15'
+        ).split(',') if pair.strip()
+    )
+}
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '20'))  # Longest silence from the provider mid-response
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))  # Retries of transient failures per provider
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))  # seconds, doubled per retry with jitter
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '4'))
+
+# Provider routing (main/utils/provider_router.py)
+LLM_ROUTER_WINDOW = int(os.getenv('LLM_ROUTER_WINDOW', '50'))  # Recent calls kept per provider/model
+LLM_BREAKER_ERROR_RATE = float(os.getenv('LLM_BREAKER_ERROR_RATE', '0.5'))  # Opens the circuit
+LLM_BREAKER_MIN_SAMPLES = int(os.getenv('LLM_BREAKER_MIN_SAMPLES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))  # seconds before a probe call
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'False') == 'True'  # Race the fallback after the p95 delay
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1'))  # seconds
+LLM_HEDGE_MAX_DELAY = float(os.getenv('LLM_HEDGE_MAX_DELAY', '10'))
+
+# Long-term memory (main/utils/long_term_memory.py); 'mem0' or 'local'
+LONG_TERM_MEMORY_BACKEND = os.getenv('LONG_TERM_MEMORY_BACKEND', 'mem0')
+LONG_TERM_MEMORY_TOP_K = int(os.getenv('LONG_TERM_MEMORY_TOP_K', '5'))
+LONG_TERM_MEMORY_TOKEN_BUDGET = int(os.getenv('LONG_TERM_MEMORY_TOKEN_BUDGET', '400'))
+LONG_TERM_MEMORY_CACHE_TTL = float(os.getenv('LONG_TERM_MEMORY_CACHE_TTL', '300'))
+
+# Prompt assembly (main/utils/context_builder.py)
+CONTEXT_MAX_PROMPT_TOKENS = int(os.getenv('CONTEXT_MAX_PROMPT_TOKENS', '6000'))  # Cap on prompt size, below the model window
+CONTEXT_DIGEST_TOKENS = int(os.getenv('CONTEXT_DIGEST_TOKENS', '300'))  # Size of the digest of older turns
+
+# Periodic maintenance jobs (main/scheduler.py). Each worker starts a scheduler and a shared-cache
+# lock lets one of them run each job per interval; set SCHEDULER_ENABLED=False on the web workers
+# when a single dedicated process runs the jobs instead.
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+# Chat history retention (main/utils/history_retention.py), run by main/scheduler.py
+CHAT_HISTORY_RETENTION_ENABLED = os.getenv('CHAT_HISTORY_RETENTION_ENABLED', 'true').lower() == 'true'
+CHAT_HISTORY_MAX_LENGTH = int(os.getenv('CHAT_HISTORY_MAX_LENGTH', '20'))  # Turns kept per user, older ones are archived
+CHAT_HISTORY_RETENTION_INTERVAL_MINUTES = int(os.getenv('CHAT_HISTORY_RETENTION_INTERVAL_MINUTES', '60'))
+CHAT_HISTORY_RETENTION_BATCH_SIZE = int(os.getenv('CHAT_HISTORY_RETENTION_BATCH_SIZE', '500'))
+CHAT_HISTORY_RETENTION_MAX_BATCHES = int(os.getenv('CHAT_HISTORY_RETENTION_MAX_BATCHES', '20'))  # Per run
+
+# Token accounting (main/utils/token_usage.py)
+TOKEN_USAGE_FLUSH_INTERVAL = float(os.getenv('TOKEN_USAGE_FLUSH_INTERVAL', '5'))  # seconds between batched DB writes
+
+# Shared cache for all workers: Redis or memcached when configured, otherwise a
+# file cache that the workers on this host share (tests and local runs)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'jee_buddy',
+        }
+    }
+elif os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.getenv('MEMCACHED_LOCATION').split(','),
+            'KEY_PREFIX': 'jee_buddy',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'jee_buddy_cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Profile cache (main/utils/profile_cache.py)
+PROFILE_CACHE_LOCAL_TTL = float(os.getenv('PROFILE_CACHE_LOCAL_TTL', '5'))  # Per-process copy, seconds
+PROFILE_CACHE_SHARED_TTL = float(os.getenv('PROFILE_CACHE_SHARED_TTL', '60'))
+PROFILE_CACHE_ALIAS = os.getenv('PROFILE_CACHE_ALIAS', 'default') or None  # CACHES alias shared by all workers
+
+# Subscription status lookups (subscription/views.py)
+SUBSCRIPTION_STATUS_CACHE_TTL = int(os.getenv('SUBSCRIPTION_STATUS_CACHE_TTL', '300'))
+
+# Answer cache for repeated questions (main/utils/answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '5000'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', '0.9'))
+ANSWER_CACHE_PERSIST = os.getenv('ANSWER_CACHE_PERSIST', 'True') == 'True'  # Store answers in MathProblem/Solution
+ANSWER_SHARED_CACHE_TTL = int(os.getenv('ANSWER_SHARED_CACHE_TTL', '3600'))  # Answers shared between workers via CACHES
+ANSWER_SHARED_MISS_TTL = int(os.getenv('ANSWER_SHARED_MISS_TTL', '30'))  # Remembered database misses, until the answer is stored
+ANSWER_CACHE_PRUNE_INTERVAL_MINUTES = int(os.getenv('ANSWER_CACHE_PRUNE_INTERVAL_MINUTES', '60'))  # Expired Solution rows, main/scheduler.py
+
+# Cheap-model routing of simple lookups (main/utils/question_router.py)
+QUESTION_ROUTING_ENABLED = os.getenv('QUESTION_ROUTING_ENABLED', 'True') == 'True'
+SMALL_QUESTION_MODEL = os.getenv('SMALL_QUESTION_MODEL', 'llama-3.1-8b-instant')
+SIMPLE_QUESTION_MAX_WORDS = int(os.getenv('SIMPLE_QUESTION_MAX_WORDS', '14'))
+
+# Problem photos are shrunk before vision calls (main/utils/image_preprocessing.py)
+IMAGE_PREPROCESSING_ENABLED = os.getenv('IMAGE_PREPROCESSING_ENABLED', 'True') == 'True'
+# Resolution each vision model reads images at, as model=LONGxSHORT pairs
+IMAGE_MODEL_SIZE_LIMITS = {
+    model.strip(): tuple(int(side) for side in size.lower().split('x'))
+    for model, _, size in (
+        pair.partition('=') for pair in os.getenv(
+            'IMAGE_MODEL_SIZE_LIMITS',
+            'gpt-4-turbo=2048x768,gpt-4o=2048x768,gpt-4o-mini=2048x768,gpt-4.1=2048x768'
+        ).split(',') if pair.strip()
+    )
+}
+IMAGE_MAX_LONG_SIDE = int(os.getenv('IMAGE_MAX_LONG_SIDE', '2048'))  # For models not listed above
+IMAGE_MAX_SHORT_SIDE = int(os.getenv('IMAGE_MAX_SHORT_SIDE', '768'))
+IMAGE_COLOR_CHROMA_THRESHOLD = float(os.getenv('IMAGE_COLOR_CHROMA_THRESHOLD', '12'))  # Cb/Cr std dev to keep colour; 255 = always grayscale
+IMAGE_CROP_TO_CONTENT = os.getenv('IMAGE_CROP_TO_CONTENT', 'True') == 'True'
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_PREPROCESS_WORKERS = int(os.getenv('IMAGE_PREPROCESS_WORKERS', '2'))
+
+# Solutions reused for near-identical problem photos (main/utils/image_hash_cache.py)
+IMAGE_HASH_CACHE_ENABLED = os.getenv('IMAGE_HASH_CACHE_ENABLED', 'True') == 'True'
+IMAGE_HASH_CACHE_ALIAS = os.getenv('IMAGE_HASH_CACHE_ALIAS', 'default')  # CACHES alias shared by all workers
+IMAGE_HASH_CACHE_TTL = int(os.getenv('IMAGE_HASH_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+IMAGE_HASH_MAX_DISTANCE = int(os.getenv('IMAGE_HASH_MAX_DISTANCE', '6'))  # dHash Hamming bits, below 8
+IMAGE_HASH_MAX_PHASH_DISTANCE = int(os.getenv('IMAGE_HASH_MAX_PHASH_DISTANCE', '10'))
+IMAGE_HASH_BUCKET_SIZE = int(os.getenv('IMAGE_HASH_BUCKET_SIZE', '64'))  # Newest entries kept per band value
+
+# OCR-first reading of problem photos; needs pytesseract and the tesseract binary (main/utils/image_ocr.py)
+OCR_FIRST_ENABLED = os.getenv('OCR_FIRST_ENABLED', 'True') == 'True'
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', '85'))  # Mean word confidence (0-100) to skip vision
+OCR_MIN_NUMERIC_CONFIDENCE = float(os.getenv('OCR_MIN_NUMERIC_CONFIDENCE', '85'))  # Every word with a digit must reach it
+OCR_MIN_WORDS = int(os.getenv('OCR_MIN_WORDS', '4'))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '5'))  # seconds per image
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))  # Concurrent tesseract processes per worker
+
+# Content-addressed store for uploaded images (main/utils/blob_store.py)
+IMAGE_STORE_BACKEND = os.getenv('IMAGE_STORE_BACKEND', 'local')  # 'local' or 's3' (needs boto3)
+IMAGE_STORE_ROOT = os.getenv('IMAGE_STORE_ROOT', str(BASE_DIR / 'media' / 'math_images'))
+IMAGE_STORE_BUCKET = os.getenv('IMAGE_STORE_BUCKET', '')
+IMAGE_STORE_PREFIX = os.getenv('IMAGE_STORE_PREFIX', 'math_images/')
+IMAGE_STORE_ENDPOINT_URL = os.getenv('IMAGE_STORE_ENDPOINT_URL') or None  # For S3-compatible services
+IMAGE_STORE_GC_ENABLED = os.getenv('IMAGE_STORE_GC_ENABLED', 'True') == 'True'
+IMAGE_STORE_GC_INTERVAL_MINUTES = int(os.getenv('IMAGE_STORE_GC_INTERVAL_MINUTES', '360'))
+IMAGE_STORE_GC_GRACE_HOURS = float(os.getenv('IMAGE_STORE_GC_GRACE_HOURS', '24'))  # Newer images are never collected
+
+# Identical questions in flight at once share one provider call (main/utils/request_coalescer.py)
+REQUEST_COALESCING_ENABLED = os.getenv('REQUEST_COALESCING_ENABLED', 'True') == 'True'
+
+# Solve endpoint admission control, per worker process (main/utils/admission.py)
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '32'))
+ADMISSION_PER_USER = int(os.getenv('ADMISSION_PER_USER', '2'))  # In-flight solves per user, queued included
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '64'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '5'))  # seconds before a queued request gets 429
+
 
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
@@ -65,18 +230,19 @@ INSTALLED_APPS = [
 ]
 
 
-ASGI_APPLICATION = 'config.asgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'main.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.RequestBudgetMiddleware',
 ]
 
 
@@ -168,6 +334,12 @@ DATABASES = {
         'PASSWORD': os.getenv('SUPABASE_DB_PASSWORD'),
         'HOST': os.getenv('SUPABASE_DB_HOST'),
         'PORT': os.getenv('SUPABASE_DB_PORT'),
+        # Under ASGI, sync ORM calls run in executor threads that Django's request signals never
+        # clean up, so persistent connections pile up until the server's limit is hit. Close them
+        # per request and pool in front of Postgres instead (pgbouncer / Supabase's pooler port,
+        # or Django 5.1+'s OPTIONS["pool"]).
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'sslmode': 'require',  # Ensure SSL mode is enabled
         },
@@ -1,24 +1,35 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, AsyncIterator, List
+from dataclasses import dataclass, field
 import logging
-from asgiref.sync import sync_to_async
-from openai import AsyncOpenAI
-from contextlib import asynccontextmanager
+import threading
+import time
 import os
-from main.models import ChatHistory
-from pathlib import Path
+from main.models import ChatHistory, Solution
 from django.conf import settings
-import uuid
-import base64
 from io import BytesIO
 from .math_image_agent import MathSolver
-from groq import Groq
-from langchain.memory import ConversationBufferMemory
-from mem0 import MemoryClient
+from main.utils.llm_clients import get_async_client
+from main.utils.token_usage import add_usage
+from main.utils.answer_cache import AnswerCache, context_hash, is_self_contained, question_hash
+from main.utils.long_term_memory import LongTermMemory
+from main.utils.context_builder import ContextBuilder
+from main.utils.shared_cache import aget_or_compute, cache_set
+from main.utils.request_coalescer import RequestCoalescer
+from main.utils.provider_router import AllProvidersFailed, Candidate, provider_router
+from main.utils.deadlines import call_timeout, http_timeout, model_timeout, retry_async
+from main.utils.question_router import FORMULA, OCR, STANDARD, VISION, QuestionRouter, lookup_formula
+from main.utils.image_ocr import image_text_reader
+from main.utils.image_preprocessing import PreparedImage, prepare_image
+from main.utils.blob_store import get_image_store
+from asgiref.sync import sync_to_async
 
 
 
 logger = logging.getLogger(__name__)
 
+# Shared-cache value for a question with no stored answer
+ANSWER_MISS = '__answer_miss__'
+
 class ResponseTemplates:
     """Templates for system messages and response structures"""
     
@@ -150,54 +161,64 @@ Please provide a {'comprehensive and advanced' if deep_think else 'clear and foc
 • {'Detailed' if deep_think else 'Simple'} solutions"""
 
 
+@dataclass
+class RequestContext:
+    """Per-request state for one solve, so the shared MathAgent stays immutable"""
+    question: str
+    context: Dict[Any, Any]
+    context_data: Dict[Any, Any]
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    model_config: Dict[str, Any] = field(default_factory=dict)
+    route: str = STANDARD  # QuestionRouter route the model was picked by
+    usage: Dict[str, int] = field(default_factory=dict)  # Provider-reported token usage
+
+
 class MathAgent:
+    """Process-wide math agent; per-request state lives in RequestContext"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
     def __init__(self, api_key: str):
+        if not api_key:
+            raise ValueError("GROQ_DEEPSEEK_API_KEY is not set")
         self.api_key = api_key
         self.templates = ResponseTemplates()
-        self._setup_agent()
-        self.image_solver = MathSolver(api_key)
-        self.memory = ConversationBufferMemory()
-        self.memory_client = MemoryClient(api_key=os.getenv('LONG_TERM_MEMORY_API_KEY'))
+        self.image_solver = MathSolver()
+        self.answer_cache = AnswerCache.from_settings()
+        self.memory = LongTermMemory.from_settings()
+        self.context_builder = ContextBuilder.from_settings()
+        self.coalescer = RequestCoalescer()
+        self.question_router = QuestionRouter.from_settings()
+        self.text_reader = image_text_reader
+        self.image_store = get_image_store()
 
     @classmethod
     async def create(cls):
+        """Return the shared agent, building it on first use"""
+        if cls._instance is not None:
+            return cls._instance
+
         api_key = os.getenv('GROQ_DEEPSEEK_API_KEY')
         if not api_key:
             raise ValueError("GROQ_DEEPSEEK_API_KEY environment variable is not set")
-                
-        # Create instance asynchronously
-        return await sync_to_async(cls)(api_key=api_key)
 
-    def _setup_agent(self):
-        """Initialize agent settings"""
-        if not self.api_key:
-            raise ValueError("GROQ_DEEPSEEK_API_KEY is not set")
-        self.chat_history = []
-        self.max_history = 100
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(api_key=api_key)
+        return cls._instance
 
+    def _get_client(self, provider: str = 'groq'):
+        """Shared, pooled async client for a provider"""
+        return get_async_client(provider)
+
+    def _remember(self, user_id: Optional[str], question: str, solution: str):
+        """Queue the finished exchange for long-term memory"""
+        self.memory.remember(user_id, [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": solution},
+        ])
 
-    @asynccontextmanager
-    async def _get_client(self):
-        """Context manager for API client"""
-        client = None
-        try:
-            # Try Groq first
-            client = Groq(api_key=self.api_key)
-            print("Groq client created")
-            yield client
-        except Exception as e:
-            logger.warning(f"Groq API failed, falling back to OpenAI: {str(e)}")
-            openai_key = os.getenv('OPENAI_API_KEY')
-            if not openai_key:
-                raise ValueError("OPENAI_API_KEY environment variable is not set")
-            
-            # Initialize OpenAI client
-            client = AsyncOpenAI(api_key=openai_key)
-            print("OpenAI fallback client created")
-            yield client
-        finally:
-            if client is not None:  # Ensure client is not None before closing
-                client.close()
     def _get_model_config(self, deep_think: bool) -> Dict[str, Any]:
         """Get model configuration based on mode"""
         try:
@@ -228,28 +249,169 @@ class MathAgent:
 
 
 
-    async def _save_uploaded_image(self, base64_image: str) -> str:
-        """Save base64 image and return the file path"""
+    async def _prepare_request(self, question: str, context: Dict[Any, Any]) -> RequestContext:
+        """Build the per-request context: extracted data, messages and model config"""
+        context_data = self._extract_context(context)
+        request = RequestContext(question=question, context=context, context_data=context_data)
+
+        system_message = self._get_system_message(context_data)
+        # Simple lookups go to a smaller model; only real problems need the 70B ones
+        request.route = self._route(question, context, context_data)
+        request.model_config = (
+            self.question_router.model_config(request.route, context_data['deep_think'])
+            or self._get_model_config(context_data['deep_think'])
+        )
+        if self._is_shared(question, context):
+            # Cached and coalesced answers are served to other users, so they are built without
+            # this user's memories, chat history or session digest
+            memories, prompt_data = None, {**context_data, 'user_id': None, 'chat_history': []}
+        else:
+            memories = await self.memory.recall(context_data['user_id'], question)
+            prompt_data = context_data
+        request.messages = self._prepare_messages(
+            question, system_message, prompt_data, request.model_config, memories
+        )
+        return request
+
+    def _route(self, question: str, context: Dict[Any, Any], context_data: Dict[Any, Any]) -> str:
+        if context.get('image'):
+            return VISION
+        if context.get('ocr_text'):
+            return OCR
+        return self.question_router.classify(question, context_data)
+
+    def _route_model(self, request: RequestContext) -> str:
+        """Model that actually served the request, for the route counters"""
+        return self.image_solver.model if request.route == VISION else request.model_config['model']
+
+    async def _read_image(self, question: str, context: Dict[Any, Any]) -> tuple:
+        """Prepare and store an uploaded image, then OCR-first: a confidently read image is swapped for its text"""
+        if not context.get('image'):
+            return question, context
+        image = await prepare_image(context['image'], self.image_solver.model)
+        # Prepared once, reused by the vision fallback
+        context = {**context, 'image': image, 'image_path': self._store_image(image)}
+        if not self.text_reader.available:
+            return question, context
+        result = await self.text_reader.read(image.data)
+        if not self.text_reader.accepts(result):
+            # Too weak to replace the image, but its numbers still confirm image hash cache hits
+            return question, {**context, 'image_text': result.text if result else None}
+        question = f"{question}\n\nProblem (read from the uploaded image):\n{result.text}"
+        return question, {**context, 'image': None, 'ocr_text': result.text}
+
+    def _store_image(self, image: PreparedImage) -> str:
+        """Content-addressed key of the stored image; the write finishes in the background"""
         try:
-            # Create media directory if it doesn't exist
-            media_path = Path(settings.MEDIA_ROOT) / 'math_images'
-            media_path.mkdir(parents=True, exist_ok=True)
-            
-            # Generate unique filename
-            filename = f"math_image_{uuid.uuid4()}.png"
-            file_path = media_path / filename
-            
-            # Decode and save image
-            image_data = base64.b64decode(base64_image)
-            with open(file_path, 'wb') as f:
-                f.write(image_data)
-            
-            # Return relative path for database storage
-            return f'math_images/{filename}'
-            
+            return self.image_store.put_nowait(image.data, image.mime_type)
         except Exception as e:
             logger.error(f"Error saving image: {str(e)}")
-            raise
+            return ''
+
+    def _is_cacheable(self, question: str, context: Dict[Any, Any]) -> bool:
+        """Only self-contained text questions are served from the answer cache; their prompts carry no user context"""
+        return (
+            getattr(settings, 'ANSWER_CACHE_ENABLED', True)
+            and not context.get('image')
+            and is_self_contained(question)
+        )
+
+    async def _get_cached_answer(self, question: str, context: Dict[Any, Any]) -> Optional[str]:
+        """Look up the in-process cache, then the shared cache, then the persistent tier"""
+        if not self._is_cacheable(question, context):
+            return None
+        context_data = self._extract_context(context)
+        try:
+            solution = self.answer_cache.get(question, context_data)
+            if solution is None and getattr(settings, 'ANSWER_CACHE_PERSIST', True):
+                q_hash, c_hash = question_hash(question), context_hash(context_data)
+                # Workers missing the same answer wait for one database lookup
+                solution = await aget_or_compute(
+                    self._shared_answer_key(q_hash, c_hash),
+                    lambda: self._lookup_stored_answer(q_hash, c_hash),
+                    timeout=getattr(settings, 'ANSWER_SHARED_CACHE_TTL', 3600)
+                )
+                if solution == ANSWER_MISS:
+                    solution = None
+                if solution is not None:
+                    self.answer_cache.set(question, context_data, solution)
+            if solution is not None:
+                logger.info(f"Answer cache hit: {self.answer_cache.stats()}")
+            return solution
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {str(e)}")
+            return None
+
+    async def _cache_answer(self, question: str, context: Dict[Any, Any], solution: str):
+        """Store a fresh solution in every cache tier"""
+        if not self._is_cacheable(question, context):
+            return
+        context_data = self._extract_context(context)
+        try:
+            self.answer_cache.set(question, context_data, solution)
+            if getattr(settings, 'ANSWER_CACHE_PERSIST', True):
+                q_hash, c_hash = question_hash(question), context_hash(context_data)
+                await Solution.astore_cached(question, q_hash, c_hash, context_data, solution)
+                await sync_to_async(cache_set, thread_sensitive=False)(
+                    self._shared_answer_key(q_hash, c_hash), solution,
+                    getattr(settings, 'ANSWER_SHARED_CACHE_TTL', 3600)
+                )
+        except Exception as e:
+            logger.warning(f"Failed to cache answer: {str(e)}")
+
+    async def _lookup_stored_answer(self, q_hash: str, c_hash: str) -> Optional[str]:
+        """Stored answer; a miss is remembered briefly so the next asker skips the database"""
+        solution = await Solution.aget_cached(q_hash, c_hash, getattr(settings, 'ANSWER_CACHE_TTL', 7 * 24 * 3600))
+        if solution is None:
+            # Written directly with its own short timeout; _cache_answer overwrites it once answered
+            await sync_to_async(cache_set, thread_sensitive=False)(
+                self._shared_answer_key(q_hash, c_hash), ANSWER_MISS,
+                getattr(settings, 'ANSWER_SHARED_MISS_TTL', 30)
+            )
+        return solution
+
+    @staticmethod
+    def _shared_answer_key(q_hash: str, c_hash: str) -> str:
+        return f"answer:{q_hash}:{c_hash}"
+
+    def _is_shared(self, question: str, context: Dict[Any, Any]) -> bool:
+        """Whether the answer may reach other users through the answer cache or coalescing"""
+        return self._is_cacheable(question, context) or self._coalesce_key(question, context) is not None
+
+    def _coalesce_key(self, question: str, context: Dict[Any, Any]) -> Optional[tuple]:
+        """
+        Identity of a request whose answer doesn't depend on who asked; None if it does.
+
+        The leader's answer is fanned out to every follower, so it is generated from a
+        user-neutral prompt (see _prepare_request).
+        """
+        if (not getattr(settings, 'REQUEST_COALESCING_ENABLED', True)
+                or context.get('image') or not is_self_contained(question)):
+            return None
+        # context_hash covers subject, topic, interaction type, deep think and selected text
+        return question_hash(question), context_hash(self._extract_context(context))
+
+    async def _generate(self, question: str, context: Dict[Any, Any]) -> tuple:
+        """Call the provider for a fresh solution and cache it; returns (solution, usage)"""
+        request = await self._prepare_request(question, context)
+        started = time.monotonic()
+        solution = await self._make_api_call(request.messages, request.model_config, context, request.usage)
+        self.question_router.record(
+            request.route, self._route_model(request), time.monotonic() - started, request.usage
+        )
+        await self._cache_answer(question, context, solution)
+        return solution, request.usage
+
+    def _answer_locally(self, question: str, context: Dict[Any, Any]) -> Optional[str]:
+        """Plain formula lookups are answered from the local index, without a provider call"""
+        started = time.monotonic()
+        has_image = bool(context.get('image') or context.get('ocr_text'))
+        route = self.question_router.classify(question, self._extract_context(context), has_image)
+        if route != FORMULA:
+            return None
+        answer = lookup_formula(question)
+        self.question_router.record(FORMULA, None, time.monotonic() - started)
+        return answer
 
     async def solve(self, question: str, context: Dict[Any, Any]) -> dict:
         try:
@@ -257,46 +419,84 @@ class MathAgent:
             logger.info(f"question: {question}")
             logger.info(f"Context received: {context}")
 
-            # Extract context first
-            context_data = self._extract_context(context)
-
-            self.memory_client.add([{"role": "user", "content": question}], user_id=context_data['user_id'])
-            # Get system message
-            system_message = self._get_system_message(context_data)
-            # Prepare messages
-            messages = self._prepare_messages(question, system_message, context_data)
-            
-            # Get model configuration
-            model_config = self._get_model_config(context_data['deep_think'])
-            
-            # print("messages", messages)
-            # print("model_config", model_config)
-            # print("context", context)
-            # Make API call
-            
-
-
-            solution = await self._make_api_call(messages, model_config, context)
-            self.memory_client.add([{"role": "assistant", "content": solution}], user_id=context_data['user_id'])
+            question, context = await self._read_image(question, context)
+            cached = self._answer_locally(question, context) or await self._get_cached_answer(question, context)
+            if cached is not None:
+                return self._prepare_response(question, cached, self._extract_context(context))
+
+            key = self._coalesce_key(question, context)
+            if key is not None:
+                (solution, usage), leader = await self.coalescer.run(key, lambda: self._generate(question, context))
+                # Followers made no provider call; they are charged like a cache hit
+                usage = usage if leader else None
+            else:
+                solution, usage = await self._generate(question, context)
+            self._remember(context.get('user_id'), question, solution)
             print("solution", solution)
 
-            
-            # Prepare response
-            response = {
-                "solution": solution,
-                "context": {
-                    "current_question": question,
-                    "response": solution,
-                    **context_data
-                }
-            }
-            
-            return response
+            return self._prepare_response(question, solution, self._extract_context(context), usage)
 
         except Exception as e:
             logger.error(f"Error in solve method: {str(e)}", exc_info=True)
             return self._get_error_response(question, str(e), context)
 
+    async def solve_stream(self, question: str, context: Dict[Any, Any]) -> AsyncIterator[dict]:
+        """Yield solution deltas as they arrive, followed by a final done/error event"""
+        try:
+            logger.info(f"Streaming question: {question}")
+
+            question, context = await self._read_image(question, context)
+            cached = self._answer_locally(question, context) or await self._get_cached_answer(question, context)
+            if cached is not None:
+                yield {"type": "delta", "content": cached}
+                yield {"type": "done", **self._prepare_response(question, cached, self._extract_context(context))}
+                return
+
+            key = self._coalesce_key(question, context)
+            if key is not None and self.coalescer.join(key) is not None:
+                # An identical request is already running; wait for its full answer
+                (solution, usage), leader = await self.coalescer.run(key, lambda: self._generate(question, context))
+                self._remember(context.get('user_id'), question, solution)
+                yield {"type": "delta", "content": solution}
+                yield {"type": "done", **self._prepare_response(
+                    question, solution, self._extract_context(context), usage if leader else None
+                )}
+                return
+
+            shared = self.coalescer.claim(key) if key is not None else None
+            try:
+                request = await self._prepare_request(question, context)
+
+                started = time.monotonic()
+                chunks = []
+                async for delta in self._stream_api_call(request.messages, request.model_config, context, request.usage):
+                    chunks.append(delta)
+                    yield {"type": "delta", "content": delta}
+
+                solution = "".join(chunks)
+                if not solution:
+                    raise ValueError("Empty response received from API")
+                self.question_router.record(
+                    request.route, self._route_model(request), time.monotonic() - started, request.usage
+                )
+                await self._cache_answer(question, context, solution)
+                if shared is not None:
+                    shared.set_result((solution, request.usage))
+            except Exception as e:
+                if shared is not None:
+                    self.coalescer.abandon(shared, e)
+                raise
+            finally:
+                if shared is not None:
+                    self.coalescer.abandon(shared)  # Client went away mid-stream
+            self._remember(request.context_data['user_id'], question, solution)
+
+            yield {"type": "done", **self._prepare_response(question, solution, request.context_data, request.usage)}
+
+        except Exception as e:
+            logger.error(f"Error in solve_stream method: {str(e)}", exc_info=True)
+            yield {"type": "error", **self._get_error_response(question, str(e), context)}
+
     def _extract_context(self, context: Dict[Any, Any]) -> Dict[Any, Any]:
         """Extract and organize context data""" 
         return {
@@ -307,6 +507,7 @@ class MathAgent:
             'topic': context.get('topic', ''),
             'interaction_type': context.get('interaction_type', 'solve'),
             'deep_think': context.get('Deep_think', False),
+            'image_path': context.get('image_path', ''),  # Image store key of the uploaded image
             'chat_history': context.get('chat_history', [])
         }
 
@@ -325,144 +526,124 @@ class MathAgent:
 
     
 
-    def _prepare_messages(self, question: str, system_message: str, context_data: Dict[Any, Any]) -> list:
-        """Prepare messages for API call"""
-        messages = [{"role": "system", "content": system_message}]
-        
-        # Add previous conversation from memory
-        try:
-            if context_data['user_id']:
-                # Retrieve memories for the specific user
-                previous_memory = self.memory_client.get_all(user_id=context_data['user_id'])
-                
-                if previous_memory:
-                    for interaction in previous_memory:
-                        # Handle the mem0 data format
-                        if isinstance(interaction, dict) and 'memory' in interaction:
-                            # Extract the memory content
-                            memory_content = interaction['memory']
-                            
-                            # Append as a user message (or split into user/assistant if needed)
-                            messages.append({
-                                "role": "user",  # Default to 'user' role
-                                "content": memory_content
-                            })
-                        else:
-                            logger.warning(f"Skipping invalid interaction: {interaction}")
-        except Exception as e:
-            logger.warning(f"Error retrieving from mem0: {str(e)}")
-
-        # Add current question
-        question_content = (
-            f"Based on this text: '{context_data['selected_text']}'\n\nQuestion: {question}"
-            if context_data['selected_text']
-            else question
+    def _prepare_messages(self, question: str, system_message: str, context_data: Dict[Any, Any],
+                          model_config: Dict[str, Any], memories: Optional[List[str]] = None) -> list:
+        """Prepare messages for API call within the model's prompt budget"""
+        session_key = (
+            (context_data['user_id'], context_data['session_id'])
+            if context_data['user_id'] and context_data['session_id'] else None
+        )
+        return self.context_builder.build(
+            system_message,
+            question,
+            context_data['selected_text'],
+            model_config,
+            memories=memories,
+            chat_history=context_data['chat_history'],
+            session_key=session_key,
         )
-        messages.append({"role": "user", "content": question_content})
-        
-        return messages
-
-
-
 
-    async def _make_api_call(self, messages: list, model_config: Dict[str, Any], context: Dict[Any, Any] = None) -> str:
-        """Make API call and get response"""
-        last_error = None
-        
-        # Check if this is an image-based request
+    async def _make_api_call(self, messages: list, model_config: Dict[str, Any], context: Dict[Any, Any] = None,
+                             usage: Optional[Dict[str, int]] = None) -> str:
+        """Make API call and get response, adding provider-reported token usage to `usage`"""
         is_image_request = bool(context and context.get('image'))
-        
+
         # Handle image requests first
         if is_image_request:
             try:
                 # Use the MathSolver to process the image
-                image_data = context['image']
-                solution = await self.image_solver.solve(image_data)
-                return solution
+                return await self.image_solver.solve(context['image'], usage, context.get('image_text'))
             except Exception as image_error:
                 logger.error(f"Image processing failed: {str(image_error)}")
-                last_error = image_error
-                # Fall through to text-based processing
+                # Fall through to the OpenAI vision model
+
+        openai_config = self._get_openai_config(model_config, is_image_request)
+        candidates = [] if is_image_request else [
+            Candidate(f"groq:{model_config['model']}", lambda: self._complete('groq', messages, model_config))
+        ]
+        candidates.append(
+            Candidate(f"openai:{openai_config['model']}", lambda: self._complete('openai', messages, openai_config))
+        )
 
-        # Remove provider from config as it's not needed for the API call
-        api_config = {k: v for k, v in model_config.items() if k != "provider"}
-        
-        # Try Groq first for deep think mode
-        if model_config.get("provider") == "groq":
-            try:
-                # Disable streaming for now to avoid await issues
-                api_config["stream"] = False
-                
-                # Make the Groq API call synchronously (no await)
-                response = self.groq_client.chat.completions.create(
+        try:
+            response = await provider_router.call(candidates)
+        except AllProvidersFailed as e:
+            logger.error(str(e))
+            raise
+
+        add_usage(usage, response.usage)
+        return response.choices[0].message.content
+
+    async def _complete(self, provider: str, messages: list, config: Dict[str, Any]):
+        """One non-streaming completion within the request budget; empty responses count as a failure"""
+        async def attempt(timeout: float):
+            response = await self._get_client(provider).chat.completions.create(
                 messages=messages,
-                model=model_config["model"],  # Pass model here
-                **api_config
+                timeout=http_timeout(timeout),
+                **config
             )
-                return response.choices[0].message.content
-            except Exception as groq_error:
-                logger.warning(f"Groq API failed, falling back to DeepSeek: {str(groq_error)}")
-                last_error = groq_error
+            if not response or not response.choices:
+                raise ValueError(f"Empty response received from {provider} API")
+            return response
 
-        # For non-image requests, proceed with the API call
-        if not is_image_request:
-            try:
-                async with self._get_client() as client:
-                    try:
-                        response = client.chat.completions.create(
-                            messages=messages,
-                            **model_config
-                        )
-                        
-                        if not response or not response.choices:
-                            raise ValueError("Empty response received from API")
-                            
-                        return response.choices[0].message.content
-                    except Exception as api_error:
-                        last_error = api_error
-                        logger.error(f"Groq API call failed: {str(api_error)}")
-                        raise
-            except Exception as e:
-                logger.warning(f"Groq API failed, falling back to OpenAI: {str(e)}")
+        return await retry_async(attempt, description=f"{provider} completion", cap=model_timeout(config['model']))
 
-        
-        # For image requests or if Groq fails, use OpenAI
-        try:
-            openai_key = os.getenv('OPENAI_API_KEY')
-            if not openai_key:
-                raise ValueError("OPENAI_API_KEY environment variable is not set")
-            
-            # Update model config for OpenAI
-            openai_config = {
-                # Use GPT-4 models for image requests, otherwise use fallback config
-                "model": "gpt-4-turbo" if is_image_request else (
-                    "deepseek-chat" if model_config.get("model") == "deepseek-reasoner" 
-                    else "gpt-3.5-turbo-16k"
-                ),
-                "temperature": model_config.get("temperature", 0.7),
-                "max_tokens": model_config.get("max_tokens", 380),
-                "stream": False
-            }
-            # print("openai_config", openai_config)
-            # print("messages", messages)
-            async with AsyncOpenAI(api_key=openai_key) as openai_client:
-                response = await openai_client.chat.completions.create(
-                    messages=messages,
-                    **openai_config
-                )
-                
-                if not response or not response.choices:
-                    raise ValueError("Empty response received from OpenAI API")
-                    
-                return response.choices[0].message.content
-                
-        except Exception as openai_error:
-            error_msg = f"API calls failed. "
-            if last_error:
-                error_msg += f"Groq error: {last_error}, "
-            error_msg += f"OpenAI error: {openai_error}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
+    def _get_openai_config(self, model_config: Dict[str, Any], is_image_request: bool = False) -> Dict[str, Any]:
+        """Map a Groq model configuration onto the OpenAI fallback"""
+        return {
+            # Use GPT-4 models for image requests, otherwise use fallback config
+            "model": "gpt-4-turbo" if is_image_request else (
+                "deepseek-chat" if model_config.get("model") == "deepseek-reasoner" 
+                else "gpt-3.5-turbo-16k"
+            ),
+            "temperature": model_config.get("temperature", 0.7),
+            "max_tokens": model_config.get("max_tokens", 380),
+            "stream": model_config.get("stream", False)
+        }
+
+    async def _stream_api_call(self, messages: list, model_config: Dict[str, Any], context: Dict[Any, Any] = None,
+                               usage: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+        """Stream completion deltas, failing over to OpenAI until the first token has been sent"""
+        # Image solutions are not streamed by MathSolver, send them as a single delta
+        if context and context.get('image'):
+            yield await self.image_solver.solve(context['image'], usage, context.get('image_text'))
+            return
+
+        stream_config = {**model_config, "stream": True}
+        openai_config = self._get_openai_config(stream_config)
+
+        async def groq_stream():
+            stream = await self._get_client('groq').chat.completions.create(
+                messages=messages,
+                timeout=http_timeout(call_timeout(model_timeout(stream_config['model']))),
+                **stream_config
+            )
+            async for chunk in stream:
+                # Groq reports usage on the final chunk under x_groq
+                x_groq = getattr(chunk, 'x_groq', None)
+                add_usage(usage, getattr(x_groq, 'usage', None))
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+        async def openai_stream():
+            stream = await self._get_client('openai').chat.completions.create(
+                messages=messages,
+                stream_options={"include_usage": True},
+                timeout=http_timeout(call_timeout(model_timeout(openai_config['model']))),
+                **openai_config
+            )
+            async for chunk in stream:
+                add_usage(usage, chunk.usage)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+        async for delta in provider_router.stream([
+            Candidate(f"groq:{model_config['model']}", groq_stream),
+            Candidate(f"openai:{openai_config['model']}", openai_stream),
+        ]):
+            yield delta
 
     async def _save_chat_history(self, question: str, solution: str, context_data: Dict[Any, Any]):
         """Save interaction to chat history"""
@@ -478,7 +659,7 @@ class MathAgent:
                 }
 
                 # Create chat history entry
-                chat = await sync_to_async(ChatHistory.objects.create)(
+                chat = await ChatHistory.objects.acreate(
                     user_id=context_data['user_id'],
                     session_id=context_data['session_id'],
                     question=question,
@@ -489,10 +670,12 @@ class MathAgent:
         except Exception as e:
             logger.error(f"Error saving chat history: {str(e)}")
 
-    def _prepare_response(self, question: str, solution: str, context_data: Dict[Any, Any]) -> dict:
-        """Prepare final response"""
+    def _prepare_response(self, question: str, solution: str, context_data: Dict[Any, Any],
+                          usage: Optional[Dict[str, int]] = None) -> dict:
+        """Prepare final response; usage is None when no provider call was made (cache hit)"""
         return {
             "solution": solution,
+            "usage": usage or None,
             "context": {
                 "current_question": question,
                 "response": solution,
@@ -504,6 +687,7 @@ class MathAgent:
         """Prepare error response"""
         return {
             "solution": "I apologize, but I encountered an error processing your request. Please try again.",
+            "usage": {"total_tokens": 0},  # Errors are not charged
             "context": {
                 "current_question": question,
                 "response": f"Error occurred: {error}",
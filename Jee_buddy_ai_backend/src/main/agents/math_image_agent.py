@@ -1,8 +1,13 @@
-from openai import AsyncOpenAI
+from main.utils.llm_clients import get_async_client
+from main.utils.token_usage import add_usage
+from main.utils.deadlines import http_timeout, model_timeout, retry_async
+from main.utils.image_hash_cache import content_key, image_hash_cache
+from main.utils.image_payload import ImagePayload
+from main.utils.image_preprocessing import PreparedImage, prepare_image
 from PIL import Image
 import base64
 import io
-from typing import Optional
+from typing import Dict, Optional, Union
 import logging
 import os
 from dotenv import load_dotenv
@@ -11,9 +16,12 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 class MathSolver:
-    def __init__(self, api_key: str):
-        """Initialize the Math Solver service"""
-        self.client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))  # Always use OpenAI for images
+    model = "gpt-4-turbo"
+
+    @property
+    def client(self):
+        """Shared, pooled OpenAI client (always use OpenAI for images)"""
+        return get_async_client('openai')
 
     # async def encode_image(self, file) -> str:
     #     """Convert uploaded file to base64"""
@@ -26,14 +34,25 @@ class MathSolver:
     #         logger.error(f"Error encoding image: {str(e)}")
     #         raise ValueError("Invalid image file")
 
-    async def solve(self, file) -> Optional[str]:
-        """Process image and return solution"""
+    async def solve(self, file: Union[ImagePayload, PreparedImage, str], usage: Optional[Dict[str, int]] = None,
+                    text: Optional[str] = None) -> Optional[str]:
+        """Process image and return solution, adding token usage to `usage`; `text` is an OCR reading of it, if any"""
         try: 
-            print("file", file)
-            base64_image = file
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4-turbo", 
+            # Smaller, upright images at the model's resolution upload faster and cost fewer image tokens
+            image = await prepare_image(file, self.model)
+
+            # Another photo of the same printed problem was already solved
+            content = content_key(image.data, text)
+            if image.fingerprint:
+                cached = await image_hash_cache.aget(image.fingerprint, content)
+                if cached is not None:
+                    return cached
+
+            image_url = image.data_url()  # Encoded once, shared by every retry
+
+            response = await retry_async(lambda timeout: self.client.chat.completions.create(
+                model=self.model,
+                timeout=http_timeout(timeout),
                 messages=[
                     {
                         "role": "user",
@@ -45,16 +64,20 @@ class MathSolver:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
+                                    "url": image_url
                                 }
                             }
                         ]
                     }
                 ],
                 max_tokens=4096
-            )
-            
-            return response.choices[0].message.content
+            ), description="image solve", cap=model_timeout(self.model))
+
+            add_usage(usage, response.usage)
+            solution = response.choices[0].message.content
+            if image.fingerprint and solution:
+                await image_hash_cache.aset(image.fingerprint, content, solution)
+            return solution
 
         except Exception as e:
             logger.error(f"Error in solution generation: {str(e)}")
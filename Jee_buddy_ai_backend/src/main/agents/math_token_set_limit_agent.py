@@ -1,44 +1,31 @@
-import psycopg2
+import logging
 import uuid
 
+from django.db import connections
+
+from main.utils.token_usage import usage_buffer
+
+logger = logging.getLogger(__name__)
+
+LIMIT_REACHED_MESSAGE = "Sorry, you have reached your free 1000 token limit. Please recharge your subscription plan to continue."
+
+
 class MathTokenLimitAgent:
     def __init__(self):
-        # Database Configuration
-        self.DB_CONFIG = {
-            "dbname": "postgres",
-            "user": "postgres",
-            "password": "jeebuddy@2025",  # Keep safe in production
-            "host": "db.kymdueuxnesfvjdrueww.supabase.co",
-            "port": 5432,
-        }
-
         # Free User Limits
         self.FREE_USER_MAX_QUERIES = 5
         self.FREE_USER_MAX_TOKENS = 100
         self.TOKENS_PER_75_WORDS = 100  # Token ratio
 
-    def connect_db(self):
-        """Establish a connection to the database."""
-        try:
-            conn = psycopg2.connect(**self.DB_CONFIG)
-            return conn
-        except Exception as e:
-            print(f"Database connection error: {e}")
-            return None
-
     def get_user(self, user_id):
         """Retrieve user details from the database by user_id."""
-        conn = self.connect_db()
-        if not conn:
-            return None
-
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "SELECT id, name, COALESCE(payment_status, ''), COALESCE(total_tokens, 0) FROM profiles WHERE id = %s",
-                (user_id,),
-            )
-            user = cursor.fetchone()
+            with connections['default'].cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, name, COALESCE(payment_status, ''), COALESCE(total_tokens, 0) FROM profiles WHERE id = %s",
+                    [user_id],
+                )
+                user = cursor.fetchone()
             if user:
                 return {
                     "id": str(user[0]),  # Convert UUID to string
@@ -48,36 +35,46 @@ class MathTokenLimitAgent:
                 }
             return None
         except Exception as e:
-            print(f"Error fetching user: {e}")
+            logger.error(f"Error fetching user: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
-
-    def update_user_usage(self, user_id, new_total_tokens):
-        """Update token count for the user."""
-        conn = self.connect_db()
-        if not conn:
-            return False
 
-        cursor = conn.cursor()
-        try:
-            user_uuid = uuid.UUID(user_id)  # Ensure it's a valid UUID
+    def reserve_tokens(self, user_id, tokens):
+        """
+        Atomically adds tokens to a free user's total if it stays within FREE_USER_MAX_TOKENS.
+
+        Usage recorded but not flushed yet counts against the limit too. Returns the new total,
+        or None when nothing was updated (unknown user or limit reached).
+        """
+        limit = self.FREE_USER_MAX_TOKENS - max(0, usage_buffer.pending(user_id))
+        with connections['default'].cursor() as cursor:
             cursor.execute(
-                "UPDATE profiles SET total_tokens = %s WHERE id = %s",
-                (new_total_tokens, str(user_uuid)),
+                """
+                UPDATE profiles
+                SET total_tokens = COALESCE(total_tokens, 0) + %s
+                WHERE id = %s AND COALESCE(total_tokens, 0) + %s <= %s
+                RETURNING total_tokens
+                """,
+                [tokens, user_id, tokens, limit],
             )
-            conn.commit()
-            return True
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def record_usage(self, user_id, tokens_used, reserved=0):
+        """Charge provider-reported usage after a completion, less the reservation; written to the DB in batches."""
+        try:
+            user_id = str(uuid.UUID(str(user_id)))
+        except ValueError:
+            return
+        usage_buffer.record(user_id, tokens_used, reserved)
+
+    def is_paid_user(self, user_id):
+        """Whether the user's (cached) profile shows a completed payment"""
+        try:
+            user_id = str(uuid.UUID(str(user_id)))
         except ValueError:
-            print("Invalid UUID format:", user_id)
-            return False
-        except Exception as e:
-            print(f"Error updating user usage: {e}")
             return False
-        finally:
-            cursor.close()
-            conn.close()
+        user = usage_buffer.get_profile(user_id, self.get_user)
+        return bool(user) and user["payment_status"] == "completed"
 
     def calculate_tokens(self, text):
         """Calculate token count based on words (100 tokens ≈ 75 words)."""
@@ -86,60 +83,47 @@ class MathTokenLimitAgent:
         return max(tokens_used, 1)  # Ensure at least 1 token is counted
 
     def process_query(self, user_id, prompt):
-        """Handle user queries and enforce limits."""
+        """
+        Check the user's quota before a solve.
+
+        Paid users are recognised from the cached profile. Free users reserve the prompt's
+        estimated cost atomically (reserve_tokens); the response's reserved_tokens is passed
+        to record_usage() with the actual usage, which settles the difference.
+        """
         if not user_id or not prompt:
             return {"error": "user_id and prompt are required"}, 400
 
-        user = self.get_user(user_id)
-        if not user:
+        try:
+            user_id = str(uuid.UUID(str(user_id)))  # Ensure it's a valid UUID
+        except ValueError:
+            logger.warning(f"Invalid UUID format: {user_id}")
             return {"error": "User not found"}, 404
 
-        user_id, payment_status, total_tokens = (
-            user["id"],
-            user["payment_status"],
-            user["total_tokens"],
-        )
+        user = usage_buffer.get_profile(user_id, self.get_user)
+        if not user:
+            return {"error": "User not found"}, 404
 
-        # Print payment status for debugging
-        print(f"Payment status for user {user_id}: {payment_status}")
+        payment_status, total_tokens = user["payment_status"], user["total_tokens"]
 
-        # ✅ 2. If payment_status is "completed" → Unlimited chat
+        # If payment_status is "completed" → Unlimited chat
         if payment_status == "completed":
-            tokens_used = self.calculate_tokens(prompt)
-            new_total_tokens = total_tokens + tokens_used
-            self.update_user_usage(user_id, new_total_tokens)
-
-            response = f"GPT Response to: {prompt}"
             return {
-                "response": response,
                 "total_tokens_used": "Unlimited",
-                "new_total_tokens": new_total_tokens,
+                "total_tokens": total_tokens,
             }
 
-        # ✅ 3. If free user exceeds 1000 tokens → Block further queries
-        if total_tokens >= self.FREE_USER_MAX_TOKENS:
-            return {
-                "message": "Sorry, you have reached your free 1000 token limit. Please recharge your subscription plan to continue."
-            }
-
-        # ✅ 4. Calculate tokens based on words
-        tokens_used = self.calculate_tokens(prompt)
-
-        # ✅ 5. Check if user exceeds 1000 token limit after this query
-        new_total_tokens = total_tokens + tokens_used
-        if new_total_tokens > self.FREE_USER_MAX_TOKENS:
-            return {
-                "message": "Sorry, you have reached your free 1000 token limit. Please recharge your subscription plan to continue."
-            }
-
-        # ✅ 6. Update total tokens in the database
-        self.update_user_usage(user_id, new_total_tokens)
-
-        # Mocked GPT response (replace with actual GPT API call)
-        response = f"GPT Response to: {prompt}"
+        # Free users are blocked once the reservation would take them past the limit
+        reserved = self.calculate_tokens(prompt)
+        try:
+            total_tokens = self.reserve_tokens(user_id, reserved)
+        except Exception as e:
+            logger.error(f"Error reserving tokens: {e}")
+            return {"error": "Could not check token usage"}, 500
+        if total_tokens is None:
+            return {"message": LIMIT_REACHED_MESSAGE}
 
         return {
-            "response": response,
-            "tokens_used": tokens_used,
-            "new_total_tokens": new_total_tokens,
-        }
\ No newline at end of file
+            "total_tokens": total_tokens,
+            "remaining_tokens": self.FREE_USER_MAX_TOKENS - total_tokens,
+            "reserved_tokens": reserved,
+        }
@@ -2,14 +2,23 @@ import streamlit as st
 import os
 from typing import Dict
 import PyPDF2
+import httpx
 from openai import OpenAI
 from dotenv import load_dotenv
 import tempfile
 
+# Runs as a standalone Streamlit app, so limits come from the environment rather than Django settings
+SUMMARIZER_TIMEOUT = float(os.getenv('BOOK_SUMMARIZER_TIMEOUT', '120'))  # seconds per OpenAI call
+SUMMARIZER_MAX_RETRIES = int(os.getenv('BOOK_SUMMARIZER_MAX_RETRIES', '2'))  # SDK backoff is exponential with jitter
+
 class BookSummarizer:
     def __init__(self):
         load_dotenv()
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = OpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=httpx.Timeout(SUMMARIZER_TIMEOUT, connect=10.0),
+            max_retries=SUMMARIZER_MAX_RETRIES
+        )
         
     def read_pdf(self, pdf_path: str) -> Dict[str, str]:
         """Extract text from PDF file and organize by chapters"""
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from main.models import ChatHistory
+
+
+class Command(BaseCommand):
+    help = 'Fills ChatHistory.fingerprint for existing rows, deleting older duplicates of the same interaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        updated = deleted = 0
+
+        # Newest first, so the copy that survives is the latest one
+        rows = (
+            ChatHistory.objects.filter(fingerprint__isnull=True)
+            .order_by('-timestamp', '-id')
+            .values_list('id', 'user_id', 'session_id', 'question', 'response')
+            .iterator(chunk_size=batch_size)
+        )
+        # Written batches are found by the fingerprint lookup, so only a dry run has to remember them
+        seen = set() if dry_run else None
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                batch_updated, batch_deleted = self.process_batch(batch, seen, dry_run)
+                updated, deleted = updated + batch_updated, deleted + batch_deleted
+                batch = []
+        if batch:
+            batch_updated, batch_deleted = self.process_batch(batch, seen, dry_run)
+            updated, deleted = updated + batch_updated, deleted + batch_deleted
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Fingerprinted {updated} chat rows and removed {deleted} duplicates'
+        ))
+
+    def process_batch(self, batch, seen, dry_run):
+        """Fingerprint one batch; rows whose fingerprint is already taken are duplicates"""
+        fingerprints = {
+            row[0]: ChatHistory.compute_fingerprint(row[1], row[2], row[3], row[4])
+            for row in batch
+        }
+        taken = set(
+            ChatHistory.objects.filter(fingerprint__in=set(fingerprints.values()))
+            .values_list('fingerprint', flat=True)
+        ) | (seen or set())
+
+        keep, duplicates = [], []
+        for row_id, fingerprint in fingerprints.items():
+            if fingerprint in taken:
+                duplicates.append(row_id)
+            else:
+                taken.add(fingerprint)
+                keep.append(ChatHistory(id=row_id, fingerprint=fingerprint))
+
+        if dry_run:
+            seen.update(chat.fingerprint for chat in keep)
+        else:
+            ChatHistory.objects.filter(id__in=duplicates).delete()
+            ChatHistory.objects.bulk_update(keep, ['fingerprint'])
+        return len(keep), len(duplicates)
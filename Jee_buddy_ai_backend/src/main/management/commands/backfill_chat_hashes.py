@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from main.models import ChatHistory
+
+
+class Command(BaseCommand):
+    help = 'Fills ChatHistory.content_hash and preview for rows saved before the columns existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        updated = 0
+
+        # Each batch is its own short UPDATE, so the table is never locked for the whole backfill
+        rows = (
+            ChatHistory.objects.filter(content_hash__isnull=True)
+            .values_list('id', 'question', 'response')
+            .iterator(chunk_size=batch_size)
+        )
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                updated += self.process_batch(batch, dry_run)
+                batch = []
+        if batch:
+            updated += self.process_batch(batch, dry_run)
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Filled content hash and preview for {updated} chat rows'))
+
+    def process_batch(self, batch, dry_run):
+        """Hash and preview one batch of (id, question, response) rows"""
+        chats = [
+            ChatHistory(
+                id=row_id,
+                content_hash=ChatHistory.compute_content_hash(question, response),
+                preview=ChatHistory.make_preview(question),
+            )
+            for row_id, question, response in batch
+        ]
+        if not dry_run:
+            ChatHistory.objects.bulk_update(chats, ['content_hash', 'preview'])
+        return len(chats)
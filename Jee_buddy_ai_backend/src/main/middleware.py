@@ -1,3 +1,10 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from main.utils.deadlines import request_budget
+
+
 class CORSMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -8,4 +15,54 @@ class CORSMiddleware:
         response["Access-Control-Allow-Credentials"] = "true"
         response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
         response["Access-Control-Allow-Headers"] = "Content-Type"
-        return response
\ No newline at end of file
+        return response
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that stays async under ASGI.
+
+    The stock middleware is sync-only, which makes Django run every async view
+    behind it in a worker thread. Static files are rare, so only they go off-loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestBudgetMiddleware:
+    """Gives each request a time budget that upstream LLM calls take their timeouts from"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budget = getattr(settings, 'LLM_REQUEST_BUDGET', 60.0)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_budget(self.budget):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_budget(self.budget):
+            return await self.get_response(request)
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-18 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_delete_userprofile_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mathproblem',
+            name='question_hash',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='context_hash',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='solution',
+            index=models.Index(fields=['context_hash', 'created_at'], name='main_soluti_context_faecee_idx'),
+        ),
+    ]
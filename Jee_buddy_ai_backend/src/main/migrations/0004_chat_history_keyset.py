@@ -0,0 +1,35 @@
+# Generated by Django 4.2.8 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_answer_cache'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chathistory',
+            name='main_chathi_user_id_8dc3b8_idx',
+        ),
+        migrations.AddField(
+            model_name='chathistory',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='chathistory',
+            name='preview',
+            field=models.CharField(editable=False, max_length=53, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user_id', '-timestamp', '-id'], include=('session_id', 'preview', 'content_hash'), name='chat_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user_id', 'content_hash'], name='chat_user_content_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.8 on 2026-10-18 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_chat_history_keyset'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='chathistory',
+            name='unique_chat_interaction',
+        ),
+        migrations.RemoveIndex(
+            model_name='chathistory',
+            name='chat_user_content_idx',
+        ),
+        migrations.AddField(
+            model_name='chathistory',
+            name='fingerprint',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_chat_history_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatHistoryArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('user_id', models.CharField(max_length=255)),
+                ('session_id', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('payload', models.BinaryField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'timestamp'], name='chat_archive_user_idx')],
+            },
+        ),
+    ]
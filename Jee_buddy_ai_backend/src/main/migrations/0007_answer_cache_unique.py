@@ -0,0 +1,51 @@
+# Generated by Django 4.2.8 on 2026-10-18 03:38
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_answers(apps, schema_editor):
+    """Keep one problem per question hash and the newest solution per problem/context"""
+    MathProblem = apps.get_model('main', 'MathProblem')
+    Solution = apps.get_model('main', 'Solution')
+
+    duplicated = (
+        MathProblem.objects.exclude(question_hash='')
+        .values('question_hash').annotate(rows=Count('id'), keep=Max('id')).filter(rows__gt=1)
+    )
+    for group in duplicated.iterator():
+        extra = MathProblem.objects.filter(question_hash=group['question_hash']).exclude(id=group['keep'])
+        Solution.objects.filter(problem__in=extra).update(problem_id=group['keep'])
+        extra.delete()
+
+    duplicated = (
+        Solution.objects.exclude(context_hash='')
+        .values('problem_id', 'context_hash').annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    for group in duplicated.iterator():
+        solutions = Solution.objects.filter(problem_id=group['problem_id'], context_hash=group['context_hash'])
+        newest = solutions.order_by('-created_at', '-id').values_list('id', flat=True)[0]
+        solutions.exclude(id=newest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_chat_history_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='solution',
+            index=models.Index(fields=['created_at'], name='main_soluti_created_eb9710_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_answers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mathproblem',
+            constraint=models.UniqueConstraint(condition=models.Q(('question_hash', ''), _negated=True), fields=('question_hash',), name='math_problem_question_hash_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='solution',
+            constraint=models.UniqueConstraint(condition=models.Q(('context_hash', ''), _negated=True), fields=('problem', 'context_hash'), name='solution_problem_context_uniq'),
+        ),
+    ]
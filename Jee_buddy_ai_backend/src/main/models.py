@@ -1,12 +1,17 @@
 from django.db import models
 from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
 import uuid
 import json
 import logging
+import zlib
 
 logger = logging.getLogger(__name__)
 
 MAX_HISTORY_LENGTH = 20  # Set to 20 as per your requirement
+PREVIEW_LENGTH = 50
 
 class ChatHistory(models.Model):
     user_id = models.CharField(max_length=255)  # Supabase user ID
@@ -15,6 +20,33 @@ class ChatHistory(models.Model):
     response = models.TextField()
     context = models.JSONField(default=dict)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Hash of question + response and the sidebar title; NULL only on rows not yet backfilled
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
+    preview = models.CharField(max_length=PREVIEW_LENGTH + 3, null=True, editable=False)
+    # Identifies an interaction within a session; NULL only on rows not yet backfilled
+    fingerprint = models.CharField(max_length=64, unique=True, null=True, editable=False)
+
+    @staticmethod
+    def compute_content_hash(question, response):
+        """Identifies duplicate interactions without comparing full text"""
+        return hashlib.sha256(f"{question}\x1f{response}".encode('utf-8')).hexdigest()
+
+    @classmethod
+    def compute_fingerprint(cls, user_id, session_id, question, response):
+        """Same user, session, question and response give the same fingerprint"""
+        content_hash = cls.compute_content_hash(question, response)
+        return hashlib.sha256(f"{user_id}\x1f{session_id}\x1f{content_hash}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_preview(question):
+        cleaned_question = question.replace('()', '') if question else ''
+        return cleaned_question[:PREVIEW_LENGTH] + ('...' if len(cleaned_question) > PREVIEW_LENGTH else '')
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash(self.question, self.response)
+        self.fingerprint = self.compute_fingerprint(self.user_id, self.session_id, self.question, self.response)
+        self.preview = self.make_preview(self.question)
+        super().save(*args, **kwargs)
 
     def to_dict(self):
         """Convert the model instance to a dictionary"""
@@ -36,29 +68,38 @@ class ChatHistory(models.Model):
     @classmethod
     def add_interaction(cls, user_id, session_id, question, response, context):
         """
-        Adds a new interaction and ensures the chat history does not exceed MAX_HISTORY_LENGTH.
+        Adds a new interaction, or refreshes it if it was already stored.
+
+        History beyond MAX_HISTORY_LENGTH is archived by the periodic retention job
+        (main/utils/history_retention.py), not on insert.
         """
         logger.info(f"Adding interaction for user_id: {user_id}, session_id: {session_id}")
-        
-        with transaction.atomic():
-            # Check the current count of chats for the user
-            current_count = cls.objects.filter(user_id=user_id).count()
-
-            # If the count exceeds the limit, delete the oldest entries
-            if current_count >= MAX_HISTORY_LENGTH:
-                entries_to_remove = current_count - (MAX_HISTORY_LENGTH - 1)
-                oldest_entries = cls.objects.filter(user_id=user_id) \
-                                  .order_by('timestamp')[:entries_to_remove]
-                oldest_entries.delete()
-
-            # Create the new interaction
-            return cls.objects.create(
-                user_id=user_id,
-                session_id=session_id,
-                question=question,
-                response=response,
-                context=context
-            )
+
+        chat, _ = cls.objects.update_or_create(
+            fingerprint=cls.compute_fingerprint(user_id, session_id, question, response),
+            defaults=cls.upsert_defaults(user_id, session_id, question, response, context)
+        )
+        return chat
+
+    @classmethod
+    async def aupsert_interaction(cls, user_id, session_id, question, response, context):
+        """Store an interaction once per session; a repeat moves the existing row to now"""
+        chat, _ = await cls.objects.aupdate_or_create(
+            fingerprint=cls.compute_fingerprint(user_id, session_id, question, response),
+            defaults=cls.upsert_defaults(user_id, session_id, question, response, context)
+        )
+        return chat
+
+    @staticmethod
+    def upsert_defaults(user_id, session_id, question, response, context):
+        return {
+            'user_id': user_id,
+            'session_id': session_id,
+            'question': question,
+            'response': response,
+            'context': context,
+            'timestamp': timezone.now(),
+        }
 
     @classmethod
     def get_recent_history(cls, user_id, session_id, limit=MAX_HISTORY_LENGTH):
@@ -76,19 +117,55 @@ class ChatHistory(models.Model):
         db_table = 'main_chathistory'  # Explicitly set the table name
         ordering = ['-timestamp']
         indexes = [
-            models.Index(fields=['user_id', 'timestamp']),  # Optimized for filtering by user_id and timestamp
+            # Keyset pagination on (user_id, timestamp, id); covers the summary-only history listing
+            models.Index(
+                fields=['user_id', '-timestamp', '-id'],
+                include=['session_id', 'preview', 'content_hash'],
+                name='chat_user_recent_idx'
+            ),
             models.Index(fields=['session_id'])  # Optimized for filtering by session_id
         ]
-        constraints = [
-            models.UniqueConstraint(
-                fields=['user_id', 'session_id', 'question', 'timestamp'],
-                name='unique_chat_interaction'
-            )
+
+
+class ChatHistoryArchive(models.Model):
+    """Cold storage for chat turns pruned from ChatHistory; the body is zlib-compressed JSON"""
+    original_id = models.BigIntegerField(unique=True)  # ChatHistory id, so a turn is archived once
+    user_id = models.CharField(max_length=255)
+    session_id = models.CharField(max_length=100)
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    payload = models.BinaryField()
+
+    @classmethod
+    def from_chat(cls, chat):
+        body = {'question': chat.question, 'response': chat.response, 'context': chat.context}
+        return cls(
+            original_id=chat.id,
+            user_id=chat.user_id,
+            session_id=chat.session_id,
+            timestamp=chat.timestamp,
+            payload=zlib.compress(json.dumps(body).encode('utf-8'), 9)
+        )
+
+    def to_dict(self):
+        """Decompressed turn, in the same shape as ChatHistory.to_dict()"""
+        body = json.loads(zlib.decompress(bytes(self.payload)).decode('utf-8'))
+        return {
+            'user_id': self.user_id,
+            'session_id': self.session_id,
+            'timestamp': self.timestamp.isoformat(),
+            **body
+        }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'timestamp'], name='chat_archive_user_idx')
         ]
 
 
 class MathProblem(models.Model):
     question = models.TextField()
+    question_hash = models.CharField(max_length=64, db_index=True, default='')  # Hash of the normalized question
     category = models.CharField(max_length=100)
     difficulty = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -99,6 +176,14 @@ class MathProblem(models.Model):
             models.Index(fields=['question']),  # Optimized for searching by question
             models.Index(fields=['last_accessed'])  # Optimized for sorting by last_accessed
         ]
+        constraints = [
+            # Rows from before question_hash existed keep the '' default
+            models.UniqueConstraint(
+                fields=['question_hash'],
+                condition=~models.Q(question_hash=''),
+                name='math_problem_question_hash_uniq'
+            )
+        ]
 
 
 class Solution(models.Model):
@@ -107,6 +192,72 @@ class Solution(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     context_data = models.JSONField(default=dict)  # Stores topics and related approaches
+    context_hash = models.CharField(max_length=64, default='')  # Hash of the context that shaped the answer
+
+    @classmethod
+    async def aget_cached(cls, question_hash, context_hash, max_age):
+        """
+        Returns the newest cached answer for a question/context pair, or None if it is older than max_age seconds.
+        """
+        solution = await cls.objects.filter(
+            problem__question_hash=question_hash,
+            context_hash=context_hash,
+            created_at__gte=timezone.now() - timedelta(seconds=max_age)
+        ).order_by('-created_at').only('content', 'problem_id').afirst()
+        if solution is None:
+            return None
+
+        # Touch the problem so last_accessed reflects cache hits
+        await MathProblem.objects.filter(pk=solution.problem_id).aupdate(last_accessed=timezone.now())
+        return solution.content
+
+    @classmethod
+    async def astore_cached(cls, question, question_hash, context_hash, context_data, content):
+        """
+        Persists an answer as the cached solution for a question/context pair.
+
+        One problem per question hash and one solution per problem/context; workers storing the
+        same answer at once converge on the same rows through the unique constraints.
+        """
+        problem, _ = await MathProblem.objects.aget_or_create(
+            question_hash=question_hash,
+            defaults={
+                'question': question,
+                'category': context_data.get('subject', ''),
+                'difficulty': 'deep' if context_data.get('deep_think') else 'standard',
+            }
+        )
+        solution, _ = await cls.objects.aupdate_or_create(
+            problem=problem,
+            context_hash=context_hash,
+            defaults={
+                'approach_type': context_data.get('interaction_type', ''),
+                'content': content,
+                'created_at': timezone.now(),  # A re-stored answer starts a new TTL
+                'context_data': {
+                    'topic': context_data.get('topic', ''),
+                    'selected_text': context_data.get('selected_text', ''),
+                    'deep_think': bool(context_data.get('deep_think', False)),
+                },
+            }
+        )
+        return solution
+
+    @classmethod
+    def delete_expired(cls, max_age, batch_size=500, max_batches=20):
+        """
+        Deletes cached solutions older than max_age seconds, then problems left without any.
+        Returns how many solutions were deleted.
+        """
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        deleted = 0
+        for _ in range(max_batches):
+            ids = list(cls.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += cls.objects.filter(id__in=ids).delete()[0]
+        MathProblem.objects.filter(solutions__isnull=True, last_accessed__lt=cutoff).delete()
+        return deleted
 
     def get_context_data(self):
         """Get parsed context data."""
@@ -118,4 +269,13 @@ class Solution(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['problem', 'created_at']),  # Optimized for filtering by problem and creation time
+            models.Index(fields=['context_hash', 'created_at']),  # Answer cache lookups
+            models.Index(fields=['created_at']),  # Expiry sweeps
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['problem', 'context_hash'],
+                condition=~models.Q(context_hash=''),
+                name='solution_problem_context_uniq'
+            )
         ]
\ No newline at end of file
@@ -0,0 +1,98 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from django_apscheduler.jobstores import DjangoJobStore
+from django.conf import settings
+from django.core.cache import caches
+from .utils.history_retention import prune_chat_history
+from .utils.blob_store import collect_garbage
+from .utils.answer_cache import prune_cached_answers
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Create a global scheduler instance
+scheduler = None
+
+# job id -> (function, setting that enables it, interval setting, default interval in minutes)
+JOBS = {
+    # Move chat history beyond the per-user limit into the archive table
+    'prune_chat_history': (
+        prune_chat_history, 'CHAT_HISTORY_RETENTION_ENABLED', 'CHAT_HISTORY_RETENTION_INTERVAL_MINUTES', 60
+    ),
+    # Delete persisted answers past their TTL
+    'prune_cached_answers': (
+        prune_cached_answers, 'ANSWER_CACHE_PERSIST', 'ANSWER_CACHE_PRUNE_INTERVAL_MINUTES', 60
+    ),
+    # Delete stored images that no chat turn refers to any more
+    'collect_image_garbage': (
+        collect_garbage, 'IMAGE_STORE_GC_ENABLED', 'IMAGE_STORE_GC_INTERVAL_MINUTES', 360
+    ),
+}
+
+
+def _interval(job_id):
+    _, _, interval_setting, default = JOBS[job_id]
+    return getattr(settings, interval_setting, default)
+
+
+def enabled_jobs():
+    """Ids of the jobs whose own setting turns them on"""
+    return [job_id for job_id, (_, enabled, _, _) in JOBS.items() if getattr(settings, enabled, True)]
+
+
+def run_job(job_id):
+    """
+    Run a job unless another process already ran it this interval.
+
+    Every worker process that imports the app starts a scheduler, so the first to add
+    the job's key to the shared cache runs it and the rest skip until the key expires.
+    If the cache is unreachable the job runs anyway; all jobs are safe to repeat.
+    """
+    func = JOBS[job_id][0]
+    lock_timeout = max(30, _interval(job_id) * 60 - 60)
+    try:
+        acquired = caches['default'].add(f"scheduler:{job_id}", os.getpid(), lock_timeout)
+    except Exception as e:
+        logger.warning(f"Scheduler lock unavailable for {job_id}, running anyway: {e}")
+        acquired = True
+    if not acquired:
+        logger.info(f"Skipping {job_id}, another process ran it this interval")
+        return None
+    return func()
+
+
+def start():
+    global scheduler
+    # Only start if scheduler is None (not already started) and this process runs scheduled jobs
+    if scheduler is not None or not getattr(settings, 'SCHEDULER_ENABLED', True):
+        return
+    job_ids = enabled_jobs()
+    if not job_ids:
+        return
+    try:
+        scheduler = BackgroundScheduler(getattr(settings, 'SCHEDULER_CONFIG', {}))
+        scheduler.add_jobstore(DjangoJobStore(), "default")
+
+        for job_id in job_ids:
+            scheduler.add_job(
+                run_job,
+                'interval',
+                args=[job_id],
+                minutes=_interval(job_id),
+                name=job_id,
+                jobstore='default',
+                id=job_id,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
+            )
+
+        logger.info(f"Starting scheduler... Running {', '.join(job_ids)} periodically")
+        scheduler.start()
+
+        # Jobs turned off since the last start would otherwise keep running from the job store
+        for job_id in JOBS.keys() - set(job_ids):
+            if scheduler.get_job(job_id, jobstore='default'):
+                scheduler.remove_job(job_id, jobstore='default')
+    except Exception as e:
+        logger.error(f"Error starting scheduler: {e}")
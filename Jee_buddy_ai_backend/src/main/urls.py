@@ -6,4 +6,5 @@ urlpatterns = [
     path('solve-math/', views.solve_math_problem, name='solve_math'),
     path('profile/', views.get_current_profile, name='get_current_profile'),
     path('chat/history/', views.get_chat_history_by_user, name='get_chat_history'),
+    path('chat/session/', views.get_session_history, name='get_session_history'),
 ]
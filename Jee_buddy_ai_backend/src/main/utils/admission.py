@@ -0,0 +1,170 @@
+"""
+Admission control for the solve endpoint.
+
+Each worker process admits at most ADMISSION_MAX_CONCURRENT solves at a time
+and at most ADMISSION_PER_USER per user (counting queued ones, so one user
+can't fill the queue). When every slot is taken a request waits in a short
+queue, paid users (payment_status == 'completed') ahead of free ones, for up
+to ADMISSION_QUEUE_TIMEOUT seconds. A full queue, a timed-out wait or a user
+over their limit is rejected straight away with a Retry-After estimate.
+
+Waiters may live on different event loops (async_to_sync under WSGI runs one
+loop per request), so state is guarded by a thread lock and waiters are woken
+through their own loop.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from django.conf import settings
+
+PAID, FREE = 0, 1  # Queue priorities, lower is served first
+
+
+class AdmissionRejected(Exception):
+    """The request can't be admitted now; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'loop', 'future', 'granted', 'abandoned')
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+        self.abandoned = False
+
+
+class Ticket:
+    """An admitted request's slot; release() is idempotent"""
+
+    def __init__(self, controller: 'AdmissionController', user_id: str):
+        self._controller = controller
+        self._user_id = user_id
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self._user_id, time.monotonic() - self._started)
+
+    def __del__(self):
+        # Safety net for a streamed response that was dropped before it started
+        self.release()
+
+
+class AdmissionController:
+    """Global and per-user concurrency limits with a bounded priority wait queue"""
+
+    def __init__(self, max_concurrent: int = 32, per_user: int = 2, queue_size: int = 64,
+                 queue_timeout: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._users = Counter()  # Active + queued per user
+        self._queue = []  # (priority, seq, waiter)
+        self._queued = 0
+        self._seq = itertools.count()
+        self._avg_hold = 1.0  # Moving average of seconds a slot is held
+        self._lock = threading.RLock()  # Re-entrant: Ticket.__del__ may run while it is held
+
+    @classmethod
+    def from_settings(cls) -> 'AdmissionController':
+        return cls(
+            max_concurrent=getattr(settings, 'ADMISSION_MAX_CONCURRENT', 32),
+            per_user=getattr(settings, 'ADMISSION_PER_USER', 2),
+            queue_size=getattr(settings, 'ADMISSION_QUEUE_SIZE', 64),
+            queue_timeout=getattr(settings, 'ADMISSION_QUEUE_TIMEOUT', 5.0),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'active': self._active, 'queued': self._queued, 'avg_hold': round(self._avg_hold, 3)}
+
+    async def admit(self, user_id: Optional[str], paid: bool = False) -> Ticket:
+        """Wait for a slot; raises AdmissionRejected instead of queueing past the limits"""
+        user_id = str(user_id or 'anonymous')
+        with self._lock:
+            if self._users[user_id] >= self.per_user:
+                raise AdmissionRejected("Too many requests in progress for this user", self._retry_after(1))
+            if self._active < self.max_concurrent and not self._queued:
+                self._take(user_id)
+                return Ticket(self, user_id)
+            if self._queued >= self.queue_size:
+                raise AdmissionRejected("Server is busy", self._retry_after(self._queued + 1))
+            waiter = _Waiter(user_id, asyncio.get_running_loop())
+            heapq.heappush(self._queue, (PAID if paid else FREE, next(self._seq), waiter))
+            self._queued += 1
+            self._users[user_id] += 1
+
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client went away while queued; a slot granted in the meantime goes to the next waiter
+            if not self._abandon(waiter):
+                Ticket(self, user_id).release()
+            raise
+        if not self._abandon(waiter):
+            return Ticket(self, user_id)
+        raise AdmissionRejected("Server is busy", self._retry_after(self._queued + 1))
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Leave the queue unless already granted a slot; returns whether it left"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.abandoned = True
+            self._queued -= 1
+            self._drop_user(waiter.user_id)
+            return True
+
+    def _take(self, user_id: str):
+        self._active += 1
+        self._users[user_id] += 1
+
+    def _drop_user(self, user_id: str):
+        self._users[user_id] -= 1
+        if self._users[user_id] <= 0:
+            del self._users[user_id]
+
+    def _release(self, user_id: str, held: float):
+        with self._lock:
+            self._active -= 1
+            self._drop_user(user_id)
+            self._avg_hold += 0.1 * (held - self._avg_hold)
+            while self._queue and self._active < self.max_concurrent:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.abandoned:
+                    continue
+                # Queued waiters already count against their user
+                waiter.granted = True
+                self._queued -= 1
+                self._active += 1
+                waiter.loop.call_soon_threadsafe(self._wake, waiter.future)
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(True)
+
+    def _retry_after(self, ahead: int) -> int:
+        """Seconds until roughly `ahead` slots free up, from the average hold time"""
+        estimate = self._avg_hold * ahead / max(1, self.max_concurrent)
+        return max(1, min(60, math.ceil(estimate)))
+
+
+admission = AdmissionController.from_settings()
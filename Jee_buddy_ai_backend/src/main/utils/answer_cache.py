@@ -0,0 +1,254 @@
+"""
+In-process answer cache for repeated questions.
+
+Exact matches hit on a hash of the normalized question plus the context that
+shapes the answer (subject, topic, interaction type, deep think, selected text).
+Near-duplicates hit through a MinHash/LSH index over character shingles; a
+candidate only counts when its estimated Jaccard similarity reaches the
+configured threshold, its context hash is identical and it has exactly the
+same literals. Literals are the numbers, operators, units and single-letter
+variables of the question, in order: "20 m/s at 30°" and "40 m/s at 60°" are
+near-identical text but different problems, so they never share an answer.
+
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full. The persistent tier lives on MathProblem/Solution;
+prune_cached_answers() deletes its expired rows and is run periodically by
+main/scheduler.py.
+"""
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_SHINGLE_SIZE = 5
+
+# Numbers, words and single symbols; literals are picked out of these
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|[^\W\d_]+|[^\w\s]")
+
+# Follow-ups depend on earlier turns, so the same words don't imply the same answer
+_FOLLOW_UP = re.compile(r"^(now|then|and|also|so|why|what if)\b|\b(previous|above|the result|same one)\b")
+
+
+def normalize_question(text: str) -> str:
+    """Canonical form used for hashing and shingling"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?.! ')
+
+
+def question_hash(question: str) -> str:
+    """Stable hash of the normalized question"""
+    return hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+
+
+def context_hash(context_data: Dict[Any, Any]) -> str:
+    """Hash of the context fields that change the answer"""
+    parts = [
+        str(context_data.get('subject', '')).lower(),
+        str(context_data.get('topic', '')).lower(),
+        str(context_data.get('interaction_type', '')),
+        str(bool(context_data.get('deep_think', False))),
+        normalize_question(context_data.get('selected_text', '')),
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def literals(question: str) -> Tuple[str, ...]:
+    """Numbers, operators, units and single-letter variables of a question, in order"""
+    tokens = _TOKEN.findall(normalize_question(question))
+    found = []
+    for i, token in enumerate(tokens):
+        is_number = token[0].isdigit()
+        is_symbol = not token[0].isalnum()
+        # A word right after a number is its unit (20 m/s, 5 kg)
+        is_unit = i > 0 and tokens[i - 1][0].isdigit() and token.isalpha()
+        if is_number or is_symbol or is_unit or len(token) == 1:
+            found.append(token)
+    return tuple(found)
+
+
+def is_self_contained(question: str) -> bool:
+    """Whether a question can be answered without the conversation around it"""
+    normalized = normalize_question(question)
+    return len(normalized.split()) >= 3 and not _FOLLOW_UP.search(normalized)
+
+
+@dataclass
+class _Entry:
+    solution: str
+    scope: str  # Context hash plus literals hash; near-duplicates must share it
+    signature: Tuple[int, ...]
+    expires_at: float
+
+
+class AnswerCache:
+    """Thread-safe LRU/TTL cache with exact and near-duplicate lookups"""
+
+    def __init__(self, max_entries: int = 5000, ttl: float = 7 * 24 * 3600,
+                 similarity_threshold: float = 0.9, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = random.Random(0x5eed)  # Fixed seed so signatures are stable across workers
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[tuple, set] = {}
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    @classmethod
+    def from_settings(cls) -> 'AnswerCache':
+        return cls(
+            max_entries=getattr(settings, 'ANSWER_CACHE_MAX_ENTRIES', 5000),
+            ttl=getattr(settings, 'ANSWER_CACHE_TTL', 7 * 24 * 3600),
+            similarity_threshold=getattr(settings, 'ANSWER_CACHE_SIMILARITY_THRESHOLD', 0.9),
+        )
+
+    def get(self, question: str, context_data: Dict[Any, Any]) -> Optional[str]:
+        """Cached solution for an exact or near-duplicate question, if any"""
+        key, scope = self._key(question, context_data)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._live_entry(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['exact_hits'] += 1
+                return entry.solution
+
+            signature = self._signature(normalize_question(question))
+            best_key, best_score = None, 0.0
+            for candidate in self._candidates(scope, signature):
+                candidate_entry = self._live_entry(candidate, now)
+                if candidate_entry is None:
+                    continue
+                score = self._similarity(signature, candidate_entry.signature)
+                if score > best_score:
+                    best_key, best_score = candidate, score
+
+            if best_key is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self._stats['similar_hits'] += 1
+                logger.info(f"Answer cache near-duplicate hit (similarity {best_score:.2f})")
+                return self._entries[best_key].solution
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, question: str, context_data: Dict[Any, Any], solution: str):
+        """Store a solution, evicting the least recently used entries when full"""
+        key, scope = self._key(question, context_data)
+        signature = self._signature(normalize_question(question))
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(solution, scope, signature, time.monotonic() + self.ttl)
+            for bucket in self._bucket_keys(scope, signature):
+                self._buckets.setdefault(bucket, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['similar_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['exact_hits'] + stats['similar_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def _key(self, question: str, context_data: Dict[Any, Any]) -> Tuple[str, str]:
+        """Exact key and the scope near-duplicates are looked up in"""
+        ctx_hash = context_hash(context_data)
+        literals_hash = hashlib.sha256('\x1f'.join(literals(question)).encode('utf-8')).hexdigest()
+        return f"{question_hash(question)}:{ctx_hash}", f"{ctx_hash}:{literals_hash}"
+
+    def _live_entry(self, key: str, now: float) -> Optional[_Entry]:
+        """Entry for key unless it has expired (expired entries are dropped)"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            self._remove(key)
+            self._stats['expired'] += 1
+            return None
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        for bucket in self._bucket_keys(entry.scope, entry.signature):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def _signature(self, text: str) -> Tuple[int, ...]:
+        """MinHash signature over character shingles"""
+        if len(text) <= _SHINGLE_SIZE:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for s in shingles]
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms)
+
+    def _bucket_keys(self, scope: str, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield (scope, band, signature[start:start + self.rows])
+
+    def _candidates(self, scope: str, signature: Tuple[int, ...]) -> set:
+        candidates = set()
+        for bucket in self._bucket_keys(scope, signature):
+            candidates |= self._buckets.get(bucket, set())
+        return candidates
+
+    @staticmethod
+    def _similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def prune_cached_answers(max_age: Optional[float] = None, batch_size: int = 500) -> int:
+    """Delete persisted answers older than ANSWER_CACHE_TTL; returns how many were deleted"""
+    from main.models import Solution
+
+    max_age = max_age if max_age is not None else getattr(settings, 'ANSWER_CACHE_TTL', 7 * 24 * 3600)
+    deleted = 0
+    try:
+        close_old_connections()
+        deleted = Solution.delete_expired(max_age, batch_size=batch_size)
+    except Exception as e:
+        logger.error(f"Error pruning cached answers: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+    if deleted:
+        logger.info(f"Deleted {deleted} expired cached answers")
+    return deleted
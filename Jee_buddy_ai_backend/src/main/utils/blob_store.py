@@ -0,0 +1,289 @@
+"""
+Content-addressed storage for uploaded problem images.
+
+A blob's key is the SHA-256 of its bytes, so the same image uploaded twice is
+stored once. Keys are spread over two levels of directories/prefixes
+(ab/cd/abcd...) to keep listings small.
+
+Writes never block the event loop: put() runs the write in a thread, and
+put_nowait() hashes the image and hands the write to a small background pool,
+returning the key straight away. Local writes go to a temporary file that is
+renamed into place, so readers never see a partial blob. Storing a blob that
+already exists only refreshes its modification time.
+
+Backends: a local directory (IMAGE_STORE_ROOT) or any S3-compatible bucket
+(IMAGE_STORE_BUCKET, optional IMAGE_STORE_ENDPOINT_URL), which needs boto3.
+
+collect_garbage() deletes blobs no chat turn refers to. It is run
+periodically by main/scheduler.py. Blobs younger than IMAGE_STORE_GC_GRACE_HOURS
+are always kept, so an upload whose turn hasn't been saved yet, or a
+re-upload that just refreshed an old blob, is never collected. The references
+are read before the listing, so a blob re-uploaded while a run is going could
+look old and unreferenced; each candidate's modification time is read again
+(stat / HEAD) right before the delete and refreshed blobs are skipped. Turns
+moved to ChatHistoryArchive keep their text but no longer hold their image.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='blob-writer')
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _shard(key: str) -> str:
+    return f"{key[:2]}/{key[2:4]}/{key}"
+
+
+class BlobStore:
+    """Sync backend primitives plus the async and background entry points built on them"""
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def touch(self, key: str, content_type: str):
+        """Refresh a blob's modification time"""
+        raise NotImplementedError
+
+    def write(self, key: str, data: bytes, content_type: str):
+        raise NotImplementedError
+
+    def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def delete_many(self, keys: List[str]):
+        raise NotImplementedError
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        """(key, modified timestamp) for every blob"""
+        raise NotImplementedError
+
+    def modified(self, key: str) -> Optional[float]:
+        """A blob's current modification timestamp, None if it is gone"""
+        raise NotImplementedError
+
+    def store(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        """Write a blob unless it is already stored"""
+        if self.exists(key):
+            self.touch(key, content_type)
+        else:
+            self.write(key, data, content_type)
+        return key
+
+    async def put(self, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        """Store bytes and return their key, without blocking the event loop"""
+        key = await sync_to_async(blob_key, thread_sensitive=False)(data)
+        return await sync_to_async(self.store, thread_sensitive=False)(key, data, content_type)
+
+    def put_nowait(self, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        """Return the key now and store the bytes in the background; failures are logged"""
+        key = blob_key(data)  # hashlib releases the GIL for large inputs
+        _writer.submit(self._store_logged, key, data, content_type)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await sync_to_async(self.read, thread_sensitive=False)(key)
+
+    def _store_logged(self, key: str, data: bytes, content_type: str):
+        try:
+            self.store(key, data, content_type)
+        except Exception as e:
+            logger.error(f"Error storing blob {key}: {str(e)}")
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / _shard(key)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def touch(self, key: str, content_type: str):
+        os.utime(self._path(key))
+
+    def write(self, key: str, data: bytes, content_type: str):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            temporary.write_bytes(data)
+            os.replace(temporary, path)  # Atomic; a concurrent writer of the same key writes the same bytes
+        finally:
+            temporary.unlink(missing_ok=True)
+
+    def read(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def delete_many(self, keys: List[str]):
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def modified(self, key: str) -> Optional[float]:
+        try:
+            return self._path(key).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        if not self.root.exists():
+            return
+        for path in self.root.glob('??/??/*'):
+            if not path.name.startswith('.'):
+                yield path.name, path.stat().st_mtime
+
+
+class S3BlobStore(BlobStore):
+    """Any S3-compatible bucket (AWS, MinIO, R2, ...)"""
+
+    def __init__(self, bucket: str, prefix: str = 'math_images/', endpoint_url: Optional[str] = None):
+        import boto3  # Optional dependency, only needed for this backend
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{_shard(key)}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def touch(self, key: str, content_type: str):
+        # Copying an object onto itself is the only way to bump LastModified
+        object_key = self._object_key(key)
+        self.client.copy_object(
+            Bucket=self.bucket, Key=object_key,
+            CopySource={'Bucket': self.bucket, 'Key': object_key},
+            MetadataDirective='REPLACE', ContentType=content_type,
+        )
+
+    def write(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, ContentType=content_type)
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body'].read()
+
+    def delete_many(self, keys: List[str]):
+        for start in range(0, len(keys), 1000):  # delete_objects takes at most 1000 keys
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': self._object_key(key)} for key in keys[start:start + 1000]],
+                'Quiet': True,
+            })
+
+    def modified(self, key: str) -> Optional[float]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))['LastModified'].timestamp()
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'].rsplit('/', 1)[-1], item['LastModified'].timestamp()
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> BlobStore:
+    """The configured image store, built on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = _build_store()
+        return _store
+
+
+def _build_store() -> BlobStore:
+    root = getattr(settings, 'IMAGE_STORE_ROOT', None) or os.path.join(settings.MEDIA_ROOT or 'media', 'math_images')
+    if getattr(settings, 'IMAGE_STORE_BACKEND', 'local') == 's3':
+        try:
+            return S3BlobStore(
+                bucket=settings.IMAGE_STORE_BUCKET,
+                prefix=getattr(settings, 'IMAGE_STORE_PREFIX', 'math_images/'),
+                endpoint_url=getattr(settings, 'IMAGE_STORE_ENDPOINT_URL', None),
+            )
+        except Exception as e:
+            logger.error(f"S3 image store unavailable, storing images locally: {str(e)}")
+    return LocalBlobStore(root)
+
+
+def referenced_image_keys() -> set:
+    """Blob keys that saved chat turns still point at"""
+    from main.models import ChatHistory
+
+    return set(
+        ChatHistory.objects.filter(context__has_key='image_path')
+        .values_list('context__image_path', flat=True)
+    )
+
+
+def _delete_stale(store: BlobStore, keys: List[str], cutoff: float) -> int:
+    """Delete the keys whose blobs haven't been stored again since they were listed"""
+    stale = []
+    for key in keys:
+        modified = store.modified(key)
+        if modified is not None and modified < cutoff:
+            stale.append(key)
+    if stale:
+        store.delete_many(stale)
+    return len(stale)
+
+
+def collect_garbage(store: Optional[BlobStore] = None, grace_hours: Optional[float] = None,
+                    batch_size: int = 500) -> int:
+    """Delete blobs no chat turn refers to, skipping recent ones; returns how many were deleted"""
+    store = store or get_image_store()
+    grace_hours = grace_hours if grace_hours is not None else getattr(settings, 'IMAGE_STORE_GC_GRACE_HOURS', 24)
+    cutoff = time.time() - grace_hours * 3600
+
+    deleted = 0
+    try:
+        close_old_connections()
+        referenced = referenced_image_keys()
+        batch = []
+        for key, modified in store.list_blobs():
+            if modified < cutoff and key not in referenced:
+                batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += _delete_stale(store, batch, cutoff)
+                batch = []
+        if batch:
+            deleted += _delete_stale(store, batch, cutoff)
+    except Exception as e:
+        logger.error(f"Error collecting unreferenced images: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+    if deleted:
+        logger.info(f"Deleted {deleted} unreferenced images")
+    return deleted
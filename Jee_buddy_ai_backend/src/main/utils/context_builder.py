@@ -0,0 +1,227 @@
+"""
+Token-budgeted prompt assembly.
+
+Messages are filled in priority order until the model's prompt budget is
+used up: system prompt and the question (with selected text) always go in,
+then relevant memories, then recent chat turns newest first. Turns that no
+longer fit are folded into a short extractive digest of the older
+conversation. The digest is rolled forward per session and cached, so each
+old turn is condensed once.
+
+Tokens are counted with tiktoken's cl100k_base encoding; when it can't be
+loaded a character-based estimate is used instead.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Context window per model; unknown models get the smallest window we use
+MODEL_CONTEXT_WINDOWS = {
+    'llama-3.1-8b-instant': 131072,
+    'llama3-70b-8192': 8192,
+    'deepseek-r1-distill-llama-70b': 131072,
+    'gpt-3.5-turbo-16k': 16384,
+    'gpt-4': 8192,
+    'gpt-4-turbo': 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added per chat message
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding('cl100k_base')
+                except Exception as e:
+                    _encoding_failed = True
+                    logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of a piece of text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:(max_tokens - 1) * 4]
+
+
+def _message_tokens(content: str) -> int:
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _first_sentence(text: str, max_chars: int) -> str:
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    sentence = re.split(r'(?<=[.?!])\s', text, maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + '…'
+
+
+@dataclass
+class _Digest:
+    """Digest of a session's older turns, up to and including folded_through"""
+    folded_through: Any = None
+    lines: List[Tuple[Any, str]] = field(default_factory=list)  # (row key, line), oldest first
+
+
+class ContextBuilder:
+    """Builds the message list for a solve within the model's prompt budget"""
+
+    def __init__(self, max_prompt_tokens: int = 6000, digest_tokens: int = 300,
+                 digest_ttl: float = 24 * 3600, max_sessions: int = 10000):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.digest_tokens = digest_tokens
+        self._digests = TTLCache(maxsize=max_sessions, ttl=digest_ttl)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'ContextBuilder':
+        return cls(
+            max_prompt_tokens=getattr(settings, 'CONTEXT_MAX_PROMPT_TOKENS', 6000),
+            digest_tokens=getattr(settings, 'CONTEXT_DIGEST_TOKENS', 300),
+        )
+
+    def prompt_budget(self, model_config: Dict[str, Any]) -> int:
+        """Tokens available for the prompt once the completion is reserved"""
+        window = MODEL_CONTEXT_WINDOWS.get(model_config.get('model'), DEFAULT_CONTEXT_WINDOW)
+        return min(window - model_config.get('max_tokens', 0), self.max_prompt_tokens)
+
+    def build(self, system_message: str, question: str, selected_text: str, model_config: Dict[str, Any],
+              memories: Optional[List[str]] = None, chat_history: Optional[List[Dict[str, Any]]] = None,
+              session_key: Optional[Tuple[str, str]] = None) -> list:
+        """
+        Assemble messages for the API call.
+
+        chat_history holds ChatHistory rows newest first, as returned by get_chat_history.
+        """
+        remaining = self.prompt_budget(model_config) - _message_tokens(system_message)
+
+        # The question is required; selected text gives way if the two don't fit
+        question_content = question
+        if selected_text:
+            question_content = f"Based on this text: '{selected_text}'\n\nQuestion: {question}"
+            overflow = _message_tokens(question_content) - remaining
+            while overflow > 0 and selected_text:
+                shorter = truncate_to_tokens(selected_text, count_tokens(selected_text) - overflow)
+                selected_text = shorter if len(shorter) < len(selected_text) else selected_text[:-1]
+                question_content = f"Based on this text: '{selected_text}'\n\nQuestion: {question}"
+                overflow = _message_tokens(question_content) - remaining
+        remaining -= _message_tokens(question_content)
+
+        memory_message = None
+        if memories:
+            header = "Relevant notes from earlier sessions with this student:"
+            kept, cost = [], _message_tokens(header)
+            for memory in memories:
+                line_cost = count_tokens(f"\n- {memory}")
+                if cost + line_cost > remaining:
+                    break
+                kept.append(memory)
+                cost += line_cost
+            if kept:
+                memory_message = header + "\n" + "\n".join(f"- {memory}" for memory in kept)
+                remaining -= cost
+
+        recent, older = self._split_history(chat_history or [], remaining)
+        history_messages = []
+        for row in reversed(recent):
+            history_messages.append({"role": "user", "content": row['question']})
+            history_messages.append({"role": "assistant", "content": row['response']})
+            remaining -= self._turn_tokens(row)
+
+        digest_header = "Summary of the earlier conversation:"
+        digest = ''
+        if older:
+            cutoff = self._row_key(recent[-1]) if recent else None
+            digest_budget = min(self.digest_tokens, remaining - _message_tokens(digest_header))
+            digest = self._digest(session_key, older, cutoff, digest_budget)
+
+        messages = [{"role": "system", "content": system_message}]
+        if memory_message:
+            messages.append({"role": "system", "content": memory_message})
+        if digest:
+            messages.append({"role": "system", "content": f"{digest_header}\n{digest}"})
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": question_content})
+        return messages
+
+    def _turn_tokens(self, row: Dict[str, Any]) -> int:
+        return _message_tokens(row['question']) + _message_tokens(row['response'])
+
+    def _split_history(self, chat_history: List[Dict[str, Any]], remaining: int):
+        """Newest turns that fit, and the older ones left over for the digest"""
+        total = sum(self._turn_tokens(row) for row in chat_history)
+        if total <= remaining:
+            return chat_history, []
+
+        budget = remaining - self.digest_tokens
+        recent, used = [], 0
+        for row in chat_history:
+            cost = self._turn_tokens(row)
+            if used + cost > budget:
+                break
+            recent.append(row)
+            used += cost
+        return recent, chat_history[len(recent):]
+
+    def _digest(self, session_key: Optional[Tuple[str, str]], older: List[Dict[str, Any]],
+                cutoff: Any, max_tokens: int) -> str:
+        """Roll the session digest forward over turns that dropped out of the window"""
+        if max_tokens <= 0:
+            return ''
+
+        with self._lock:
+            cached = self._digests.get(session_key) if session_key else None
+        digest = _Digest(cached.folded_through, list(cached.lines)) if cached else _Digest()
+
+        newly_dropped = [row for row in reversed(older)
+                         if digest.folded_through is None or self._row_key(row) > digest.folded_through]
+        for row in newly_dropped:
+            digest.folded_through = self._row_key(row)
+            digest.lines.append((digest.folded_through, (
+                f"- Q: {_first_sentence(row['question'], 160)} A: {_first_sentence(row['response'], 200)}"
+            )))
+
+        # Keep the most recent lines that fit the digest budget
+        while digest.lines and count_tokens("\n".join(line for _, line in digest.lines)) > self.digest_tokens:
+            digest.lines.pop(0)
+
+        if session_key:
+            with self._lock:
+                self._digests[session_key] = digest
+
+        # Turns that are back in the window are sent in full, not summarized
+        text = "\n".join(line for key, line in digest.lines if cutoff is None or key < cutoff)
+        return text if count_tokens(text) <= max_tokens else truncate_to_tokens(text, max_tokens)
+
+    @staticmethod
+    def _row_key(row: Dict[str, Any]):
+        return (row.get('timestamp'), row.get('id'))
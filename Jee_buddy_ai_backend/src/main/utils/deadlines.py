@@ -0,0 +1,159 @@
+"""
+Request time budgets, per-call timeouts and bounded retries for upstream calls.
+
+RequestBudgetMiddleware opens a budget (LLM_REQUEST_BUDGET seconds) for each
+request. Every provider call derives its total time from what is left of it,
+capped per model (LLM_MODEL_TIMEOUTS, else LLM_CALL_TIMEOUT), so one slow
+upstream can't hold a worker past the request's deadline. Within that, the
+HTTP client gets separate connect (LLM_CONNECT_TIMEOUT) and read-idle
+(LLM_READ_TIMEOUT) timeouts, so a stalled connection fails fast while a long
+generation that keeps sending is not cut short. The deadline lives in a
+context variable, which asgiref carries across sync_to_async/async_to_sync.
+
+A streamed response is iterated after the view and the middleware have
+returned, outside their budget; within_budget() gives the stream its own
+deadline (LLM_STREAM_BUDGET) and enforces it on every item.
+
+retry_async retries transient failures (connection errors, 429/5xx) a bounded
+number of times with full-jitter exponential backoff, and never sleeps past the
+deadline. Timeouts are not retried, except connect timeouts: a generation that
+ran out of time would only start over with less time left.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = {'APIConnectionError', 'APITimeoutError'}  # Same names in the openai and groq SDKs
+
+_deadline: ContextVar[Optional[float]] = ContextVar('llm_deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before an upstream call could start"""
+
+
+@contextmanager
+def request_budget(seconds: Optional[float]):
+    """Bound upstream calls made inside the block to `seconds`, or to an outer, tighter budget"""
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, None when there is no budget"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def model_timeout(model: Optional[str]) -> float:
+    """Longest a single call to `model` may take"""
+    timeouts = getattr(settings, 'LLM_MODEL_TIMEOUTS', {})
+    return timeouts.get(model) or getattr(settings, 'LLM_CALL_TIMEOUT', 30.0)
+
+
+def call_timeout(cap: Optional[float] = None) -> float:
+    """Timeout for the next upstream call: what's left of the budget, at most `cap`"""
+    cap = cap or getattr(settings, 'LLM_CALL_TIMEOUT', 30.0)
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request budget exhausted")
+    return min(cap, left)
+
+
+def http_timeout(total: float) -> httpx.Timeout:
+    """Per-phase timeouts for one provider request that may take up to `total` seconds"""
+    return httpx.Timeout(
+        min(total, getattr(settings, 'LLM_READ_TIMEOUT', 20.0)),  # Longest gap between bytes
+        connect=min(total, getattr(settings, 'LLM_CONNECT_TIMEOUT', 5.0)),
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, DeadlineExceeded):
+        return False
+    # The SDKs wrap httpx errors (APITimeoutError, APIConnectionError); judge the underlying one
+    cause = error.__cause__ if type(error).__name__ in _RETRYABLE_NAMES else None
+    if isinstance(cause, httpx.TransportError):
+        error = cause
+    if isinstance(error, httpx.ConnectTimeout):
+        return True  # The request never reached the provider
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException)):
+        return False
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return type(error).__name__ == 'APIConnectionError'
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def retry_async(call: Callable[[float], Awaitable[Any]], retries: Optional[int] = None,
+                      description: str = 'upstream call', cap: Optional[float] = None) -> Any:
+    """Run call(timeout) with a per-attempt timeout of at most `cap`, retrying transient failures within the budget"""
+    retries = getattr(settings, 'LLM_MAX_RETRIES', 2) if retries is None else retries
+    base = getattr(settings, 'LLM_RETRY_BASE_DELAY', 0.5)
+    max_delay = getattr(settings, 'LLM_RETRY_MAX_DELAY', 4.0)
+
+    for attempt in range(retries + 1):
+        timeout = call_timeout(cap)
+        try:
+            return await asyncio.wait_for(call(timeout), timeout)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base, max_delay)
+            left = remaining()
+            if left is not None and delay >= left:
+                raise
+            logger.warning(f"{description} failed ({type(e).__name__}: {str(e)}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def within_budget(source: AsyncIterator[Any], seconds: Optional[float] = None) -> AsyncIterator[Any]:
+    """Items of `source`, with upstream calls made while producing them bounded by a budget of their own"""
+    seconds = seconds or getattr(settings, 'LLM_STREAM_BUDGET', 180.0)
+    deadline = time.monotonic() + seconds
+    try:
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise DeadlineExceeded("Stream budget exhausted")
+            token = _deadline.set(deadline)
+            try:
+                item = await asyncio.wait_for(source.__anext__(), left)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError as e:
+                if time.monotonic() < deadline:
+                    raise  # A timeout inside the stream, not ours
+                raise DeadlineExceeded("Stream budget exhausted") from e
+            finally:
+                _deadline.reset(token)
+            yield item
+    finally:
+        await source.aclose()
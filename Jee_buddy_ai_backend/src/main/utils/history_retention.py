@@ -0,0 +1,79 @@
+"""
+Periodic chat history retention.
+
+Each user keeps their newest MAX_HISTORY_LENGTH turns in ChatHistory. Older
+turns are moved to ChatHistoryArchive in batches by a scheduled job (see
+main/scheduler.py), so inserts don't count and delete rows on the request path.
+"""
+import logging
+from typing import List
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from main.models import MAX_HISTORY_LENGTH, ChatHistory, ChatHistoryArchive
+
+logger = logging.getLogger(__name__)
+
+
+def expired_chat_ids(keep: int, limit: int) -> List[int]:
+    """Ids of turns ranked below the newest `keep` of their user"""
+    # Only users over the limit have anything to archive, so the window skips everyone else
+    over_limit = (
+        ChatHistory.objects.values('user_id')
+        .annotate(turns=Count('id'))
+        .filter(turns__gt=keep)
+        .values('user_id')
+    )
+    ranked = ChatHistory.objects.filter(user_id__in=over_limit).annotate(
+        rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('timestamp').desc(), F('id').desc()]
+        )
+    )
+    return list(ranked.filter(rank__gt=keep).order_by('id').values_list('id', flat=True)[:limit])
+
+
+def archive_batch(ids: List[int]) -> int:
+    """Move one batch of turns into the archive; returns how many were moved"""
+    with transaction.atomic():
+        # Rows another worker is already archiving are skipped rather than waited on
+        chats = list(ChatHistory.objects.select_for_update(skip_locked=True).filter(id__in=ids))
+        if not chats:
+            return 0
+        ChatHistoryArchive.objects.bulk_create(
+            [ChatHistoryArchive.from_chat(chat) for chat in chats],
+            ignore_conflicts=True
+        )
+        ChatHistory.objects.filter(id__in=[chat.id for chat in chats]).delete()
+    return len(chats)
+
+
+def prune_chat_history(keep: int = None, batch_size: int = None, max_batches: int = None) -> int:
+    """Archive turns beyond each user's retention limit, a bounded number of batches per run"""
+    keep = keep or getattr(settings, 'CHAT_HISTORY_MAX_LENGTH', MAX_HISTORY_LENGTH)
+    batch_size = batch_size or getattr(settings, 'CHAT_HISTORY_RETENTION_BATCH_SIZE', 500)
+    max_batches = max_batches or getattr(settings, 'CHAT_HISTORY_RETENTION_MAX_BATCHES', 20)
+
+    archived = 0
+    try:
+        close_old_connections()
+        # Ranked once per run; each batch then archives its slice of the expired ids
+        expired = expired_chat_ids(keep, batch_size * max_batches)
+        for start in range(0, len(expired), batch_size):
+            ids = expired[start:start + batch_size]
+            moved = archive_batch(ids)
+            archived += moved
+            if moved < len(ids):
+                break  # The rest is locked by another run
+    except Exception as e:
+        logger.error(f"Error pruning chat history: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+    if archived:
+        logger.info(f"Archived {archived} chat history rows")
+    return archived
@@ -0,0 +1,203 @@
+"""
+Perceptual-hash cache for repeated problem photos.
+
+Students photograph the same printed problems again and again, and no two
+photos of a page are byte-identical. Each preprocessed image (upright,
+grayscale, cropped to the writing) gets a 64-bit dHash and a 64-bit pHash. A
+stored solution is reused when a new photo's dHash is within
+IMAGE_HASH_MAX_DISTANCE bits of it and its pHash, which shifts more with small
+rotations but separates different pages well, within
+IMAGE_HASH_MAX_PHASH_DISTANCE bits.
+
+Perceptual hashes only see the layout: two printed problems that differ only
+in their numbers hash alike. So a hit must also match on content_key(): the
+numbers, operators and units OCR read from the image when there is a reading
+with numbers in it, otherwise the exact bytes of the normalized image. Without
+OCR only resubmissions of the same photo hit.
+
+The index lives in the shared Django cache so every worker sees it. Hamming
+lookups in a key-value store use multi-index hashing: the dHash is split into
+8 bands of 8 bits, and each band value keys a short list of entries. Two hashes
+within 7 bits of each other must agree exactly on at least one band
+(pigeonhole), so one get_many over the 8 band keys finds every candidate.
+
+The index is bounded: entries expire after IMAGE_HASH_CACHE_TTL, each band
+list keeps only the newest IMAGE_HASH_BUCKET_SIZE entries, and the cache
+backend's own eviction (MAX_ENTRIES, Redis maxmemory) caps the total. Band
+lists are updated read-modify-write, so a concurrent insert can drop an entry
+from one band; that costs a miss, never a wrong answer.
+"""
+import hashlib
+import logging
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from PIL import Image
+
+from main.utils.answer_cache import literals
+
+logger = logging.getLogger(__name__)
+
+Fingerprint = Tuple[int, int]  # (dHash, pHash)
+
+BANDS = 8
+BAND_BITS = 64 // BANDS
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+
+# DCT-II basis for the low frequencies a pHash keeps
+_DCT_BASIS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def dhash(gray: Image.Image) -> int:
+    """Difference hash: is each pixel brighter than its right neighbour, on a 9x8 thumbnail"""
+    pixels = list(gray.convert('L').resize((9, 8), Image.LANCZOS).tobytes())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def phash(gray: Image.Image) -> int:
+    """DCT hash: low-frequency coefficients of a 32x32 thumbnail against their median"""
+    pixels = list(gray.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS).tobytes())
+    rows = [pixels[i * _DCT_SIZE:(i + 1) * _DCT_SIZE] for i in range(_DCT_SIZE)]
+    # Separable 2D DCT, only the top-left 8x8 block
+    row_coeffs = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    coeffs = [
+        sum(_DCT_BASIS[v][y] * row_coeffs[y][u] for y in range(_DCT_SIZE))
+        for v in range(_DCT_KEEP) for u in range(_DCT_KEEP)
+    ]
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]  # The DC term only measures brightness
+    value = 0
+    for coeff in coeffs:
+        value = (value << 1) | (coeff > median)
+    return value
+
+
+def fingerprint(gray: Image.Image) -> Fingerprint:
+    return dhash(gray), phash(gray)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def content_key(image_data: bytes, text: Optional[str] = None) -> str:
+    """What a hash hit must also agree on: the literals read from the image, or its exact bytes"""
+    found = literals(text) if text else ()
+    if any(token[0].isdigit() for token in found):
+        return 'text:' + hashlib.sha256('\x1f'.join(found).encode('utf-8')).hexdigest()
+    return 'bytes:' + hashlib.sha256(image_data).hexdigest()
+
+
+def _bands(value: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+
+class ImageHashCache:
+    """Near-duplicate image -> solution lookups over the shared cache"""
+
+    def __init__(self, alias: Optional[str] = 'default', ttl: float = 7 * 24 * 3600,
+                 max_distance: int = 6, max_phash_distance: int = 10, bucket_size: int = 64):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS} for band lookups to find every match")
+        self.alias = alias
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_phash_distance = max_phash_distance
+        self.bucket_size = bucket_size
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+    @classmethod
+    def from_settings(cls) -> 'ImageHashCache':
+        enabled = getattr(settings, 'IMAGE_HASH_CACHE_ENABLED', True)
+        return cls(
+            alias=getattr(settings, 'IMAGE_HASH_CACHE_ALIAS', 'default') if enabled else None,
+            ttl=getattr(settings, 'IMAGE_HASH_CACHE_TTL', 7 * 24 * 3600),
+            max_distance=getattr(settings, 'IMAGE_HASH_MAX_DISTANCE', 6),
+            max_phash_distance=getattr(settings, 'IMAGE_HASH_MAX_PHASH_DISTANCE', 10),
+            bucket_size=getattr(settings, 'IMAGE_HASH_BUCKET_SIZE', 64),
+        )
+
+    def get(self, fp: Fingerprint, content: str) -> Optional[str]:
+        """Stored solution for the closest photo within both distance thresholds and with the same content key"""
+        if not self.alias:
+            return None
+        try:
+            cache = caches[self.alias]
+            buckets = cache.get_many(self._band_keys(fp[0]))
+            entry_keys = {key for keys in buckets.values() for key in keys}
+            entries = cache.get_many(list(entry_keys)) if entry_keys else {}
+        except Exception as e:
+            logger.warning(f"Image hash lookup failed: {str(e)}")
+            return None
+
+        best, best_distance = None, None
+        for entry in entries.values():
+            if entry.get('content') != content:
+                continue
+            d_distance = hamming(fp[0], entry['dhash'])
+            p_distance = hamming(fp[1], entry['phash'])
+            if d_distance <= self.max_distance and p_distance <= self.max_phash_distance:
+                if best_distance is None or d_distance + p_distance < best_distance:
+                    best, best_distance = entry, d_distance + p_distance
+
+        self._count('hits' if best else 'misses')
+        if best is None:
+            return None
+        logger.info(f"Image hash cache hit (distance {best_distance})")
+        return best['solution']
+
+    def set(self, fp: Fingerprint, content: str, solution: str):
+        """Store a solution and index it under each band of its dHash"""
+        if not self.alias or not solution:
+            return
+        entry_key = f"imghash:entry:{fp[0]:016x}{fp[1]:016x}:{content}"
+        try:
+            cache = caches[self.alias]
+            cache.set(entry_key, {'dhash': fp[0], 'phash': fp[1], 'content': content, 'solution': solution}, self.ttl)
+            band_keys = self._band_keys(fp[0])
+            buckets = cache.get_many(band_keys)
+            cache.set_many({
+                key: ([entry_key] + [k for k in buckets.get(key, []) if k != entry_key])[:self.bucket_size]
+                for key in band_keys
+            }, self.ttl)
+        except Exception as e:
+            logger.warning(f"Image hash store failed: {str(e)}")
+            return
+        self._count('stores')
+
+    async def aget(self, fp: Fingerprint, content: str) -> Optional[str]:
+        return await sync_to_async(self.get, thread_sensitive=False)(fp, content)
+
+    async def aset(self, fp: Fingerprint, content: str, solution: str):
+        await sync_to_async(self.set, thread_sensitive=False)(fp, content, solution)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _band_keys(value: int) -> List[str]:
+        return [f"imghash:band:{band}:{bits:02x}" for band, bits in enumerate(_bands(value))]
+
+
+image_hash_cache = ImageHashCache.from_settings()
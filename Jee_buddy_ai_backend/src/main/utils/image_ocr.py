@@ -0,0 +1,238 @@
+"""
+OCR-first reading of problem photos.
+
+Most uploads are printed problems that a local OCR engine reads perfectly
+well. When Tesseract reads the preprocessed image with enough confidence, the
+problem text is sent down the normal text path (cheaper models, answer cache,
+streaming); only images it can't read confidently go to the vision model.
+
+A reading is accepted when the mean word confidence reaches
+OCR_MIN_CONFIDENCE, every word with a digit in it reaches
+OCR_MIN_NUMERIC_CONFIDENCE (one misread number is a wrong answer however clean
+the rest is), there are at least OCR_MIN_WORDS words and the text isn't mostly
+stray symbols (handwriting and dense notation come out garbled).
+
+Tesseract reads a page as flat lines of text, so two-dimensional notation is
+lost: x² comes out as x2, a stacked fraction as two lines, √ as V. Readings
+with that kind of layout (raised or lowered words, a rule between two lines,
+radical/script glyphs) go to the vision model.
+
+pytesseract and the tesseract binary are optional; without them every image
+goes to the vision model as before. Tesseract runs as a subprocess, so a small
+thread pool (OCR_WORKERS) keeps it off the event loop and bounds how many run
+at once.
+"""
+import asyncio
+import io
+import logging
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from PIL import Image
+
+try:
+    import pytesseract
+except ImportError:  # Optional dependency
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+# Characters a printed physics/maths problem is made of; anything else suggests a bad read
+_EXPECTED = re.compile(r"[\w\s.,;:!?'\"()\[\]{}+\-*/=<>^%°√π±×÷|]")
+# Notation that only makes sense laid out in two dimensions; Tesseract reads √ as V
+_LAYOUT_GLYPHS = re.compile(r"[√∛∫∑∏⁄⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻₀₁₂₃₄₅₆₇₈₉]|\bV[\d(]")
+_RULE = re.compile(r"^[-_—–]{2,}$")
+
+
+@dataclass(frozen=True)
+class OcrResult:
+    text: str
+    confidence: float  # Mean word confidence, 0-100
+    words: int
+    numeric_confidence: float = 100.0  # Lowest confidence of a word containing a digit
+    math_layout: bool = False  # Scripts or fraction bars were found on the page
+
+
+@dataclass(frozen=True)
+class _Word:
+    text: str
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+
+def _scripted(lines: List[List[_Word]], height: float) -> bool:
+    """Whether a word sits clearly above or below the rest of its line (super/subscripts)"""
+    for words in lines:
+        if len(words) < 2:
+            continue
+        top = statistics.median(word.top for word in words)
+        bottom = statistics.median(word.bottom for word in words)
+        for word in words:
+            if word.top < top - 0.35 * height or word.bottom > bottom + 0.35 * height:
+                return True
+            if word.bottom - word.top < 0.6 * height and abs(
+                (word.top + word.bottom) / 2 - (top + bottom) / 2
+            ) > 0.25 * height:
+                return True
+    return False
+
+
+def _fraction_bar(gray: Image.Image, lines: List[List[_Word]], height: float) -> bool:
+    """Whether a thin horizontal rule separates two overlapping lines (a stacked fraction)"""
+    if any(_RULE.match(word.text) for words in lines for word in words):
+        return True
+    boxes = sorted(
+        ((min(w.left for w in words), min(w.top for w in words),
+          max(w.right for w in words), max(w.bottom for w in words)) for words in lines),
+        key=lambda box: box[1],
+    )
+    for upper, lower in zip(boxes, boxes[1:]):
+        left, right = max(upper[0], lower[0]), min(upper[2], lower[2])
+        if right - left < height or lower[1] - upper[3] < 2:
+            continue
+        band = gray.crop((left, upper[3] + 1, right, lower[1] - 1)).point(lambda p: 255 if p < 128 else 0)
+        ink = band.getbbox()
+        if ink and ink[3] - ink[1] <= max(2, 0.3 * height) and ink[2] - ink[0] >= height:
+            return True
+    return False
+
+
+class ImageTextReader:
+    """Tesseract in a worker pool, with acceptance thresholds and latency counters"""
+
+    def __init__(self, enabled: bool = True, min_confidence: float = 85.0, min_words: int = 4,
+                 timeout: float = 5.0, workers: int = 2, min_numeric_confidence: float = 85.0):
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.min_numeric_confidence = min_numeric_confidence
+        self.min_words = min_words
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr')
+        self._available: Optional[bool] = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._stats = {'accepted': 0, 'rejected': 0, 'failed': 0, 'confidence_total': 0.0}
+
+    @classmethod
+    def from_settings(cls) -> 'ImageTextReader':
+        return cls(
+            enabled=getattr(settings, 'OCR_FIRST_ENABLED', True),
+            min_confidence=getattr(settings, 'OCR_MIN_CONFIDENCE', 85.0),
+            min_words=getattr(settings, 'OCR_MIN_WORDS', 4),
+            timeout=getattr(settings, 'OCR_TIMEOUT', 5.0),
+            workers=getattr(settings, 'OCR_WORKERS', 2),
+            min_numeric_confidence=getattr(settings, 'OCR_MIN_NUMERIC_CONFIDENCE', 85.0),
+        )
+
+    @property
+    def available(self) -> bool:
+        """Whether OCR is enabled and an engine is installed (checked once)"""
+        if not self.enabled:
+            return False
+        if self._available is None:
+            self._available = self._find_engine()
+        return self._available
+
+    @staticmethod
+    def _find_engine() -> bool:
+        if pytesseract is None:
+            logger.info("OCR_FIRST_ENABLED is set but pytesseract is not installed, images go to vision")
+            return False
+        try:
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception as e:
+            logger.warning(f"Tesseract is not available, images go to vision: {str(e)}")
+            return False
+
+    async def read(self, image_data: bytes) -> Optional[OcrResult]:
+        """OCR an encoded image off the event loop; None if OCR is unavailable or fails"""
+        if not self.available:
+            return None
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, self._ocr, image_data)
+        except Exception as e:
+            logger.warning(f"OCR failed, using vision: {str(e)}")
+            self._record('failed', time.monotonic() - started)
+            return None
+        self._record('accepted' if self.accepts(result) else 'rejected', time.monotonic() - started, result)
+        return result
+
+    def accepts(self, result: Optional[OcrResult]) -> bool:
+        """Whether a reading is good enough to replace the image"""
+        if result is None or result.words < self.min_words or result.confidence < self.min_confidence:
+            return False
+        if result.numeric_confidence < self.min_numeric_confidence:
+            return False
+        if result.math_layout or _LAYOUT_GLYPHS.search(result.text):
+            return False
+        text = result.text.replace('\n', ' ')
+        return len(_EXPECTED.findall(text)) >= 0.95 * len(text)
+
+    def _ocr(self, image_data: bytes) -> OcrResult:
+        image = Image.open(io.BytesIO(image_data))
+        data = pytesseract.image_to_data(
+            image,
+            config='--psm 6',  # One uniform block of text
+            output_type=pytesseract.Output.DICT,
+            timeout=self.timeout,
+        )
+        lines, weighted, chars, numeric = {}, 0.0, 0, 100.0
+        for i, word in enumerate(data['text']):
+            word, confidence = word.strip(), float(data['conf'][i])
+            if not word or confidence < 0:
+                continue
+            left, top = data['left'][i], data['top'][i]
+            lines.setdefault((data['block_num'][i], data['par_num'][i], data['line_num'][i]), []).append(
+                _Word(word, left, top, left + data['width'][i], top + data['height'][i])
+            )
+            weighted += confidence * len(word)
+            chars += len(word)
+            if any(c.isdigit() for c in word):
+                numeric = min(numeric, confidence)
+        lines = list(lines.values())
+        text = '\n'.join(' '.join(word.text for word in words) for words in lines)
+
+        math_layout = False
+        if lines:
+            height = statistics.median(word.bottom - word.top for words in lines for word in words)
+            math_layout = _scripted(lines, height) or _fraction_bar(image.convert('L'), lines, height)
+        return OcrResult(
+            text, weighted / chars if chars else 0.0, sum(len(words) for words in lines), numeric, math_layout
+        )
+
+    def _record(self, outcome: str, latency: float, result: Optional[OcrResult] = None):
+        with self._lock:
+            self._stats[outcome] += 1
+            self._latencies.append(latency)
+            if result is not None:
+                self._stats['confidence_total'] += result.confidence
+        logger.info(f"OCR {outcome} in {latency * 1000:.0f}ms"
+                    + (f" (confidence {result.confidence:.0f}, {result.words} words)" if result else ""))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+        read = stats['accepted'] + stats['rejected']
+        confidence_total = stats.pop('confidence_total')
+        stats['avg_confidence'] = round(confidence_total / read, 1) if read else 0.0
+        stats['acceptance_ratio'] = stats['accepted'] / read if read else 0.0
+        if latencies:
+            stats['avg_latency_ms'] = round(1000 * sum(latencies) / len(latencies), 1)
+            stats['p95_latency_ms'] = round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1)
+        return stats
+
+
+image_text_reader = ImageTextReader.from_settings()
@@ -0,0 +1,95 @@
+"""
+An uploaded image carried through the solve path without copying it.
+
+The upload stays where Django put it: in memory for small files, in a
+temporary file on disk once it passes FILE_UPLOAD_MAX_MEMORY_SIZE. Nothing is
+read until preprocessing needs the pixels, and base64 only happens once, at the
+provider boundary, via to_data_url(). JSON clients that send base64 are decoded
+once to bytes on the way in.
+
+repr() only gives the size and type, so logging a context that holds an image
+never writes the payload to the logs.
+"""
+import base64
+import binascii
+import io
+import os
+from typing import BinaryIO, Optional
+
+from django.core.files.uploadedfile import UploadedFile
+
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    """Image bytes as a base64 data URL; build it once per provider request, not per attempt"""
+    encoded = bytearray(f"data:{mime_type};base64,".encode('ascii'))
+    encoded += base64.b64encode(data)
+    return encoded.decode('ascii')
+
+
+class ImagePayload:
+    """Raw image bytes, or an unread upload, plus its MIME type"""
+
+    __slots__ = ('_data', '_upload', 'size', 'content_type')
+
+    def __init__(self, data: Optional[bytes] = None, upload: Optional[UploadedFile] = None,
+                 content_type: str = ''):
+        self._data = data
+        self._upload = upload
+        self.size = len(data) if data is not None else (upload.size or 0)
+        self.content_type = content_type
+
+    @classmethod
+    def from_upload(cls, upload: UploadedFile) -> 'ImagePayload':
+        return cls(upload=upload, content_type=upload.content_type or '')
+
+    @classmethod
+    def from_base64(cls, encoded: str) -> 'ImagePayload':
+        """Decode a base64 (or data URL) image from a JSON body; raises ValueError if it isn't base64"""
+        content_type = ''
+        if encoded.startswith('data:'):
+            header, _, encoded = encoded.partition(',')
+            content_type = header[5:].split(';')[0]
+        try:
+            # Line-wrapped base64 is fine, but any other stray character is an error rather than dropped
+            return cls(data=base64.b64decode(''.join(encoded.split()), validate=True), content_type=content_type)
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f"Invalid base64 image: {e}") from e
+
+    @classmethod
+    def coerce(cls, image) -> Optional['ImagePayload']:
+        """Accept a payload, raw bytes or a base64 string"""
+        if not image or isinstance(image, ImagePayload):
+            return image or None
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return cls(data=bytes(image))
+        return cls.from_base64(image)
+
+    def open(self) -> BinaryIO:
+        """A readable file positioned at the start; the upload's own file when there is one"""
+        if self._data is not None:
+            return io.BytesIO(self._data)  # Shares the bytes, no copy until written
+        self._upload.seek(0)
+        return self._upload
+
+    def read(self) -> bytes:
+        """The whole image as bytes, read from the upload on first use (blocking I/O)"""
+        if self._data is None:
+            self._data = self.open().read()
+            self._upload = None
+        return self._data
+
+    @property
+    def path(self) -> Optional[str]:
+        """Filesystem path of a disk-backed upload, if any"""
+        temporary_path = getattr(self._upload, 'temporary_file_path', None)
+        return temporary_path() if temporary_path and self._data is None else None
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __repr__(self):
+        where = 'disk' if self.path and os.path.exists(self.path) else 'memory'
+        return f"<ImagePayload {self.size} bytes {self.content_type or 'image'} in {where}>"
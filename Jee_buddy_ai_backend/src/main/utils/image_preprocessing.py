@@ -0,0 +1,200 @@
+"""
+Shrink uploaded problem photos before they are sent to a vision model.
+
+Phones upload 4-12 MP JPEGs, but the vision model scales every image down to
+the resolution it reads at before it looks at it (for gpt-4-turbo and gpt-4o
+at high detail that is 2048 x 768). Anything past that only costs upload time
+and latency. The limits are kept per model in IMAGE_MODEL_SIZE_LIMITS, with
+IMAGE_MAX_LONG_SIDE x IMAGE_MAX_SHORT_SIDE for models not listed. Each image is:
+
+1. rotated upright from its EXIF orientation,
+2. reduced while decoding (JPEG draft mode),
+3. cropped to the written content plus a small margin,
+4. downscaled to the model's effective resolution,
+5. re-encoded as an optimized JPEG.
+
+Most uploads are black or blue ink on paper and are sent as grayscale. Colour
+carries meaning in some problems (colour-coded graphs, circuit diagrams, marked
+regions), so images whose chroma varies more than IMAGE_COLOR_CHROMA_THRESHOLD
+(standard deviation of the Cb/Cr channels) keep their colour.
+
+Pillow releases the GIL while decoding, resizing and encoding, so the work
+runs in a small thread pool rather than on the event loop.
+"""
+import asyncio
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+from django.conf import settings
+from PIL import Image, ImageOps, ImageStat, UnidentifiedImageError
+
+from main.utils.image_hash_cache import Fingerprint, fingerprint
+from main.utils.image_payload import ImagePayload, to_data_url
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+@dataclass(frozen=True, repr=False)
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    fingerprint: Optional[Fingerprint] = None  # Perceptual hashes of the normalized image
+
+    def data_url(self) -> str:
+        return to_data_url(self.data, self.mime_type)
+
+    def __repr__(self):
+        return f"<PreparedImage {len(self.data)} bytes {self.mime_type} {self.width}x{self.height}>"
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def size_limits(model: Optional[str] = None) -> Tuple[int, int]:
+    """(long side, short side) the model reads images at"""
+    limits = _setting('IMAGE_MODEL_SIZE_LIMITS', {}).get(model)
+    if limits:
+        return limits
+    return _setting('IMAGE_MAX_LONG_SIDE', 2048), _setting('IMAGE_MAX_SHORT_SIDE', 768)
+
+
+def is_colorful(image: Image.Image) -> bool:
+    """Whether colour varies enough across the image to carry information"""
+    if image.mode not in ('RGB', 'RGBA', 'P', 'CMYK', 'YCbCr'):
+        return False
+    small = image.convert('RGB')
+    small.thumbnail((128, 128))
+    _, cb, cr = ImageStat.Stat(small.convert('YCbCr')).stddev
+    return max(cb, cr) > _setting('IMAGE_COLOR_CHROMA_THRESHOLD', 12.0)
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    """Composite a transparent image onto white; convert() would drop alpha and leave the background black"""
+    if image.mode not in ('RGBA', 'LA', 'PA', 'RGBa', 'La') and 'transparency' not in image.info:
+        return image
+    paper = Image.new('RGBA', image.size, 'white')
+    paper.alpha_composite(image.convert('RGBA'))
+    return paper.convert('RGB')
+
+
+def sniff_mime_type(data: bytes) -> str:
+    """MIME type of an encoded image from its magic bytes, PNG when unknown"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'image/png'
+
+
+def _original(data: bytes, fp: Optional[Fingerprint] = None) -> PreparedImage:
+    return PreparedImage(data, sniff_mime_type(data), 0, 0, fp)
+
+
+def _content_box(gray: Image.Image, margin: int):
+    """Bounding box of the ink on the page, or None when it is blank or nearly full-frame"""
+    # Ink is anything clearly darker than the paper; the histogram's brightest busy level is the paper
+    small = gray.copy()
+    small.thumbnail((256, 256))
+    histogram = small.histogram()
+    paper = max(range(256), key=lambda level: histogram[level] if level > 96 else -1)
+    threshold = max(0, paper - 60)
+    box = small.point(lambda p: 255 if p < threshold else 0).getbbox()
+    if not box:
+        return None
+
+    scale_x, scale_y = gray.width / small.width, gray.height / small.height
+    left, top, right, bottom = box
+    box = (
+        max(0, int(left * scale_x) - margin),
+        max(0, int(top * scale_y) - margin),
+        min(gray.width, int(right * scale_x) + margin),
+        min(gray.height, int(bottom * scale_y) + margin),
+    )
+    # Not worth a copy when the content fills almost the whole frame
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.9 * gray.width * gray.height:
+        return None
+    return box
+
+
+def preprocess_image(image: Union[bytes, ImagePayload], model: Optional[str] = None) -> PreparedImage:
+    """Orient, crop, downscale and re-encode an image for `model`; raises ValueError if it can't be decoded"""
+    source = image.open() if isinstance(image, ImagePayload) else io.BytesIO(image)
+    max_long, max_short = size_limits(model)
+
+    try:
+        image = Image.open(source)
+        # Let the JPEG decoder do most of the downscaling (1/2, 1/4, 1/8) for free
+        image.draft('RGB', (max_long, max_long))
+        image = flatten(ImageOps.exif_transpose(image))
+        gray = image.convert('L')
+        image = image.convert('RGB') if is_colorful(image) else gray
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image file: {e}") from e
+
+    if _setting('IMAGE_CROP_TO_CONTENT', True):
+        box = _content_box(gray, margin=max(8, min(gray.size) // 40))
+        if box:
+            image = image.crop(box)
+            gray = image if image.mode == 'L' else gray.crop(box)
+
+    long_side, short_side = max(image.size), min(image.size)
+    scale = min(1.0, max_long / long_side, max_short / short_side)
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+        gray = image if image.mode == 'L' else image.convert('L')
+
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=_setting('IMAGE_JPEG_QUALITY', 85), optimize=True)
+    return PreparedImage(out.getvalue(), 'image/jpeg', image.width, image.height, fingerprint(gray))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_setting('IMAGE_PREPROCESS_WORKERS', 2),
+                thread_name_prefix='image-preprocess',
+            )
+        return _executor
+
+
+def _prepare(image: ImagePayload, model: Optional[str] = None) -> PreparedImage:
+    """The preprocessed image, or the original bytes if preprocessing fails or doesn't help"""
+    if _setting('IMAGE_PREPROCESSING_ENABLED', True):
+        try:
+            prepared = preprocess_image(image, model)
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, sending the original: {str(e)}")
+        else:
+            if len(prepared.data) < image.size:
+                logger.info(
+                    f"Preprocessed image {image.size // 1024} KB -> {len(prepared.data) // 1024} KB "
+                    f"({prepared.width}x{prepared.height})"
+                )
+                return prepared
+            return _original(image.read(), prepared.fingerprint)
+    return _original(image.read())
+
+
+async def prepare_image(image: Union[bytes, ImagePayload, PreparedImage],
+                        model: Optional[str] = None) -> PreparedImage:
+    """Preprocess for `model` off the event loop; reading a disk-backed upload happens in the pool too"""
+    if isinstance(image, PreparedImage):
+        return image  # Already prepared earlier in the request
+    image = ImagePayload.coerce(image)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _prepare, image, model)
@@ -0,0 +1,131 @@
+"""
+Process-wide registry of pooled LLM provider clients.
+
+Building a Groq/OpenAI client per request pays for a TLS handshake and a fresh
+connection pool every time. Clients here are created lazily, once per provider,
+and share a keep-alive httpx pool configured from settings.
+
+Sync clients are shared by every thread in the process. Async clients are bound
+to the event loop that created them (httpx pools can't move between loops), so
+they are cached per running loop - under ASGI that is one pool per worker.
+
+SDK-level retries are off and the default timeouts are LLM_CONNECT_TIMEOUT to
+connect and LLM_READ_TIMEOUT between bytes: callers pass per-call timeouts and
+retry through main/utils/deadlines.py, so a hung upstream can't outlive the
+request budget.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Dict
+
+import httpx
+from django.conf import settings
+from groq import AsyncGroq, Groq
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {
+    'groq': {
+        'api_key_env': 'GROQ_DEEPSEEK_API_KEY',
+        'sync': Groq,
+        'async': AsyncGroq,
+    },
+    'openai': {
+        'api_key_env': 'OPENAI_API_KEY',
+        'sync': OpenAI,
+        'async': AsyncOpenAI,
+    },
+}
+
+_lock = threading.Lock()
+_sync_clients: Dict[str, Any] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _use_http2() -> bool:
+    """HTTP/2 needs the optional `h2` package, fall back to HTTP/1.1 keep-alive without it"""
+    if not getattr(settings, 'LLM_HTTP2', True):
+        return False
+    if importlib.util.find_spec('h2') is None:
+        logger.warning("LLM_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _pool_options() -> Dict[str, Any]:
+    """httpx client options shared by every provider"""
+    return {
+        'limits': httpx.Limits(
+            max_connections=getattr(settings, 'LLM_POOL_MAX_CONNECTIONS', 100),
+            max_keepalive_connections=getattr(settings, 'LLM_POOL_MAX_KEEPALIVE', 20),
+            keepalive_expiry=getattr(settings, 'LLM_POOL_IDLE_TIMEOUT', 60.0),
+        ),
+        'http2': _use_http2(),
+    }
+
+
+def _sdk_options() -> Dict[str, Any]:
+    """Timeout and retry options shared by every provider SDK client"""
+    return {
+        'timeout': httpx.Timeout(
+            getattr(settings, 'LLM_READ_TIMEOUT', 20.0),
+            connect=getattr(settings, 'LLM_CONNECT_TIMEOUT', 5.0),
+        ),
+        'max_retries': 0,
+    }
+
+
+def _build_client(provider: str, is_async: bool):
+    """Create a provider SDK client on top of a pooled httpx client"""
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+
+    config = PROVIDERS[provider]
+    api_key = os.getenv(config['api_key_env'])
+    if not api_key:
+        raise ValueError(f"{config['api_key_env']} environment variable is not set")
+
+    if is_async:
+        http_client = httpx.AsyncClient(**_pool_options())
+        client = config['async'](api_key=api_key, http_client=http_client, **_sdk_options())
+    else:
+        http_client = httpx.Client(**_pool_options())
+        client = config['sync'](api_key=api_key, http_client=http_client, **_sdk_options())
+
+    logger.info(f"Created pooled {'async' if is_async else 'sync'} {provider} client")
+    return client
+
+
+def get_client(provider: str):
+    """Shared synchronous client for a provider"""
+    client = _sync_clients.get(provider)
+    if client is None:
+        with _lock:
+            client = _sync_clients.get(provider)
+            if client is None:
+                client = _sync_clients[provider] = _build_client(provider, is_async=False)
+    return client
+
+
+def get_async_client(provider: str):
+    """Shared async client for a provider, bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(provider)
+        if client is None:
+            client = clients[provider] = _build_client(provider, is_async=True)
+    return client
+
+
+def close_clients():
+    """Close the shared sync clients, e.g. on worker shutdown"""
+    with _lock:
+        for client in _sync_clients.values():
+            client.close()
+        _sync_clients.clear()
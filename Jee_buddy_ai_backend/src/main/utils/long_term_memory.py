@@ -0,0 +1,181 @@
+"""
+Long-term memory for the math agent.
+
+Writes go on a bounded queue drained by a background thread, so a request
+never waits on mem0. Reads are a top-k relevance search over the current
+question, trimmed to a token budget and cached per user until that user's
+next write lands (or the TTL runs out).
+
+The storage backend is swappable: `Mem0Backend` talks to the hosted mem0 API,
+`LocalMemoryBackend` keeps everything in process for tests and local runs.
+"""
+import logging
+import os
+import queue
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TOKENS_PER_75_WORDS = 100  # Same ratio as MathTokenLimitAgent
+_QUERIES_PER_USER = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (100 tokens ≈ 75 words)"""
+    return max((len(text.split()) * TOKENS_PER_75_WORDS) // 75, 1)
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class Mem0Backend:
+    """Hosted mem0 store; the client is created on first use"""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv('LONG_TERM_MEMORY_API_KEY')
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from mem0 import MemoryClient
+                    self._client = MemoryClient(api_key=self.api_key)
+        return self._client
+
+    def add(self, user_id: str, messages: List[Dict[str, str]]):
+        self.client.add(messages, user_id=user_id)
+
+    def search(self, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        response = self.client.search(query, filters={"user_id": user_id}, top_k=limit)
+        # mem0 returns either a bare list or {"results": [...]} depending on API version
+        results = response.get('results', []) if isinstance(response, dict) else response
+        return [r for r in results if isinstance(r, dict) and r.get('memory')][:limit]
+
+
+class LocalMemoryBackend:
+    """In-process stand-in for mem0, ranking memories by word overlap with the query"""
+
+    def __init__(self):
+        self._memories: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id: str, messages: List[Dict[str, str]]):
+        with self._lock:
+            self._memories.setdefault(user_id, []).extend(m['content'] for m in messages if m.get('content'))
+
+    def search(self, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        query_words = _words(query)
+        with self._lock:
+            memories = list(self._memories.get(user_id, []))
+        scored = []
+        for memory in memories:
+            memory_words = _words(memory)
+            overlap = len(query_words & memory_words)
+            if overlap:
+                scored.append({"memory": memory, "score": overlap / len(query_words | memory_words)})
+        scored.sort(key=lambda r: r['score'], reverse=True)
+        return scored[:limit]
+
+
+class LongTermMemory:
+    """Queued writes and cached, budgeted relevance search over a memory backend"""
+
+    def __init__(self, backend, top_k: int = 5, token_budget: int = 400, cache_ttl: float = 300.0,
+                 max_cached_users: int = 10000, queue_size: int = 1000):
+        self.backend = backend
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self._cache = TTLCache(maxsize=max_cached_users, ttl=cache_ttl)
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'LongTermMemory':
+        backend_name = getattr(settings, 'LONG_TERM_MEMORY_BACKEND', 'mem0')
+        backend = LocalMemoryBackend() if backend_name == 'local' else Mem0Backend()
+        return cls(
+            backend,
+            top_k=getattr(settings, 'LONG_TERM_MEMORY_TOP_K', 5),
+            token_budget=getattr(settings, 'LONG_TERM_MEMORY_TOKEN_BUDGET', 400),
+            cache_ttl=getattr(settings, 'LONG_TERM_MEMORY_CACHE_TTL', 300.0),
+        )
+
+    def remember(self, user_id: Optional[str], messages: List[Dict[str, str]]):
+        """Queue messages for storage and return immediately"""
+        if not user_id or not messages:
+            return
+        try:
+            self._queue.put_nowait((user_id, messages))
+        except queue.Full:
+            logger.warning(f"Memory write queue full, dropping write for user {user_id}")
+            return
+        self._ensure_worker()
+
+    async def recall(self, user_id: Optional[str], query: str) -> List[str]:
+        """Most relevant memories for the query, within the token budget"""
+        if not user_id or not query:
+            return []
+
+        with self._cache_lock:
+            cached = self._cache.get(user_id, {}).get(query)
+        if cached is not None:
+            return cached
+
+        try:
+            results = await sync_to_async(self.backend.search, thread_sensitive=False)(user_id, query, self.top_k)
+        except Exception as e:
+            logger.warning(f"Error retrieving from long-term memory: {str(e)}")
+            return []
+
+        memories, used = [], 0
+        for result in results:
+            cost = estimate_tokens(result['memory'])
+            if used + cost > self.token_budget:
+                break
+            memories.append(result['memory'])
+            used += cost
+
+        with self._cache_lock:
+            per_user = self._cache.get(user_id, {})
+            if len(per_user) >= _QUERIES_PER_USER:
+                per_user.pop(next(iter(per_user)))
+            per_user[query] = memories
+            self._cache[user_id] = per_user
+        return memories
+
+    def invalidate(self, user_id: str):
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+
+    def drain(self):
+        """Block until every queued write has been handled"""
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name='long-term-memory', daemon=True)
+                self._worker.start()
+
+    def _run_worker(self):
+        while True:
+            user_id, messages = self._queue.get()
+            try:
+                self.backend.add(user_id, messages)
+                self.invalidate(user_id)
+            except Exception as e:
+                logger.warning(f"Error storing long-term memory: {str(e)}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,38 @@
+"""
+Keyset cursors for chat history.
+
+A cursor is the (timestamp, id) of the last row a client has seen, encoded
+as an opaque URL-safe string. The next page is every row strictly older
+than it, which the (user_id, timestamp, id) index can serve without OFFSET.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.db.models import Q
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """(timestamp, id) from a cursor; raises ValueError if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def older_than(cursor: Optional[Tuple[datetime, int]]) -> Q:
+    """Filter for rows strictly before the cursor in (timestamp, id) order"""
+    if cursor is None:
+        return Q()
+    timestamp, row_id = cursor
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=row_id)
@@ -0,0 +1,81 @@
+"""
+Cache for Supabase `profiles` rows.
+
+Lookups go through a short-lived per-process LRU, then an optional shared
+Django cache (PROFILE_CACHE_ALIAS, loaded with single-flight locking), then
+the database. Writers that change
+current_session_id, payment_status or total_tokens call invalidate() so the
+next read goes back to the database; other workers' local copies expire
+within PROFILE_CACHE_LOCAL_TTL.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from main.utils.shared_cache import cache_delete, get_or_compute
+
+logger = logging.getLogger(__name__)
+
+# Columns profiles are looked up by; get_current_profile uses uuid, the token agent uses id
+LOOKUP_COLUMNS = ('id', 'uuid')
+
+
+class ProfileCache:
+    """Two-tier (local LRU/TTL + optional shared) cache of profile rows"""
+
+    def __init__(self, local_ttl: float = 5.0, shared_ttl: float = 60.0, max_entries: int = 10000,
+                 shared_alias: Optional[str] = None):
+        self.shared_ttl = shared_ttl
+        self.shared_alias = shared_alias
+        self._local = TTLCache(maxsize=max_entries, ttl=local_ttl)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'ProfileCache':
+        return cls(
+            local_ttl=getattr(settings, 'PROFILE_CACHE_LOCAL_TTL', 5.0),
+            shared_ttl=getattr(settings, 'PROFILE_CACHE_SHARED_TTL', 60.0),
+            shared_alias=getattr(settings, 'PROFILE_CACHE_ALIAS', None),
+        )
+
+    def get(self, user_id: str, load_profile: Callable[[str], Optional[dict]], lookup: str = 'id') -> Optional[dict]:
+        """Profile for user_id, loading it with load_profile on a miss (misses are not cached)"""
+        key = self._key(lookup, user_id)
+        with self._lock:
+            profile = self._local.get(key)
+        if profile is not None:
+            return dict(profile)
+
+        if self.shared_alias:
+            profile = get_or_compute(key, lambda: load_profile(user_id), self.shared_ttl, self.shared_alias)
+        else:
+            profile = load_profile(user_id)
+        if profile is None:
+            return None
+
+        with self._lock:
+            self._local[key] = profile
+        return dict(profile)
+
+    def invalidate(self, user_id: str):
+        """Forget a user's profile in both tiers"""
+        keys = [self._key(lookup, user_id) for lookup in LOOKUP_COLUMNS]
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        if self.shared_alias:
+            cache_delete(*keys, alias=self.shared_alias)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    @staticmethod
+    def _key(lookup: str, user_id: str) -> str:
+        return f"profile:{lookup}:{user_id}"
+
+
+profile_cache = ProfileCache.from_settings()
@@ -0,0 +1,262 @@
+"""
+Routing of LLM calls across providers/models.
+
+Each route ("groq:llama3-70b-8192", "openai:gpt-3.5-turbo-16k", ...) keeps a
+rolling window of recent call latencies and outcomes. A route whose error rate
+over the window crosses LLM_BREAKER_ERROR_RATE has its circuit opened: it is
+skipped for LLM_BREAKER_COOLDOWN seconds, then a single probe call decides
+whether it closes again.
+
+Calls go to healthy routes in preference order. Without hedging the next route
+is tried only after a failure; with LLM_HEDGE_ENABLED the next route is also
+started once the current one has run longer than its own p95 latency (clamped
+to LLM_HEDGE_MIN_DELAY..LLM_HEDGE_MAX_DELAY), the first success wins and the
+loser is cancelled.
+
+Streams fail over the same way, but only until their first item has been sent.
+Candidates are plain coroutine/iterator factories, so the decision logic runs
+the same against fake providers in tests.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from main.utils.deadlines import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+@dataclass
+class Candidate:
+    """One way to serve a call: a route name and a factory for the attempt"""
+    name: str
+    call: Callable[[], Any]  # Returns an awaitable for call(), an async iterator for stream()
+
+
+class AllProvidersFailed(ValueError):
+    """Every candidate route failed (or was unavailable) for a call"""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        details = ", ".join(f"{name} error: {error}" for name, error in errors.items())
+        super().__init__(f"API calls failed. {details}")
+
+
+class RouteHealth:
+    """Rolling latency/error window and circuit breaker for one route"""
+
+    def __init__(self, window: int = 50, error_rate: float = 0.5, min_samples: int = 5,
+                 cooldown: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.error_rate_threshold = error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._clock = clock
+        self._samples = deque(maxlen=window)  # (latency, ok)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def acquire(self) -> bool:
+        """Whether a call may go to this route now; half-open routes admit one probe at a time"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self._clock() - self._opened_at < self.cooldown:
+                return False
+            if self._probing:
+                return False
+            self._state, self._probing = HALF_OPEN, True
+            return True
+
+    def release(self):
+        """Give back a probe slot without recording an outcome (the attempt was cancelled)"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self._state = CLOSED
+                    self._samples.clear()
+                    self._samples.append((latency, ok))
+                else:
+                    self._trip()
+            elif self._state == CLOSED and self._should_trip():
+                self._trip()
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._error_rate()
+
+    def p95(self) -> Optional[float]:
+        """95th percentile latency of successful calls in the window, None without data"""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'state': self.state, 'error_rate': self.error_rate(), 'p95': self.p95(), 'samples': len(self._samples)}
+
+    def _error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def _should_trip(self) -> bool:
+        return len(self._samples) >= self.min_samples and self._error_rate() >= self.error_rate_threshold
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        logger.warning(f"Circuit opened after error rate {self._error_rate():.2f}")
+
+
+class ProviderRouter:
+    """Latency-aware failover with circuit breakers and optional hedging"""
+
+    def __init__(self, hedge: bool = False, hedge_min_delay: float = 1.0, hedge_max_delay: float = 10.0,
+                 clock: Callable[[], float] = time.monotonic, **health_options):
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self._clock = clock
+        self._health_options = {'clock': clock, **health_options}
+        self._routes: Dict[str, RouteHealth] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'ProviderRouter':
+        return cls(
+            hedge=getattr(settings, 'LLM_HEDGE_ENABLED', False),
+            hedge_min_delay=getattr(settings, 'LLM_HEDGE_MIN_DELAY', 1.0),
+            hedge_max_delay=getattr(settings, 'LLM_HEDGE_MAX_DELAY', 10.0),
+            window=getattr(settings, 'LLM_ROUTER_WINDOW', 50),
+            error_rate=getattr(settings, 'LLM_BREAKER_ERROR_RATE', 0.5),
+            min_samples=getattr(settings, 'LLM_BREAKER_MIN_SAMPLES', 5),
+            cooldown=getattr(settings, 'LLM_BREAKER_COOLDOWN', 30.0),
+        )
+
+    def health(self, name: str) -> RouteHealth:
+        route = self._routes.get(name)
+        if route is None:
+            with self._lock:
+                route = self._routes.setdefault(name, RouteHealth(**self._health_options))
+        return route
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: route.snapshot() for name, route in self._routes.items()}
+
+    def hedge_delay(self, name: str) -> float:
+        """How long to wait on a route before starting the next one"""
+        p95 = self.health(name).p95()
+        if p95 is None:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p95))
+
+    async def call(self, candidates: List[Candidate]) -> Any:
+        """Result of the first candidate to succeed; raises AllProvidersFailed"""
+        errors: Dict[str, BaseException] = {}
+        pending: Dict[asyncio.Future, Candidate] = {}
+        remaining = list(candidates)
+
+        def launch() -> Optional[Candidate]:
+            while remaining:
+                candidate = remaining.pop(0)
+                if self.health(candidate.name).acquire():
+                    pending[asyncio.ensure_future(self._attempt(candidate))] = candidate
+                    return candidate
+                errors[candidate.name] = RuntimeError("circuit open")
+            return None
+
+        current = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(current.name) if self.hedge and remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging {current.name} after {timeout:.2f}s")
+                    current = launch() or current
+                    continue
+                for task in done:
+                    candidate = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    if isinstance(task.exception(), DeadlineExceeded):
+                        raise task.exception()  # No time left for a fallback either
+                    errors[candidate.name] = task.exception()
+                    logger.warning(f"{candidate.name} failed: {str(task.exception())}")
+                if not pending:
+                    current = launch() or current
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise AllProvidersFailed(errors)
+
+    async def stream(self, candidates: List[Candidate]) -> AsyncIterator[Any]:
+        """Items from the first candidate stream to succeed; no failover once output was sent"""
+        errors: Dict[str, BaseException] = {}
+        for candidate in candidates:
+            health = self.health(candidate.name)
+            if not health.acquire():
+                errors[candidate.name] = RuntimeError("circuit open")
+                continue
+            started, sent = self._clock(), False
+            try:
+                async for item in candidate.call():
+                    sent = True
+                    yield item
+            except (asyncio.CancelledError, GeneratorExit, DeadlineExceeded):
+                health.release()
+                raise
+            except Exception as e:
+                health.record(self._clock() - started, False)
+                # Once output has reached the caller a fallback would duplicate it
+                if sent:
+                    raise
+                errors[candidate.name] = e
+                logger.warning(f"{candidate.name} stream failed: {str(e)}")
+                continue
+            health.record(self._clock() - started, True)
+            return
+
+        raise AllProvidersFailed(errors)
+
+    async def _attempt(self, candidate: Candidate) -> Any:
+        health = self.health(candidate.name)
+        started = self._clock()
+        try:
+            result = await candidate.call()
+        except (asyncio.CancelledError, DeadlineExceeded):
+            health.release()  # Lost a hedge race, the caller went away or ran out of time; not a provider failure
+            raise
+        except Exception:
+            health.record(self._clock() - started, False)
+            raise
+        health.record(self._clock() - started, True)
+        return result
+
+
+provider_router = ProviderRouter.from_settings()
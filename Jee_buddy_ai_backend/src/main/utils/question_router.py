@@ -0,0 +1,246 @@
+"""
+Cheap-model routing for solve requests.
+
+A local, rule-based classifier looks at the normalized question before any
+provider call:
+
+- formula: a short "what is the formula of X" lookup that the local formula
+  index can answer outright, with no provider call at all;
+- small: other short definitional/lookup questions, sent to SMALL_QUESTION_MODEL;
+- standard / deep: everything else, and every deep-think request, sent to the
+  70B models as before.
+
+Image requests are counted as vision, or as ocr when their text was read
+locally and sent down the text path (main/utils/image_ocr.py), so the two
+paths' latency and cost can be compared.
+
+Only the default solve interaction is routed locally: explain, test, similar
+and the other modes ask for a worked explanation, a mini-test or examples,
+which neither a formula index entry nor the small model provides. Anything
+with selected text, an image, numbers to work with or a problem verb (solve,
+prove, find, ...) is never downgraded either. Per-route counters (requests,
+latency, tokens, estimated cost) are kept in process and logged.
+"""
+import logging
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from main.utils.answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+FORMULA, SMALL, STANDARD, DEEP = 'formula', 'small', 'standard', 'deep'
+VISION, OCR = 'vision', 'ocr'  # Image requests, see MathAgent._route
+
+# Approximate list prices in USD per 1M tokens (input, output)
+MODEL_PRICES = {
+    'llama-3.1-8b-instant': (0.05, 0.08),
+    'llama3-70b-8192': (0.59, 0.79),
+    'deepseek-r1-distill-llama-70b': (0.75, 0.99),
+    'gpt-3.5-turbo-16k': (3.0, 4.0),
+    'gpt-4': (30.0, 60.0),
+    'gpt-4-turbo': (10.0, 30.0),
+}
+
+_LOOKUP_START = re.compile(r"^(what is|what's|what are|define|state|write|give|tell me|name)\b")
+_LOOKUP_NOUN = re.compile(
+    r"\b(formula|formulae|formulas|equation|expression|relation|law|definition|meaning|"
+    r"si unit|unit|units|dimension|dimensions|dimensional formula|value|symbol|statement)\b"
+)
+_FORMULA_NOUN = re.compile(r"\b(formula|formulae|formulas|equation|expression|relation|law)\b")
+_HARD = re.compile(
+    r"\b(solve|prove|show that|derive|derivation|find|calculate|compute|evaluate|integrate|"
+    r"differentiate|simplify|determine|how many|how much|minimum|maximum|if|when|why|compare|difference)\b"
+)
+_ARITHMETIC = re.compile(r"\d\s*[-+*/^=]|[-+*/^=]\s*\d|=")
+_FORMULA_SUBJECT = re.compile(
+    r"^(what is|what's|what are|state|write|give|tell me)\s+(the\s+)?"
+    r"(formula|formulae|formulas|equation|expression|relation)\s+(of|for)\s+(?P<subject>.+)$"
+)
+_ARTICLES = re.compile(r"\b(the|a|an)\b")
+_ROUTABLE_INTERACTIONS = ('solve', '')
+
+# (formula, explanation) keyed by concept; aliases map onto the same entry
+FORMULA_INDEX = {
+    'kinetic energy': ('KE = ½mv²', 'm = mass (kg), v = speed (m/s). SI unit: joule (J).'),
+    'potential energy': ('U = mgh', 'near the Earth\'s surface; m = mass, g ≈ 9.8 m/s², h = height.'),
+    'momentum': ('p = mv', 'm = mass (kg), v = velocity (m/s). SI unit: kg·m/s.'),
+    'force': ('F = ma', 'Newton\'s second law; m = mass (kg), a = acceleration (m/s²). SI unit: newton (N).'),
+    'work': ('W = F·d·cos θ', 'F = force, d = displacement, θ = angle between them. SI unit: joule (J).'),
+    'power': ('P = W/t = F·v', 'W = work done, t = time. SI unit: watt (W).'),
+    'density': ('ρ = m/V', 'm = mass, V = volume. SI unit: kg/m³.'),
+    'pressure': ('P = F/A', 'F = normal force, A = area. SI unit: pascal (Pa).'),
+    'acceleration': ('a = Δv/Δt', 'change in velocity over time. SI unit: m/s².'),
+    'centripetal force': ('F = mv²/r', 'm = mass, v = speed, r = radius of the circle.'),
+    'centripetal acceleration': ('a = v²/r = ω²r', 'v = speed, ω = angular speed, r = radius.'),
+    'newton\'s law of gravitation': ('F = Gm₁m₂/r²', 'G = 6.674 × 10⁻¹¹ N·m²/kg².'),
+    'coulomb\'s law': ('F = kq₁q₂/r²', 'k = 1/(4πε₀) ≈ 9 × 10⁹ N·m²/C².'),
+    'ohm\'s law': ('V = IR', 'V = potential difference (V), I = current (A), R = resistance (Ω).'),
+    'electric power': ('P = VI = I²R = V²/R', 'SI unit: watt (W).'),
+    'ideal gas equation': ('PV = nRT', 'R = 8.314 J/(mol·K), T in kelvin.'),
+    'wave speed': ('v = fλ', 'f = frequency (Hz), λ = wavelength (m).'),
+    'energy of a photon': ('E = hν = hc/λ', 'h = 6.626 × 10⁻³⁴ J·s.'),
+    'mass energy equivalence': ('E = mc²', 'c = 3 × 10⁸ m/s.'),
+    'de broglie wavelength': ('λ = h/p = h/(mv)', 'h = Planck\'s constant, p = momentum.'),
+    'time period of a simple pendulum': ('T = 2π√(l/g)', 'l = length, g = acceleration due to gravity.'),
+    'quadratic formula': ('x = (−b ± √(b² − 4ac)) / 2a', 'roots of ax² + bx + c = 0, a ≠ 0.'),
+    'area of a circle': ('A = πr²', 'r = radius.'),
+    'circumference of a circle': ('C = 2πr', 'r = radius.'),
+    'volume of a sphere': ('V = (4/3)πr³', 'r = radius.'),
+    'surface area of a sphere': ('A = 4πr²', 'r = radius.'),
+    'volume of a cylinder': ('V = πr²h', 'r = radius, h = height.'),
+    'pythagoras theorem': ('a² + b² = c²', 'c = hypotenuse of a right triangle.'),
+    'nth term of an ap': ('aₙ = a + (n − 1)d', 'a = first term, d = common difference.'),
+    'sum of an ap': ('Sₙ = n/2 · [2a + (n − 1)d]', 'a = first term, d = common difference.'),
+    'nth term of a gp': ('aₙ = arⁿ⁻¹', 'a = first term, r = common ratio.'),
+    'sum of a gp': ('Sₙ = a(rⁿ − 1)/(r − 1)', 'r ≠ 1; for |r| < 1 the infinite sum is a/(1 − r).'),
+    'distance formula': ('d = √((x₂ − x₁)² + (y₂ − y₁)²)', 'distance between (x₁, y₁) and (x₂, y₂).'),
+    'slope of a line': ('m = (y₂ − y₁)/(x₂ − x₁)', 'through (x₁, y₁) and (x₂, y₂).'),
+    'molarity': ('M = n/V', 'n = moles of solute, V = volume of solution in litres.'),
+    'number of moles': ('n = m/M', 'm = mass (g), M = molar mass (g/mol).'),
+    'ph': ('pH = −log₁₀[H⁺]', '[H⁺] in mol/L.'),
+}
+FORMULA_ALIASES = {
+    'ke': 'kinetic energy',
+    'gravitational potential energy': 'potential energy',
+    'linear momentum': 'momentum',
+    'newton\'s second law': 'force',
+    'universal law of gravitation': 'newton\'s law of gravitation',
+    'gravitational force': 'newton\'s law of gravitation',
+    'electrostatic force': 'coulomb\'s law',
+    'ideal gas law': 'ideal gas equation',
+    'photon energy': 'energy of a photon',
+    'simple pendulum': 'time period of a simple pendulum',
+    'time period of simple pendulum': 'time period of a simple pendulum',
+    'roots of a quadratic equation': 'quadratic formula',
+    'pythagorean theorem': 'pythagoras theorem',
+    'nth term of an arithmetic progression': 'nth term of an ap',
+    'sum of an arithmetic progression': 'sum of an ap',
+    'sum of n terms of an ap': 'sum of an ap',
+    'nth term of a geometric progression': 'nth term of a gp',
+    'sum of a geometric progression': 'sum of a gp',
+    'sum of n terms of a gp': 'sum of a gp',
+    'moles': 'number of moles',
+    'ph value': 'ph',
+}
+
+
+def _concept_key(text: str) -> str:
+    text = text.replace('’', "'")
+    return re.sub(r'\s+', ' ', _ARTICLES.sub(' ', text)).strip(" ?.!'")
+
+
+_INDEX = {_concept_key(name): name for name in FORMULA_INDEX}
+_INDEX.update({_concept_key(alias): name for alias, name in FORMULA_ALIASES.items()})
+
+
+def lookup_formula(question: str) -> Optional[str]:
+    """Answer from the local formula index, or None if the question isn't a plain formula lookup"""
+    normalized = normalize_question(question)
+    match = _FORMULA_SUBJECT.match(normalized)
+    subject = match.group('subject') if match else normalized
+    name = _INDEX.get(_concept_key(subject))
+    if name is None and match is None and _FORMULA_NOUN.search(normalized):
+        # "what is ohm's law", "state coulomb's law"
+        name = _INDEX.get(_concept_key(re.sub(_LOOKUP_START, '', normalized)))
+    if name is None:
+        return None
+    formula, explanation = FORMULA_INDEX[name]
+    return f"**{name[0].upper()}{name[1:]}:** {formula}\n\nwhere {explanation}"
+
+
+class _RouteCounters:
+    __slots__ = ('requests', 'latency_total', 'latencies', 'prompt_tokens', 'completion_tokens', 'cost')
+
+    def __init__(self):
+        self.requests = 0
+        self.latency_total = 0.0
+        self.latencies = deque(maxlen=200)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+
+class QuestionRouter:
+    """Classifies questions into routes and keeps per-route latency/cost counters"""
+
+    def __init__(self, enabled: bool = True, small_model: str = 'llama-3.1-8b-instant', max_simple_words: int = 14):
+        self.enabled = enabled
+        self.small_model = small_model
+        self.max_simple_words = max_simple_words
+        self._counters: Dict[str, _RouteCounters] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'QuestionRouter':
+        return cls(
+            enabled=getattr(settings, 'QUESTION_ROUTING_ENABLED', True),
+            small_model=getattr(settings, 'SMALL_QUESTION_MODEL', 'llama-3.1-8b-instant'),
+            max_simple_words=getattr(settings, 'SIMPLE_QUESTION_MAX_WORDS', 14),
+        )
+
+    def classify(self, question: str, context_data: Dict[Any, Any], has_image: bool = False) -> str:
+        if context_data.get('deep_think'):
+            return DEEP  # The user asked for the full model, however short the question
+        if not self.enabled or has_image or context_data.get('selected_text'):
+            return STANDARD
+        if (context_data.get('interaction_type') or '') not in _ROUTABLE_INTERACTIONS:
+            return STANDARD
+
+        normalized = normalize_question(question)
+        if (len(normalized.split()) > self.max_simple_words
+                or _HARD.search(normalized) or _ARITHMETIC.search(normalized)
+                or not _LOOKUP_START.match(normalized)):
+            return STANDARD
+        if lookup_formula(question) is not None:
+            return FORMULA
+        if _LOOKUP_NOUN.search(normalized) or len(normalized.split()) <= 6:
+            return SMALL
+        return STANDARD
+
+    def model_config(self, route: str, deep_think: bool) -> Optional[Dict[str, Any]]:
+        """Model override for a route; None keeps the default model for the mode"""
+        if route != SMALL:
+            return None
+        return {
+            "model": self.small_model,
+            "temperature": 0.6,
+            "max_tokens": 2000 if deep_think else 1024,
+            "stream": False,
+        }
+
+    def record(self, route: str, model: Optional[str], latency: float, usage: Optional[Dict[str, int]] = None):
+        usage = usage or {}
+        prompt, completion = usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+        price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (prompt * price_in + completion * price_out) / 1_000_000
+        with self._lock:
+            counters = self._counters.setdefault(route, _RouteCounters())
+            counters.requests += 1
+            counters.latency_total += latency
+            counters.latencies.append(latency)
+            counters.prompt_tokens += prompt
+            counters.completion_tokens += completion
+            counters.cost += cost
+        logger.info(f"Route {route} ({model or 'local'}): {latency * 1000:.0f}ms, "
+                    f"{prompt + completion} tokens, ${cost:.6f}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {route: self._snapshot(counters) for route, counters in self._counters.items()}
+
+    @staticmethod
+    def _snapshot(counters: _RouteCounters) -> Dict[str, Any]:
+        latencies = sorted(counters.latencies)
+        return {
+            'requests': counters.requests,
+            'avg_latency_ms': round(1000 * counters.latency_total / counters.requests, 1),
+            'p95_latency_ms': round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1),
+            'prompt_tokens': counters.prompt_tokens,
+            'completion_tokens': counters.completion_tokens,
+            'cost_usd': round(counters.cost, 6),
+        }
@@ -0,0 +1,80 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+The first caller for a key produces the result; callers that arrive while it
+is still running await the same future instead of starting their own provider
+call. Work started through run() is a shielded task, so a leader whose client
+disconnects doesn't cancel it for the followers. A streaming leader claims the
+key and resolves the future itself; if it gives up without a result, waiting
+followers compute on their own.
+
+Only the shared result is fanned out: per-user side effects (history rows,
+memory, token accounting) stay with each caller.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderAbandoned(Exception):
+    """The caller producing a coalesced result stopped before finishing it"""
+
+
+class RequestCoalescer:
+    """Per-event-loop registry of in-flight results keyed by request identity"""
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self.stats = {'leaders': 0, 'followers': 0}
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Result of compute(), shared with concurrent callers of key, and whether this caller produced it"""
+        future = self.join(key)
+        if future is not None:
+            try:
+                self.stats['followers'] += 1
+                return await asyncio.shield(future), False
+            except LeaderAbandoned:
+                logger.info(f"Coalesced request abandoned, computing it again: {key}")
+
+        task = asyncio.ensure_future(compute())
+        self._register(key, task)
+        self.stats['leaders'] += 1
+        return await asyncio.shield(task), True
+
+    def join(self, key: Hashable) -> Optional[asyncio.Future]:
+        """In-flight future for key, if another caller is producing it"""
+        future = self._inflight.get(self._scoped(key))
+        return future if future is not None and not future.done() else None
+
+    def claim(self, key: Hashable) -> asyncio.Future:
+        """Register the caller as producer of key; it must resolve or abandon() the returned future"""
+        future = asyncio.get_running_loop().create_future()
+        self._register(key, future)
+        self.stats['leaders'] += 1
+        return future
+
+    @staticmethod
+    def abandon(future: asyncio.Future, error: Optional[BaseException] = None):
+        """Release a claimed future that won't get a result; followers see error or retry"""
+        if not future.done():
+            future.set_exception(error if isinstance(error, Exception) else LeaderAbandoned())
+
+    def _register(self, key: Hashable, future: asyncio.Future):
+        scoped = self._scoped(key)
+        self._inflight[scoped] = future
+
+        def _done(f: asyncio.Future):
+            if self._inflight.get(scoped) is f:
+                del self._inflight[scoped]
+            if not f.cancelled():
+                f.exception()  # Retrieved here so unawaited failures aren't logged as lost
+
+        future.add_done_callback(_done)
+
+    @staticmethod
+    def _scoped(key: Hashable) -> Tuple[int, Hashable]:
+        # Futures belong to one event loop
+        return id(asyncio.get_running_loop()), key
@@ -0,0 +1,143 @@
+"""
+Helpers over the shared Django cache (CACHES in core/settings.py).
+
+get_or_compute / aget_or_compute return a cached value, or compute and store
+it with single-flight locking: one caller per process computes a missing key
+(a local lock), and across workers the first to `add` a short-lived lock key
+computes while the others poll for its result. If the lock holder dies or
+takes too long, waiters fall back to computing themselves.
+
+Cache errors never fail the caller; the value is computed directly instead.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from typing import Any, Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_LOCK_STRIPES = [threading.Lock() for _ in range(64)]
+_async_locks: "weakref.WeakValueDictionary[tuple, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+LOCK_TIMEOUT = 30  # Seconds a compute lock is held before others may take over
+WAIT_TIMEOUT = 10  # Seconds a waiter polls for another worker's result
+POLL_INTERVAL = 0.05
+
+
+def _cache(alias: str):
+    return caches[alias]
+
+
+def _stripe(key: str) -> threading.Lock:
+    return _LOCK_STRIPES[zlib.crc32(key.encode('utf-8')) % len(_LOCK_STRIPES)]
+
+
+def cache_get(key: str, alias: str = 'default', default: Any = None) -> Any:
+    try:
+        return _cache(alias).get(key, default)
+    except Exception as e:
+        logger.warning(f"Cache get failed for {key}: {str(e)}")
+        return default
+
+
+def cache_set(key: str, value: Any, timeout: Optional[float] = None, alias: str = 'default'):
+    try:
+        _cache(alias).set(key, value, timeout)
+    except Exception as e:
+        logger.warning(f"Cache set failed for {key}: {str(e)}")
+
+
+def cache_delete(*keys: str, alias: str = 'default'):
+    try:
+        _cache(alias).delete_many(keys)
+    except Exception as e:
+        logger.warning(f"Cache delete failed for {keys}: {str(e)}")
+
+
+def _try_lock(lock_key: str, token: str, alias: str) -> bool:
+    try:
+        return _cache(alias).add(lock_key, token, LOCK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Cache lock failed for {lock_key}: {str(e)}")
+        return True  # No shared cache to coordinate through, compute locally
+
+
+def _unlock(lock_key: str, token: str, alias: str):
+    if cache_get(lock_key, alias) == token:
+        cache_delete(lock_key, alias=alias)
+
+
+def get_or_compute(key: str, compute: Callable[[], Any], timeout: Optional[float] = 300,
+                   alias: str = 'default', cache_none: bool = False) -> Any:
+    """Cached value for key, computing it once across threads and workers on a miss"""
+    value = cache_get(key, alias, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    with _stripe(key):
+        value = cache_get(key, alias, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock_key, token = f"{key}:lock", uuid.uuid4().hex
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while not _try_lock(lock_key, token, alias):
+            time.sleep(POLL_INTERVAL)
+            value = cache_get(key, alias, _MISSING)
+            if value is not _MISSING:
+                return value
+            if time.monotonic() > deadline:
+                break
+
+        try:
+            value = compute()
+            if value is not None or cache_none:
+                cache_set(key, value, timeout, alias)
+            return value
+        finally:
+            _unlock(lock_key, token, alias)
+
+
+async def aget_or_compute(key: str, compute: Callable[[], Awaitable[Any]], timeout: Optional[float] = 300,
+                          alias: str = 'default', cache_none: bool = False) -> Any:
+    """Async get_or_compute; compute is a coroutine function, cache I/O runs off the event loop"""
+    aget = sync_to_async(cache_get, thread_sensitive=False)
+    value = await aget(key, alias, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    # asyncio locks belong to one event loop
+    lock_id = (id(asyncio.get_running_loop()), key)
+    lock = _async_locks.get(lock_id)
+    if lock is None:
+        lock = _async_locks.setdefault(lock_id, asyncio.Lock())
+    async with lock:
+        value = await aget(key, alias, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock_key, token = f"{key}:lock", uuid.uuid4().hex
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while not await sync_to_async(_try_lock, thread_sensitive=False)(lock_key, token, alias):
+            await asyncio.sleep(POLL_INTERVAL)
+            value = await aget(key, alias, _MISSING)
+            if value is not _MISSING:
+                return value
+            if time.monotonic() > deadline:
+                break
+
+        try:
+            value = await compute()
+            if value is not None or cache_none:
+                await sync_to_async(cache_set, thread_sensitive=False)(key, value, timeout, alias)
+            return value
+        finally:
+            await sync_to_async(_unlock, thread_sensitive=False)(lock_key, token, alias)
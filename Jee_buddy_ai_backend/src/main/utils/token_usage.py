@@ -0,0 +1,140 @@
+"""
+Buffered token accounting.
+
+Free users' quota checks reserve an estimate of the request's cost with one
+atomic UPDATE on the request path (MathTokenLimitAgent.reserve_tokens), so
+concurrent requests can't overshoot the limit on a stale read. Usage reported
+by the provider (prompt + completion tokens) is recorded in an in-process
+buffer after each completion, net of what was reserved for it, and the
+difference is written to `profiles.total_tokens` in batches by a background
+timer. Requests that produce no answer get their reservation back the same way.
+"""
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from main.utils.profile_cache import ProfileCache, profile_cache
+
+logger = logging.getLogger(__name__)
+
+
+def add_usage(usage: Optional[Dict[str, int]], reported) -> None:
+    """Accumulate a provider `usage` block (prompt + completion tokens) into a dict"""
+    if usage is None or reported is None:
+        return
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        usage[key] = usage.get(key, 0) + (getattr(reported, key, 0) or 0)
+
+
+class TokenUsageBuffer:
+    """Per-process usage deltas, flushed to the database on a timer"""
+
+    def __init__(self, flush_interval: float = 5.0, profiles: ProfileCache = profile_cache):
+        self.flush_interval = flush_interval
+        self.profiles = profiles
+        self._pending: Dict[str, int] = {}
+        self._inflight: Dict[str, int] = {}  # Taken by a flush that hasn't committed yet
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    @classmethod
+    def from_settings(cls) -> 'TokenUsageBuffer':
+        return cls(
+            flush_interval=getattr(settings, 'TOKEN_USAGE_FLUSH_INTERVAL', 5.0),
+        )
+
+    def record(self, user_id: str, tokens: int, reserved: int = 0):
+        """Add actual usage, less what was already reserved for it, to the user's pending delta"""
+        delta = tokens - reserved
+        if not user_id or delta == 0:
+            return
+        with self._lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + delta
+        self._ensure_timer()
+
+    def pending(self, user_id: str) -> int:
+        """Usage not yet committed to the database; negative when reservations are to be given back"""
+        with self._lock:
+            return self._pending.get(user_id, 0) + self._inflight.get(user_id, 0)
+
+    def get_profile(self, user_id: str, load_profile: Callable[[str], Optional[dict]]) -> Optional[dict]:
+        """Cached profile with uncommitted usage added to total_tokens"""
+        profile = self.profiles.get(user_id, load_profile, lookup='id')
+        if profile is None:
+            return None
+        return {**profile, 'total_tokens': profile['total_tokens'] + self.pending(user_id)}
+
+    def flush(self) -> int:
+        """Write all pending deltas in one statement; returns the number of users updated"""
+        with self._lock:
+            batch = {user_id: tokens for user_id, tokens in self._pending.items() if tokens}
+            self._pending = {}
+            for user_id, tokens in batch.items():
+                self._inflight[user_id] = self._inflight.get(user_id, 0) + tokens
+        if not batch:
+            return 0
+
+        try:
+            close_old_connections()
+            with connections['default'].cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE profiles AS p
+                    SET total_tokens = GREATEST(COALESCE(p.total_tokens, 0) + v.delta, 0)
+                    FROM unnest(%s::uuid[], %s::int[]) AS v(id, delta)
+                    WHERE p.id = v.id
+                    """,
+                    [list(batch.keys()), list(batch.values())],
+                )
+        except Exception as e:
+            logger.error(f"Error flushing token usage, will retry: {e}")
+            with self._lock:
+                for user_id, tokens in batch.items():
+                    self._pending[user_id] = self._pending.get(user_id, 0) + tokens
+                    self._release_inflight(user_id, tokens)
+            return 0
+        finally:
+            # Runs on a timer thread that no request cycle cleans up after
+            close_old_connections()
+
+        # total_tokens changed; reload profiles before dropping the in-flight amounts
+        for user_id in batch:
+            self.profiles.invalidate(user_id)
+        with self._lock:
+            for user_id, tokens in batch.items():
+                self._release_inflight(user_id, tokens)
+        logger.info(f"Flushed token usage for {len(batch)} users")
+        return len(batch)
+
+    def _release_inflight(self, user_id: str, tokens: int):
+        remaining = self._inflight.get(user_id, 0) - tokens
+        if remaining != 0:  # Negative while a refund from an overlapping flush is still in flight
+            self._inflight[user_id] = remaining
+        else:
+            self._inflight.pop(user_id, None)
+
+    def _ensure_timer(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_interval, self._run_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_timer(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._timer = None
+                has_pending = bool(self._pending)
+            if has_pending:
+                self._ensure_timer()
+
+
+usage_buffer = TokenUsageBuffer.from_settings()
+atexit.register(usage_buffer.flush)
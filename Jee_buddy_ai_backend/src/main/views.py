@@ -1,4 +1,4 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.response import Response
@@ -18,12 +18,18 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db.models import F, Q, Count
 from django.db.models.expressions import Case, When
 from django.db.models.functions import Now, Trunc
-from asgiref.sync import sync_to_async, async_to_sync
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.utils.decorators import method_decorator
 from django.http import JsonResponse
 from functools import wraps
 from django.utils import timezone
 from .agents.math_token_set_limit_agent import MathTokenLimitAgent
+from .utils.pagination import decode_cursor, encode_cursor, older_than
+from .utils.profile_cache import profile_cache
+from .utils.admission import AdmissionRejected, admission
+from .utils.image_payload import ImagePayload
+from .utils.deadlines import within_budget
 logger = logging.getLogger(__name__)
 
 def async_view(view_func):
@@ -33,6 +39,27 @@ def async_view(view_func):
         return asyncio.run(view_func(*args, **kwargs))
     return wrapped_view
 
+def load_profile_by_uuid(user_id):
+    """Profile row for the profile endpoint, or None"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            SELECT uuid, name, email, current_session_id, created_at, updated_at
+            FROM profiles 
+            WHERE uuid = %s
+        """, [user_id])
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    return {
+        'uuid': row[0],
+        'name': row[1],
+        'email': row[2],
+        'current_session_id': row[3],
+        'created_at': row[4],
+        'updated_at': row[5]
+    }
+
 @api_view(['GET'])
 def get_current_profile(request):
     """Get user profile from Supabase profiles table"""
@@ -45,42 +72,26 @@ def get_current_profile(request):
                 'error': 'User ID is required'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Query the profiles table
-        with connections['default'].cursor() as cursor:
-            cursor.execute("""
-                SELECT uuid, name, email, current_session_id, created_at, updated_at
-                FROM profiles 
-                WHERE uuid = %s
-            """, [user_id])
-            
-            row = cursor.fetchone()
-            
-            if row:
-                profile_data = {
-                    'uuid': row[0],
-                    'name': row[1],
-                    'email': row[2],
-                    'current_session_id': row[3],
-                    'created_at': row[4],
-                    'updated_at': row[5]
-                }
-                
-                # If no session ID exists, generate one and update
-                if not profile_data['current_session_id']:
-                    new_session_id = f"session_{uuid.uuid4().hex[:8]}"
-                    cursor.execute("""
-                        UPDATE profiles 
-                        SET current_session_id = %s,
-                            updated_at = CURRENT_TIMESTAMP
-                        WHERE uuid = %s
-                    """, [new_session_id, user_id])
-                    profile_data['current_session_id'] = new_session_id
-                
-                return Response(profile_data)
-            
+        profile_data = profile_cache.get(user_id, load_profile_by_uuid, lookup='uuid')
+        if not profile_data:
             return Response({
                 'error': 'Profile not found'
             }, status=status.HTTP_404_NOT_FOUND)
+
+        # If no session ID exists, generate one and update
+        if not profile_data['current_session_id']:
+            new_session_id = f"session_{uuid.uuid4().hex[:8]}"
+            with connections['default'].cursor() as cursor:
+                cursor.execute("""
+                    UPDATE profiles 
+                    SET current_session_id = %s,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE uuid = %s
+                """, [new_session_id, user_id])
+            profile_cache.invalidate(user_id)
+            profile_data['current_session_id'] = new_session_id
+
+        return Response(profile_data)
             
     except Exception as e:
         logger.error(f"Error in get_current_profile: {str(e)}", exc_info=True)
@@ -88,33 +99,99 @@ def get_current_profile(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-# Create async database operations
-@sync_to_async
-def get_chat_history(user_id, session_id, limit):
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+def page_size(value, default):
+    """Requested page size clamped to 1..MAX_HISTORY_PAGE_SIZE; raises ValueError if it isn't an integer"""
     try:
-        return list(ChatHistory.objects.filter(
+        limit = int(default if value is None else value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+# Async database operations
+async def get_chat_history(user_id, session_id, limit, before=None):
+    """Session turns newest first, optionally only those older than a decoded cursor"""
+    try:
+        queryset = ChatHistory.objects.filter(
+            older_than(before),
             user_id=user_id,
             session_id=session_id
-        ).order_by('-timestamp')[:limit].values())
+        ).order_by('-timestamp', '-id')[:limit].values('id', 'question', 'response', 'context', 'timestamp')
+        return [row async for row in queryset]
     except Exception as e:
         logger.error(f"Error in get_chat_history: {str(e)}")
         return []
 
-@sync_to_async
-def save_chat_interaction(user_id, session_id, question, response, context_data):
+async def save_chat_interaction(user_id, session_id, question, response, context_data):
     try:
-        chat = ChatHistory.objects.create(
+        return await ChatHistory.aupsert_interaction(
             user_id=user_id,
             session_id=session_id,
             question=question,
             response=response,
             context=context_data
         )
-        return chat.to_dict() if hasattr(chat, 'to_dict') else None
     except Exception as e:
         logger.error(f"Error in save_chat_interaction: {str(e)}")
         return None
 
+def build_agent_context(request_data):
+    """Create the agent context dictionary from request data"""
+    return {
+        'user_id': request_data.get('user_id'),
+        'session_id': request_data.get('session_id'),
+        'subject': request_data.get('subject', ''),
+        'topic': request_data.get('topic', ''),
+        'interaction_type': request_data.get('type', ''),
+        'pinnedText': request_data.get('pinnedText', ''),
+        'selectedText': request_data.get('selectedText', ''),
+        'Deep_think': request_data.get('Deep_think', False),
+        'image': request_data.get('image'),  # ImagePayload: the upload itself, never a base64 copy
+        'source': request_data.get('source', 'Chat')
+    }
+
+def interaction_context_data(context, agent_context=None):
+    """Context stored alongside a saved chat interaction"""
+    data = {
+        'subject': context['subject'],
+        'topic': context['topic'],
+        'interaction_type': context['interaction_type'],
+        'pinned_text': context['pinnedText'],
+    }
+    # The stored image stays referenced (and out of garbage collection) while the turn exists
+    image_path = (agent_context or {}).get('image_path')
+    if image_path:
+        data['image_path'] = image_path
+    return data
+
+def saved_turn(chat):
+    """The new turn plus a cursor for paging the session history behind it"""
+    if chat is None:
+        return {'turn': None, 'history_cursor': None}
+    return {
+        'turn': {'id': chat.id, **chat.to_dict()},
+        'history_cursor': encode_cursor(chat.timestamp, chat.id),
+    }
+
+def charge_usage(user_id, question, solution, reserved=0):
+    """Record provider-reported usage for a solve, estimating it when no provider call was made"""
+    token_agent = MathTokenLimitAgent()
+    usage = solution.get('usage')
+    if usage is not None and 'total_tokens' in usage:
+        tokens_used = usage['total_tokens']
+    else:
+        # Cache hits still count against the quota, charged by their size
+        tokens_used = token_agent.calculate_tokens(f"{question} {solution['solution']}")
+    token_agent.record_usage(user_id, tokens_used, reserved)
+
+def refund_reservation(request_data):
+    """Give back the tokens reserved by the quota check when a solve produced no answer"""
+    reserved = request_data.get('reserved_tokens') or 0
+    if reserved and request_data.get('user_id'):
+        MathTokenLimitAgent().record_usage(request_data.get('user_id'), 0, reserved)
+
 async def process_math_problem(request_data):
     try:
         
@@ -126,18 +203,7 @@ async def process_math_problem(request_data):
             }, 400
 
         # Create context dictionary from form data
-        context = {
-            'user_id': request_data.get('user_id'),
-            'session_id': request_data.get('session_id'),
-            'subject': request_data.get('subject', ''),
-            'topic': request_data.get('topic', ''),
-            'interaction_type': request_data.get('type', ''),
-            'pinnedText': request_data.get('pinnedText', ''),
-            'selectedText': request_data.get('selectedText', ''),
-            'Deep_think': request_data.get('Deep_think', False),
-            'image': request_data.get('image'),  # This will contain the base64 image
-            'source': request_data.get('source', 'Chat')
-        }
+        context = build_agent_context(request_data)
         
         # Get chat history
         chat_history = []
@@ -158,28 +224,18 @@ async def process_math_problem(request_data):
                 'details': 'The AI agent failed to generate a response.'
             }, 500
 
+        if context['user_id']:
+            charge_usage(context['user_id'], question, solution, request_data.get('reserved_tokens') or 0)
+
         # Save interaction
+        chat = None
         if context['user_id'] and context['session_id']:
-            await save_chat_interaction(
+            chat = await save_chat_interaction(
                 user_id=context['user_id'],
                 session_id=context['session_id'],
                 question=question,
                 response=solution['solution'],
-                context_data={
-                    'subject': context['subject'],
-                    'topic': context['topic'],
-                    'interaction_type': context['interaction_type'],
-                    'pinned_text': context['pinnedText'],
-                }
-            )
-
-        # Get updated history
-        updated_chat_history = []
-        if context['user_id'] and context['session_id']:
-            updated_chat_history = await get_chat_history(
-                context['user_id'], 
-                context['session_id'], 
-                request_data.get('history_limit', 100)
+                context_data=interaction_context_data(context, solution.get('context'))
             )
 
         return {
@@ -191,7 +247,8 @@ async def process_math_problem(request_data):
                 'session_id': context['session_id'],
                 'subject': context['subject'],
                 'topic': context['topic'],
-                'chat_history': updated_chat_history
+                # Older turns are paged from chat/session/ using history_cursor
+                **saved_turn(chat)
             }
         }, 200
             
@@ -202,43 +259,140 @@ async def process_math_problem(request_data):
             'details': 'An unexpected error occurred while processing your request.process_math_problem'
         }, 500
 
-@csrf_exempt
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser, JSONParser])
-def solve_math_problem(request):
+def sse_event(event, payload):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+def iterate_async(async_gen):
+    """Drive an async generator from a synchronous (WSGI) streaming response"""
+    loop = asyncio.new_event_loop()
     try:
-        token_agent = MathTokenLimitAgent()
+        while True:
+            try:
+                yield loop.run_until_complete(async_gen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        # Runs on client disconnect too, so the upstream stream gets closed
+        loop.run_until_complete(async_gen.aclose())
+        loop.close()
 
-        # Process the token limit check
-        user_id = request.data.get('user_id')
-        prompt = request.data.get('question')
-        token_response = token_agent.process_query(user_id, prompt)
-        # print("token_response", token_response)
-
-        # If there's an error in token processing, return it
-        if isinstance(token_response, tuple) and len(token_response) == 2:
-            token_response, _ = token_response
-        if isinstance(token_response, dict) and token_response.get('error'):
-            return JsonResponse(token_response, status=400)
-        # if token_response.get('error'):
-        #     return JsonResponse(token_response, status=400)
-
-        # If the user has exceeded the token limit, return the message
-        # if token_response.get('message'):
-        #     return JsonResponse(token_response, status=403)
-        if isinstance(token_response, dict) and token_response.get('message'):
-            return JsonResponse(token_response, status=403)
-        
+def release_when_done(async_gen, ticket):
+    """Hold an admission slot until a streamed response finishes or the client goes away"""
+    async def wrapped():
+        try:
+            async for item in async_gen:
+                yield item
+        finally:
+            ticket.release()
+            await async_gen.aclose()
+    return wrapped()
+
+def quota_response(token_response):
+    """Error response for a failed token limit check, or None when the solve may go ahead"""
+    if isinstance(token_response, tuple) and len(token_response) == 2:
+        token_response, _ = token_response
+    # Invalid or unknown user
+    if isinstance(token_response, dict) and token_response.get('error'):
+        return JsonResponse(token_response, status=400)
+    # The user has exceeded the token limit
+    if isinstance(token_response, dict) and token_response.get('message'):
+        return JsonResponse(token_response, status=403)
+    return None
+
+def too_many_requests(rejection):
+    """Fast 429 telling the client when to retry"""
+    response = JsonResponse({
+        'error': 'Too many requests',
+        'details': rejection.reason
+    }, status=429)
+    response['Retry-After'] = str(rejection.retry_after)
+    return response
+
+def wants_stream(request, data):
+    """Streaming is requested with a truthy `stream` field or an SSE Accept header"""
+    flag = data.get('stream', False)
+    if isinstance(flag, str):
+        flag = flag.lower() == 'true'
+    return bool(flag) or 'text/event-stream' in request.headers.get('Accept', '')
+
+async def stream_math_problem(request_data):
+    """Stream a solution as SSE events and save the interaction once it completes"""
+    question = request_data.get('question', '')
+    context = build_agent_context(request_data)
+
+    if context['user_id'] and context['session_id']:
+        context['chat_history'] = await get_chat_history(
+            context['user_id'],
+            context['session_id'],
+            request_data.get('history_limit', 100)
+        )
+
+    try:
+        agent = await MathAgent.create()
+        # The stream is iterated after the view (and its request budget) has returned
+        async for event in within_budget(agent.solve_stream(question, context)):
+            if event['type'] == 'delta':
+                yield sse_event('delta', {'content': event['content']})
+                continue
+
+            if event['type'] == 'error':
+                refund_reservation(request_data)
+                yield sse_event('error', {
+                    'error': event['context']['response'],
+                    'details': event['solution']
+                })
+                return
+
+            if context['user_id']:
+                charge_usage(context['user_id'], question, event, request_data.get('reserved_tokens') or 0)
+
+            # Save interaction once the full solution is known
+            chat = None
+            if context['user_id'] and context['session_id']:
+                chat = await save_chat_interaction(
+                    user_id=context['user_id'],
+                    session_id=context['session_id'],
+                    question=question,
+                    response=event['solution'],
+                    context_data=interaction_context_data(context, event.get('context'))
+                )
+
+            yield sse_event('done', {
+                'solution': event['solution'],
+                'context': {
+                    'current_question': question,
+                    'user_id': context['user_id'],
+                    'session_id': context['session_id'],
+                    'subject': context['subject'],
+                    'topic': context['topic'],
+                    **saved_turn(chat)
+                }
+            })
+    except Exception as e:
+        logger.error(f"Error in stream_math_problem: {str(e)}", exc_info=True)
+        refund_reservation(request_data)
+        yield sse_event('error', {
+            'error': str(e),
+            'details': 'An unexpected error occurred while streaming your response.'
+        })
+
+async def solve_math_problem(request):
+    """Solve a math problem on the event loop, without tying up a worker thread"""
+    if request.method != 'POST':
+        return JsonResponse({
+            'error': 'Method not allowed',
+            'details': 'Only POST is supported'
+        }, status=405)
+
+    try:
         # Handle form data
         if request.content_type.startswith('multipart/form-data'):
-            data = request.data.copy()  # Get mutable copy of request data
+            data = request.POST.copy()  # Get mutable copy of request data
             
-            # Handle image if present
+            # Handle image if present; it stays in the upload (memory or temp file) until a provider needs it
             if 'image' in request.FILES:
-                image_file = request.FILES['image']
-                # Convert image to base64
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-                data['image'] = image_data
+                data['image'] = ImagePayload.from_upload(request.FILES['image'])
             
             # Convert boolean fields
             if 'Deep_think' in data:
@@ -246,6 +400,14 @@ def solve_math_problem(request):
                 
         elif request.content_type == 'application/json':
             data = json.loads(request.body.decode('utf-8'))
+            if data.get('image'):
+                try:
+                    data['image'] = ImagePayload.from_base64(data['image'])
+                except ValueError as e:
+                    return JsonResponse({
+                        'error': 'Invalid image',
+                        'details': str(e)
+                    }, status=400)
         else:
             return JsonResponse({
                 'error': 'Unsupported content type',
@@ -259,8 +421,46 @@ def solve_math_problem(request):
                 'details': 'Question field is required'
             }, status=400)
 
+        token_agent = MathTokenLimitAgent()
+        user_id = data.get('user_id')
+        prompt = data.get('question')
+
+        # Concurrency limits come before the quota, so a rejected request reserves nothing;
+        # paid users (from the cached profile) are served first when the worker is saturated
+        try:
+            paid = await sync_to_async(token_agent.is_paid_user)(user_id)
+            ticket = await admission.admit(user_id, paid=paid)
+        except AdmissionRejected as e:
+            logger.info(f"Rejected solve for user {user_id}: {e.reason}")
+            return too_many_requests(e)
+
+        # Process the token limit check, reserving the prompt's estimate
+        try:
+            token_response = await sync_to_async(token_agent.process_query)(user_id, prompt)
+        except Exception:
+            ticket.release()
+            raise
+        quota_rejection = quota_response(token_response)
+        if quota_rejection is not None:
+            ticket.release()
+            return quota_rejection
+        # Settled against actual usage once the solve finishes
+        data['reserved_tokens'] = token_response.get('reserved_tokens', 0)
+
+        if wants_stream(request, data):
+            content = release_when_done(stream_math_problem(data), ticket)
+            if not isinstance(request, ASGIRequest):
+                content = iterate_async(content)  # WSGI servers need a sync iterator
+            response = StreamingHttpResponse(content, content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+            return response
+
         # Process the request
-        result = async_to_sync(process_math_problem)(data)
+        try:
+            result = await process_math_problem(data)
+        finally:
+            ticket.release()
         
         # Handle tuple response
         if isinstance(result, tuple) and len(result) == 2:
@@ -268,6 +468,8 @@ def solve_math_problem(request):
         else:
             response_data = result
             status_code = 200
+        if status_code != 200:
+            refund_reservation(data)
             
         return JsonResponse(response_data, status=status_code)
             
@@ -278,129 +480,137 @@ def solve_math_problem(request):
             'details': 'An unexpected error occurred while processing your request. solve_math_problem.'
         }, status=500)
 
+# csrf_exempt() wraps views in a sync function on Django 4.2, mark the async view directly
+solve_math_problem.csrf_exempt = True
+
+async def get_session_history(request):
+    """Page backwards through a session's turns, starting from a history_cursor"""
+    if request.method != 'GET':
+        return JsonResponse({
+            'error': 'Method not allowed',
+            'details': 'Only GET is supported'
+        }, status=405)
+
+    user_id = request.GET.get('user_id')
+    session_id = request.GET.get('session_id')
+    if not user_id or not session_id:
+        return JsonResponse({
+            'error': 'user_id and session_id are required'
+        }, status=400)
+
+    try:
+        before = decode_cursor(request.GET.get('before'))
+        limit = page_size(request.GET.get('limit'), HISTORY_PAGE_SIZE)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # One extra row tells us whether there is another page
+    rows = await get_chat_history(user_id, session_id, limit + 1, before=before)
+    turns = rows[:limit]
+    next_cursor = (
+        encode_cursor(turns[-1]['timestamp'], turns[-1]['id'])
+        if len(rows) > limit else None
+    )
+    return JsonResponse({
+        'turns': turns,
+        'next_cursor': next_cursor
+    })
+
+SUMMARY_HISTORY_FIELDS = ('id', 'session_id', 'preview', 'timestamp')
+FULL_HISTORY_FIELDS = SUMMARY_HISTORY_FIELDS + ('user_id', 'question', 'response', 'context')
+
+def fill_missing_previews(rows):
+    """Preview for rows saved before the column existed and not yet backfilled (backfill_chat_hashes)"""
+    missing = [row for row in rows if row.get('preview') is None]
+    if missing:
+        questions = dict(ChatHistory.objects.filter(id__in=[row['id'] for row in missing]).values_list('id', 'question'))
+        for row in missing:
+            row['preview'] = ChatHistory.make_preview(questions.get(row['id']))
+
+def history_entry(row, summary_only):
+    """Sidebar entry for a chat row; summary entries carry no message bodies"""
+    if summary_only:
+        return dict(row)
+
+    cleaned_question = row['question'].replace('()', '') if row['question'] else ''
+    messages = []
+    if cleaned_question:
+        messages.append({
+            'sender': 'user',
+            'content': cleaned_question,
+            'timestamp': row['timestamp']
+        })
+    if row['response']:
+        messages.append({
+            'sender': 'assistant',
+            'content': row['response'],
+            'timestamp': row['timestamp']
+        })
+    return {**row, 'question': cleaned_question, 'messages': messages}
+
+def group_by_period(entries):
+    """Bucket entries (newest first) into Today/Yesterday/This Week/This Month/Older"""
+    today = timezone.now().date()
+    yesterday = today - timezone.timedelta(days=1)
+    periods = [('Today', []), ('Yesterday', []), ('This Week', []), ('This Month', []), ('Older', [])]
+
+    for entry in entries:
+        chat_date = entry['timestamp'].date()
+        if chat_date == today:
+            periods[0][1].append(entry)
+        elif chat_date == yesterday:
+            periods[1][1].append(entry)
+        elif chat_date.isocalendar()[:2] == today.isocalendar()[:2]:
+            periods[2][1].append(entry)
+        elif chat_date.month == today.month and chat_date.year == today.year:
+            periods[3][1].append(entry)
+        else:
+            periods[4][1].append(entry)
+
+    return [{'title': title, 'chats': chats} for title, chats in periods if chats]
+
 @api_view(['GET'])
 def get_chat_history_by_user(request):
-    """Get chat history for a specific user and session"""
+    """
+    Get a page of chat history for a user (optionally one session), newest first.
+
+    Pages are keyset-paginated on (timestamp, id): pass the returned next_cursor as
+    `before` to load older chats. `summary=true` returns previews only.
+    """
     try:
         user_id = request.GET.get('user_id')
         session_id = request.GET.get('session_id')
+        summary_only = request.GET.get('summary', '').lower() in ('1', 'true')
         
         if not user_id:
             return Response({
                 'error': 'User ID is required'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Query the chat history table with DISTINCT ON to remove duplicates
-        with connections['default'].cursor() as cursor:
-            cursor.execute("""
-                WITH unique_chats AS (
-                    SELECT DISTINCT ON (question, response) 
-                        id, user_id, session_id, question, response, context, 
-                        timestamp,
-                        DATE(timestamp) as chat_date,
-                        EXTRACT(WEEK FROM timestamp) as chat_week,
-                        EXTRACT(MONTH FROM timestamp) as chat_month,
-                        EXTRACT(YEAR FROM timestamp) as chat_year
-                    FROM main_chathistory 
-                    WHERE user_id = %s
-                    AND (%s IS NULL OR session_id = %s)
-                    ORDER BY question, response, timestamp DESC
-                )
-                SELECT * FROM unique_chats
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """, [user_id, session_id, session_id])
-            
-            rows = cursor.fetchall()
-            
-            # Group chats by time periods
-            grouped_chats = {
-                'today': [],
-                'yesterday': [],
-                'this_week': [],
-                'this_month': [],
-                'older': []
-            }
-            
-            today = timezone.now().date()
-            yesterday = today - timezone.timedelta(days=1)
-            
-            for row in rows:
-                # Clean up the question content
-                cleaned_question = row[3].replace('()', '') if row[3] else ''
-                chat_date = row[7]  # chat_date from the query
-                
-                chat_entry = {
-                    'id': row[0],
-                    'user_id': row[1],
-                    'session_id': row[2],
-                    'question': cleaned_question,
-                    'response': row[4],
-                    'context': row[5],
-                    'timestamp': row[6],
-                    'preview': cleaned_question[:50] + ('...' if len(cleaned_question) > 50 else '')
-                }
-                
-                # Add messages
-                messages = []
-                if chat_entry['question']:
-                    messages.append({
-                        'sender': 'user',
-                        'content': cleaned_question,
-                        'timestamp': chat_entry['timestamp']
-                    })
-                if chat_entry['response']:
-                    messages.append({
-                        'sender': 'assistant',
-                        'content': chat_entry['response'],
-                        'timestamp': chat_entry['timestamp']
-                    })
-                chat_entry['messages'] = messages
-                
-                # Group by date
-                if chat_date == today:
-                    grouped_chats['today'].append(chat_entry)
-                elif chat_date == yesterday:
-                    grouped_chats['yesterday'].append(chat_entry)
-                elif chat_date.isocalendar()[1] == today.isocalendar()[1]:
-                    grouped_chats['this_week'].append(chat_entry)
-                elif chat_date.month == today.month and chat_date.year == today.year:
-                    grouped_chats['this_month'].append(chat_entry)
-                else:
-                    grouped_chats['older'].append(chat_entry)
-            
-            # Format the response
-            formatted_history = []
-            if grouped_chats['today']:
-                formatted_history.append({
-                    'title': 'Today',
-                    'chats': grouped_chats['today']
-                })
-            if grouped_chats['yesterday']:
-                formatted_history.append({
-                    'title': 'Yesterday',
-                    'chats': grouped_chats['yesterday']
-                })
-            if grouped_chats['this_week']:
-                formatted_history.append({
-                    'title': 'This Week',
-                    'chats': grouped_chats['this_week']
-                })
-            if grouped_chats['this_month']:
-                formatted_history.append({
-                    'title': 'This Month',
-                    'chats': grouped_chats['this_month']
-                })
-            if grouped_chats['older']:
-                formatted_history.append({
-                    'title': 'Older',
-                    'chats': grouped_chats['older']
-                })
-            
+        try:
+            before = decode_cursor(request.GET.get('before'))
+            limit = page_size(request.GET.get('limit'), MAX_HISTORY_PAGE_SIZE)
+        except ValueError as e:
             return Response({
-                'chat_history': formatted_history,
-                'total_count': len(rows)
-            })
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Interactions are deduplicated on write (ChatHistory.fingerprint)
+        chats = ChatHistory.objects.filter(older_than(before), user_id=user_id)
+        if session_id:
+            chats = chats.filter(session_id=session_id)
+
+        fields = SUMMARY_HISTORY_FIELDS if summary_only else FULL_HISTORY_FIELDS
+        rows = list(chats.order_by('-timestamp', '-id').values(*fields)[:limit + 1])
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1]['timestamp'], page[-1]['id']) if len(rows) > limit else None
+        fill_missing_previews(page)
+
+        return Response({
+            'chat_history': group_by_period(history_entry(row, summary_only) for row in page),
+            'total_count': len(page),
+            'next_cursor': next_cursor
+        })
             
     except Exception as e:
         logger.error(f"Error in get_chat_history_by_user: {str(e)}", exc_info=True)
@@ -5,6 +5,9 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import razorpay
 from .models import Subscription
+from main.utils.profile_cache import profile_cache
+from main.utils.shared_cache import cache_delete, get_or_compute
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 import json
@@ -57,15 +60,17 @@ def get_subscription_status(request):
         # Cast user_id to string explicitly
         user_id_str = str(user_id)
 
-        # Check if user has an active subscription
-        subscription = Subscription.objects.filter(
-            user_id=user_id_str,  # Use the string-casted user_id
-            status='active'
-        ).order_by('-created_at').first()
+        # Check if user has an active subscription (cached, including "none")
+        subscription = get_or_compute(
+            subscription_cache_key(user_id_str),
+            lambda: load_active_subscription(user_id_str),
+            timeout=getattr(settings, 'SUBSCRIPTION_STATUS_CACHE_TTL', 300),
+            cache_none=True
+        )
 
         if subscription:
             # Ensure valid_till is timezone aware
-            valid_till = subscription.valid_till
+            valid_till = subscription['valid_till']
             if timezone.is_naive(valid_till):
                 valid_till = timezone.make_aware(valid_till)
                 
@@ -75,9 +80,9 @@ def get_subscription_status(request):
             return JsonResponse({
                 'status': 'success',
                 'is_subscribed': is_active,
-                'subscription_id': subscription.subscription_id,
-                'plan_id': subscription.plan_id,
-                'created_at': subscription.created_at.isoformat(),
+                'subscription_id': subscription['subscription_id'],
+                'plan_id': subscription['plan_id'],
+                'created_at': subscription['created_at'].isoformat(),
                 'valid_till': valid_till.isoformat(),
                 'days_remaining': days_remaining,
                 'next_billing_date': valid_till.isoformat() if valid_till else None
@@ -95,6 +100,18 @@ def get_subscription_status(request):
             'message': str(e)
         }, status=500)
 
+def subscription_cache_key(user_id):
+    return f"subscription:active:{user_id}"
+
+def load_active_subscription(user_id):
+    """Fields of the user's newest active subscription, or None"""
+    return Subscription.objects.filter(
+        user_id=user_id,
+        status='active'
+    ).order_by('-created_at').values(
+        'subscription_id', 'plan_id', 'created_at', 'valid_till'
+    ).first()
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def subscription_callback(request):
@@ -163,6 +180,9 @@ def subscription_callback(request):
             
             subscription.save()
             logger.info(f"Saved subscription record: {subscription.id}")
+            # The user's payment_status changes with a completed payment
+            profile_cache.invalidate(str(user_id))
+            cache_delete(subscription_cache_key(str(user_id)))
 
             return JsonResponse({
                 "status": "success",
@@ -1,12 +1,70 @@
 import os
 import sys
+import tempfile
+
+import django
 import pytest
+from django.conf import settings
 
 # Add src directory to Python path
 src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
 sys.path.insert(0, src_path)
 
+_tmp = tempfile.mkdtemp(prefix='jee-buddy-tests-')
+
+# One Django setup for every test module. SQLite on a file, not :memory:, so the
+# threads sync_to_async runs ORM calls in see the same database.
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'main',
+            'django_apscheduler',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(_tmp, 'db.sqlite3')}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ROOT_URLCONF='main.urls',
+        MEDIA_ROOT=os.path.join(_tmp, 'media'),
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+        SCHEDULER_ENABLED=False,
+        CHAT_HISTORY_RETENTION_ENABLED=False,
+        IMAGE_STORE_GC_ENABLED=False,
+        TOKEN_USAGE_FLUSH_INTERVAL=3600,
+    )
+    django.setup()
+
+
+@pytest.fixture(scope='session')
+def django_db_schema():
+    """Run the migrations once and create the Supabase-managed profiles table"""
+    from django.core.management import call_command
+    from django.db import connection
+
+    call_command('migrate', verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "id TEXT PRIMARY KEY, uuid TEXT, name TEXT, payment_status TEXT, "
+            "total_tokens INTEGER DEFAULT 0, created_at TEXT, email TEXT)"
+        )
+
+
+@pytest.fixture
+def db(django_db_schema):
+    """An empty database for each test"""
+    from django.apps import apps
+    from django.db import connection
+
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM profiles")
+    for model in apps.get_app_config('main').get_models():
+        model.objects.all().delete()
+
+
 @pytest.fixture(scope="function")
 def math_agent():
     from main.agents.math_agent import MathAgent
-    return MathAgent()
\ No newline at end of file
+    return MathAgent(api_key='test-key')
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+
+from main.utils.admission import AdmissionController, AdmissionRejected
+
+
+class TestAdmissionController:
+    def test_per_user_limit_rejects_fast(self):
+        controller = AdmissionController(max_concurrent=10, per_user=2)
+
+        async def run():
+            tickets = [await controller.admit('u1'), await controller.admit('u1')]
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.admit('u1')
+            other = await controller.admit('u2')  # Other users are unaffected
+            for ticket in tickets + [other]:
+                ticket.release()
+            return rejected.value
+
+        rejection = asyncio.run(run())
+        assert rejection.retry_after >= 1
+        assert controller.stats()['active'] == 0
+
+    def test_full_queue_rejects(self):
+        controller = AdmissionController(max_concurrent=1, per_user=5, queue_size=1, queue_timeout=1)
+
+        async def run():
+            held = await controller.admit('a')
+            queued = asyncio.ensure_future(controller.admit('b'))
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected):
+                await controller.admit('c')
+            held.release()
+            (await queued).release()
+
+        asyncio.run(run())
+        assert controller.stats()['active'] == 0
+
+    def test_queue_timeout_rejects_and_frees_the_user(self):
+        controller = AdmissionController(max_concurrent=1, per_user=1, queue_timeout=0.02)
+
+        async def run():
+            held = await controller.admit('a')
+            with pytest.raises(AdmissionRejected):
+                await controller.admit('b')
+            held.release()
+            (await controller.admit('b')).release()
+
+        asyncio.run(run())
+
+    def test_paid_users_are_served_first(self):
+        controller = AdmissionController(max_concurrent=1, per_user=5, queue_timeout=1)
+        order = []
+
+        async def request(user_id, paid):
+            ticket = await controller.admit(user_id, paid=paid)
+            order.append(user_id)
+            ticket.release()
+
+        async def run():
+            held = await controller.admit('holder')
+            waiters = [
+                asyncio.ensure_future(request('free1', False)),
+                asyncio.ensure_future(request('free2', False)),
+                asyncio.ensure_future(request('paid', True)),
+            ]
+            await asyncio.sleep(0.01)
+            held.release()
+            await asyncio.gather(*waiters)
+
+        asyncio.run(run())
+        assert order == ['paid', 'free1', 'free2']
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        controller = AdmissionController(max_concurrent=1, per_user=5, queue_timeout=1)
+
+        async def run():
+            held = await controller.admit('a')
+            queued = asyncio.ensure_future(controller.admit('b'))
+            await asyncio.sleep(0)
+            queued.cancel()
+            await asyncio.sleep(0)
+            held.release()
+            (await controller.admit('c')).release()
+
+        asyncio.run(run())
+        assert controller.stats()['active'] == 0
+        assert controller.stats()['queued'] == 0
@@ -0,0 +1,193 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from unittest import mock
+from django.core.cache import caches
+from django.utils import timezone
+
+from main.models import MathProblem, Solution
+from main.utils import answer_cache as answer_cache_module
+from main.utils.answer_cache import (
+    AnswerCache, context_hash, is_self_contained, literals, normalize_question, prune_cached_answers, question_hash
+)
+
+
+CONTEXT = {
+    'subject': 'physics',
+    'topic': 'Work and Energy',
+    'interaction_type': 'solve',
+    'deep_think': False,
+    'selected_text': '',
+}
+
+
+class TestAnswerCache:
+    @pytest.fixture
+    def cache(self):
+        return AnswerCache(max_entries=3, ttl=60, similarity_threshold=0.7)
+
+    def test_normalization(self):
+        """Case, whitespace and trailing punctuation don't change the key"""
+        assert normalize_question("  What is  Kinetic ENERGY?? ") == "what is kinetic energy"
+
+    def test_exact_hit(self, cache):
+        """A normalized duplicate hits exactly"""
+        cache.set("What is kinetic energy?", CONTEXT, "KE = 1/2 mv^2")
+        assert cache.get("what is   kinetic energy", CONTEXT) == "KE = 1/2 mv^2"
+        assert cache.stats()['exact_hits'] == 1
+
+    def test_near_duplicate_hit(self, cache):
+        """A lightly reworded question hits through the similarity index"""
+        cache.set("Find the derivative of x^2 sin(x) with respect to x", CONTEXT, "2x sin(x) + x^2 cos(x)")
+        assert cache.get("Find the derivative of x^2 sin(x) with respect to variable x", CONTEXT) == "2x sin(x) + x^2 cos(x)"
+        assert cache.stats()['similar_hits'] == 1
+
+    def test_different_numbers_never_share_an_answer(self, cache):
+        """Near-identical wording with other numbers is a different problem"""
+        cache.set("A ball is thrown at 20 m/s at 30° to the horizontal. Find the range.", CONTEXT, "35.3 m")
+        assert cache.get("A ball is thrown at 40 m/s at 60° to the horizontal. Find the range.", CONTEXT) is None
+        assert cache.get("A ball is thrown at 20 m/s at 60° to the horizontal. Find the range.", CONTEXT) is None
+        assert cache.stats()['similar_hits'] == 0
+
+    def test_different_units_or_operators_miss(self, cache):
+        cache.set("A car moves at 20 m/s for 10 s. Find the distance.", CONTEXT, "200 m")
+        assert cache.get("A car moves at 20 km/h for 10 s. Find the distance.", CONTEXT) is None
+        cache.set("Find the derivative of x^2 + sin(x) with respect to x", CONTEXT, "2x + cos(x)")
+        assert cache.get("Find the derivative of x^2 - sin(x) with respect to x", CONTEXT) is None
+
+    def test_literals(self):
+        assert literals("Block of 5kg on a 2.5 m incline at 30°") == ('5', 'kg', 'a', '2.5', 'm', '30', '°')
+
+    def test_context_is_part_of_the_key(self, cache):
+        """The same question in deep think mode is a different answer"""
+        cache.set("What is kinetic energy?", CONTEXT, "KE = 1/2 mv^2")
+        assert cache.get("What is kinetic energy?", {**CONTEXT, 'deep_think': True}) is None
+        assert cache.stats()['misses'] == 1
+
+    def test_unrelated_question_misses(self, cache):
+        cache.set("What is kinetic energy?", CONTEXT, "KE = 1/2 mv^2")
+        assert cache.get("State Newton's third law of motion", CONTEXT) is None
+
+    def test_lru_eviction(self, cache):
+        """The least recently used entry is evicted first"""
+        for i in range(3):
+            cache.set(f"Question number {i} about limits", CONTEXT, f"answer {i}")
+        cache.get("Question number 0 about limits", CONTEXT)
+        cache.set("Question number 3 about limits", CONTEXT, "answer 3")
+
+        assert cache.get("Question number 0 about limits", CONTEXT) == "answer 0"
+        assert cache.stats()['evictions'] == 1
+        assert cache.stats()['size'] == 3
+
+    def test_ttl_expiry(self, cache):
+        with mock.patch.object(answer_cache_module.time, 'monotonic', return_value=1000.0):
+            cache.set("What is kinetic energy?", CONTEXT, "KE = 1/2 mv^2")
+        with mock.patch.object(answer_cache_module.time, 'monotonic', return_value=1061.0):
+            assert cache.get("What is kinetic energy?", CONTEXT) is None
+        assert cache.stats()['expired'] == 1
+
+    def test_follow_up_questions_are_not_cacheable(self):
+        assert is_self_contained("What is the formula of kinetic energy")
+        assert not is_self_contained("Now integrate the result")
+        assert not is_self_contained("Why?")
+
+
+@pytest.mark.usefixtures('db')
+class TestPersistentAnswers:
+    Q_HASH, C_HASH = question_hash("What is kinetic energy?"), context_hash(CONTEXT)
+
+    async def test_store_replaces_the_answer_for_a_question_and_context(self):
+        await Solution.astore_cached("What is kinetic energy?", self.Q_HASH, self.C_HASH, CONTEXT, "first")
+        await Solution.astore_cached("What is kinetic energy?", self.Q_HASH, self.C_HASH, CONTEXT, "second")
+
+        assert await MathProblem.objects.acount() == 1
+        assert await Solution.objects.acount() == 1
+        assert await Solution.aget_cached(self.Q_HASH, self.C_HASH, 60) == "second"
+
+    async def test_concurrent_stores_keep_one_row(self):
+        await asyncio.gather(*[
+            Solution.astore_cached("What is kinetic energy?", self.Q_HASH, self.C_HASH, CONTEXT, f"answer {i}")
+            for i in range(4)
+        ])
+        assert await MathProblem.objects.acount() == 1
+        assert await Solution.objects.acount() == 1
+
+    async def test_other_contexts_get_their_own_solution(self):
+        deep = {**CONTEXT, 'deep_think': True}
+        await Solution.astore_cached("What is kinetic energy?", self.Q_HASH, self.C_HASH, CONTEXT, "short")
+        await Solution.astore_cached("What is kinetic energy?", self.Q_HASH, context_hash(deep), deep, "long")
+        assert await Solution.objects.acount() == 2
+
+    def test_prune_deletes_expired_answers_and_their_problems(self):
+        asyncio.run(Solution.astore_cached("What is kinetic energy?", self.Q_HASH, self.C_HASH, CONTEXT, "old"))
+        fresh_hash = question_hash("What is momentum?")
+        asyncio.run(Solution.astore_cached("What is momentum?", fresh_hash, self.C_HASH, CONTEXT, "new"))
+        old = timezone.now() - timedelta(hours=2)
+        Solution.objects.filter(problem__question_hash=self.Q_HASH).update(created_at=old)
+        MathProblem.objects.filter(question_hash=self.Q_HASH).update(last_accessed=old)
+
+        assert prune_cached_answers(max_age=3600) == 1
+        assert list(MathProblem.objects.values_list('question_hash', flat=True)) == [fresh_hash]
+        assert list(Solution.objects.values_list('content', flat=True)) == ["new"]
+
+
+@pytest.mark.usefixtures('db')
+class TestAnswersSharedAcrossUsers:
+    QUESTION = "Find the escape velocity from the surface of the Earth"
+
+    @pytest.fixture
+    def agent(self, math_agent):
+        caches['default'].clear()
+        math_agent.memory = mock.Mock(
+            recall=mock.AsyncMock(side_effect=lambda user_id, question: [f"{user_id} prefers cricket examples"]),
+        )
+        math_agent.prompts = []
+
+        async def api_call(messages, model_config, context=None, usage=None):
+            math_agent.prompts.append(str(messages))
+            return f"answer {len(math_agent.prompts)}"
+
+        math_agent._make_api_call = api_call
+        return math_agent
+
+    def context(self, user_id):
+        return {'user_id': user_id, 'session_id': f"{user_id}-session", 'subject': 'physics',
+                'chat_history': [{'question': f"{user_id}'s earlier question", 'response': 'earlier answer'}]}
+
+    async def test_cached_answer_carries_no_user_context(self, agent):
+        first = await agent.solve(self.QUESTION, self.context('alice'))
+        second = await agent.solve(self.QUESTION, self.context('bob'))
+
+        assert first['solution'] == second['solution'] == 'answer 1'
+        assert len(agent.prompts) == 1
+        assert 'alice' not in agent.prompts[0]
+        agent.memory.recall.assert_not_called()
+
+    async def test_personal_questions_use_the_askers_context(self, agent):
+        await agent.solve("what if the mass doubles", self.context('alice'))
+        await agent.solve("what if the mass doubles", self.context('bob'))
+
+        assert len(agent.prompts) == 2
+        assert 'alice prefers cricket' in agent.prompts[0] and "alice's earlier question" in agent.prompts[0]
+        assert 'bob prefers cricket' in agent.prompts[1] and 'alice' not in agent.prompts[1]
+
+
+class TestSharedAnswerMiss:
+    QUESTION = "Find the escape velocity from the surface of the Earth"
+
+    @pytest.fixture
+    def agent(self, math_agent):
+        caches['default'].clear()
+        return math_agent
+
+    async def test_miss_is_remembered_until_the_answer_is_stored(self, agent):
+        context = {'subject': 'physics'}
+        with mock.patch.object(Solution, 'aget_cached', mock.AsyncMock(return_value=None)) as lookup:
+            assert await agent._get_cached_answer(self.QUESTION, context) is None
+            assert await agent._get_cached_answer(self.QUESTION, context) is None
+        lookup.assert_awaited_once()
+
+        await agent._cache_answer(self.QUESTION, context, "11.2 km/s")
+        agent.answer_cache.clear()
+        assert await agent._get_cached_answer(self.QUESTION, context) == "11.2 km/s"
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+from unittest import mock
+
+import pytest
+
+
+from main.utils import blob_store
+from main.utils.blob_store import LocalBlobStore, blob_key, collect_garbage
+
+
+def age(store: LocalBlobStore, key: str, hours: float):
+    past = time.time() - hours * 3600
+    os.utime(store._path(key), (past, past))
+
+
+class TestLocalBlobStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        return LocalBlobStore(tmp_path)
+
+    def test_blobs_are_keyed_by_content(self, store):
+        key = asyncio.run(store.put(b'image bytes', 'image/jpeg'))
+        assert key == blob_key(b'image bytes')
+        assert asyncio.run(store.get(key)) == b'image bytes'
+        assert store._path(key).parent.parent.name == key[:2]
+
+    def test_duplicates_are_stored_once_and_refreshed(self, store):
+        key = asyncio.run(store.put(b'same photo'))
+        age(store, key, 48)
+        with mock.patch.object(store, 'write') as write:
+            assert asyncio.run(store.put(b'same photo')) == key
+        write.assert_not_called()
+        assert time.time() - store._path(key).stat().st_mtime < 60
+        assert [k for k, _ in store.list_blobs()] == [key]
+
+    def test_put_nowait_returns_the_key_before_the_write(self, store):
+        key = store.put_nowait(b'background')
+        deadline = time.monotonic() + 2
+        while not store.exists(key) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.read(key) == b'background'
+
+    def test_no_temporary_files_are_left_behind(self, store, tmp_path):
+        asyncio.run(store.put(b'one'))
+        assert not [p for p in tmp_path.rglob('.*')]
+
+
+class TestCollectGarbage:
+    @pytest.fixture
+    def store(self, tmp_path):
+        return LocalBlobStore(tmp_path)
+
+    def test_only_old_unreferenced_blobs_are_deleted(self, store):
+        kept = asyncio.run(store.put(b'referenced'))
+        orphan = asyncio.run(store.put(b'orphan'))
+        fresh = asyncio.run(store.put(b'fresh orphan'))
+        age(store, kept, 48)
+        age(store, orphan, 48)
+
+        with mock.patch.object(blob_store, 'referenced_image_keys', return_value={kept}):
+            assert collect_garbage(store, grace_hours=24) == 1
+
+        assert store.exists(kept) and store.exists(fresh)
+        assert not store.exists(orphan)
+
+    def test_failed_reference_lookup_deletes_nothing(self, store):
+        key = asyncio.run(store.put(b'orphan'))
+        age(store, key, 48)
+        with mock.patch.object(blob_store, 'referenced_image_keys', side_effect=RuntimeError('db down')):
+            assert collect_garbage(store, grace_hours=24) == 0
+        assert store.exists(key)
+
+    def test_blob_stored_again_during_a_run_is_kept(self, store):
+        key = asyncio.run(store.put(b'old photo'))
+        age(store, key, 48)
+        listing = store.list_blobs
+
+        def list_then_reupload():
+            listed = list(listing())
+            asyncio.run(store.put(b'old photo'))  # Re-uploaded after the references were read
+            yield from listed
+
+        with mock.patch.object(blob_store, 'referenced_image_keys', return_value=set()), \
+                mock.patch.object(store, 'list_blobs', list_then_reupload):
+            assert collect_garbage(store, grace_hours=24) == 0
+        assert store.exists(key)
+
+    def test_modified_of_a_missing_blob(self, store):
+        assert store.modified(blob_key(b'never stored')) is None
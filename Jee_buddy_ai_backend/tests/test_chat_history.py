@@ -0,0 +1,167 @@
+import json
+import zlib
+from io import StringIO
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import ChatHistory, ChatHistoryArchive
+from main.utils.history_retention import expired_chat_ids, prune_chat_history
+from main.utils.pagination import decode_cursor, encode_cursor, older_than
+from main.views import saved_turn
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+def add_turns(count, user_id='u1', session_id='s1'):
+    """Turns one minute apart, oldest first"""
+    start = timezone.now() - timedelta(hours=1)
+    chats = []
+    for i in range(count):
+        chat = ChatHistory.add_interaction(user_id, session_id, f"question {i}", f"answer {i}", {})
+        ChatHistory.objects.filter(pk=chat.pk).update(timestamp=start + timedelta(minutes=i))
+        chats.append(ChatHistory.objects.get(pk=chat.pk))
+    return chats
+
+
+class TestFingerprintUpsert:
+    def test_repeated_interaction_is_stored_once(self):
+        first = ChatHistory.add_interaction('u1', 's1', 'What is 2+2?', '4', {'topic': 'a'})
+        again = ChatHistory.add_interaction('u1', 's1', 'What is 2+2?', '4', {'topic': 'b'})
+
+        assert again.pk == first.pk
+        assert ChatHistory.objects.count() == 1
+        assert ChatHistory.objects.get().context == {'topic': 'b'}
+        assert again.timestamp >= first.timestamp
+
+    def test_other_sessions_keep_their_own_row(self):
+        ChatHistory.add_interaction('u1', 's1', 'What is 2+2?', '4', {})
+        ChatHistory.add_interaction('u1', 's2', 'What is 2+2?', '4', {})
+        assert ChatHistory.objects.count() == 2
+
+    async def test_async_upsert(self):
+        first = await ChatHistory.aupsert_interaction('u1', 's1', 'Define work', 'W = F.d', {})
+        again = await ChatHistory.aupsert_interaction('u1', 's1', 'Define work', 'W = F.d', {})
+        assert again.pk == first.pk
+        assert await ChatHistory.objects.acount() == 1
+
+    def test_preview_and_hash_are_filled_on_save(self):
+        chat = ChatHistory.add_interaction('u1', 's1', 'x' * 80, 'y', {})
+        assert chat.preview == 'x' * 50 + '...'
+        assert chat.content_hash == ChatHistory.compute_content_hash('x' * 80, 'y')
+
+    def test_backfill_fills_rows_saved_before_the_columns(self):
+        chats = add_turns(3)
+        ChatHistory.objects.filter(pk__in=[chat.pk for chat in chats[:2]]).update(content_hash=None, preview=None)
+
+        call_command('backfill_chat_hashes', batch_size=1, stdout=StringIO())
+
+        assert not ChatHistory.objects.filter(content_hash__isnull=True).exists()
+        chat = ChatHistory.objects.get(pk=chats[0].pk)
+        assert chat.preview == 'question 0'
+        assert chat.content_hash == ChatHistory.compute_content_hash('question 0', 'answer 0')
+
+
+class TestFingerprintBackfill:
+    @pytest.fixture
+    def unfingerprinted(self):
+        """Two copies of one interaction and one other, as saved before fingerprints existed"""
+        ChatHistory.objects.bulk_create([
+            ChatHistory(user_id='u1', session_id='s1', question=question, response='r', context={})
+            for question in ['q1', 'q2', 'q1']
+        ])
+
+    @pytest.mark.parametrize('dry_run', [False, True])
+    def test_duplicates_across_batches(self, unfingerprinted, dry_run):
+        out = StringIO()
+        call_command('backfill_chat_fingerprints', batch_size=1, dry_run=dry_run, stdout=out)
+
+        assert 'Fingerprinted 2 chat rows and removed 1 duplicates' in out.getvalue()
+        assert ChatHistory.objects.count() == (3 if dry_run else 2)
+        assert ChatHistory.objects.filter(fingerprint__isnull=True).exists() == dry_run
+
+
+class TestKeysetPagination:
+    def test_cursor_round_trip(self):
+        now = timezone.now()
+        assert decode_cursor(encode_cursor(now, 42)) == (now, 42)
+        assert decode_cursor(None) is None
+
+    def test_malformed_cursor_raises(self):
+        with pytest.raises(ValueError):
+            decode_cursor('not-a-cursor')
+
+    def test_pages_cover_every_row_once(self):
+        add_turns(7)
+        seen, cursor = [], None
+        while True:
+            page = list(
+                ChatHistory.objects.filter(older_than(cursor), user_id='u1')
+                .order_by('-timestamp', '-id')[:3]
+            )
+            if not page:
+                break
+            seen.extend(chat.question for chat in page)
+            cursor = (page[-1].timestamp, page[-1].id)
+
+        assert seen == [f"question {i}" for i in reversed(range(7))]
+
+    def test_rows_with_equal_timestamps_are_split_by_id(self):
+        chats = add_turns(3)
+        ChatHistory.objects.update(timestamp=chats[0].timestamp)
+        newest = ChatHistory.objects.order_by('-timestamp', '-id').first()
+
+        rest = ChatHistory.objects.filter(older_than((newest.timestamp, newest.id)))
+        assert rest.count() == 2 and newest.id not in rest.values_list('id', flat=True)
+
+
+class TestSavedTurn:
+    def test_new_turn_comes_with_a_cursor_behind_it(self):
+        chat = add_turns(2)[-1]
+        result = saved_turn(chat)
+
+        assert result['turn']['id'] == chat.id
+        assert result['turn']['question'] == 'question 1'
+        older = ChatHistory.objects.filter(older_than(decode_cursor(result['history_cursor'])))
+        assert list(older.values_list('question', flat=True)) == ['question 0']
+
+    def test_unsaved_turn(self):
+        assert saved_turn(None) == {'turn': None, 'history_cursor': None}
+
+
+class TestRetention:
+    def test_old_turns_move_to_the_archive(self):
+        add_turns(5)
+        add_turns(2, user_id='u2')
+
+        assert prune_chat_history(keep=3, batch_size=1, max_batches=10) == 2
+
+        assert sorted(ChatHistory.objects.filter(user_id='u1').values_list('question', flat=True)) == [
+            'question 2', 'question 3', 'question 4'
+        ]
+        assert ChatHistory.objects.filter(user_id='u2').count() == 2
+        archived = sorted(ChatHistoryArchive.objects.all(), key=lambda row: row.timestamp)
+        assert [row.to_dict()['question'] for row in archived] == ['question 0', 'question 1']
+        assert json.loads(zlib.decompress(bytes(archived[0].payload)))['response'] == 'answer 0'
+
+    def test_runs_are_bounded(self):
+        add_turns(6)
+        assert prune_chat_history(keep=1, batch_size=2, max_batches=1) == 2
+        assert prune_chat_history(keep=1, batch_size=2, max_batches=10) == 3
+        assert prune_chat_history(keep=1) == 0
+
+    def test_expired_ids_are_ranked_once_per_run(self):
+        add_turns(5)
+        with CaptureQueriesContext(connection) as queries:
+            assert prune_chat_history(keep=1, batch_size=1, max_batches=10) == 4
+        assert sum('ROW_NUMBER' in query['sql'] for query in queries.captured_queries) == 1
+
+    def test_only_turns_past_the_limit_expire(self):
+        add_turns(3)
+        add_turns(1, user_id='u2')
+        assert expired_chat_ids(keep=2, limit=10) == [ChatHistory.objects.get(user_id='u1', question='question 0').id]
+        assert expired_chat_ids(keep=3, limit=10) == []
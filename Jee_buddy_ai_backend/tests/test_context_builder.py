@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+from main.utils.context_builder import ContextBuilder, count_tokens
+
+
+MODEL_CONFIG = {'model': 'llama3-70b-8192', 'max_tokens': 2000}
+START = datetime(2025, 1, 1)
+
+
+def history(count, words=40):
+    """ChatHistory rows newest first, the way get_chat_history returns them"""
+    rows = [
+        {
+            'id': i,
+            'timestamp': START + timedelta(minutes=i),
+            'question': f"Question {i}. " + "detail " * words,
+            'response': f"Answer {i}. " + "step " * words,
+        }
+        for i in range(count)
+    ]
+    return list(reversed(rows))
+
+
+def prompt_tokens(messages):
+    return sum(count_tokens(m['content']) + 4 for m in messages)
+
+
+class TestContextBuilder:
+    @pytest.fixture
+    def builder(self):
+        return ContextBuilder(max_prompt_tokens=1000, digest_tokens=150)
+
+    def test_short_history_is_sent_in_full(self, builder):
+        messages = builder.build("system", "What is 2+2?", "", MODEL_CONFIG, chat_history=history(2))
+
+        assert [m['role'] for m in messages] == ['system', 'user', 'assistant', 'user', 'assistant', 'user']
+        assert messages[1]['content'].startswith("Question 0.")
+        assert messages[-1]['content'] == "What is 2+2?"
+
+    def test_prompt_stays_within_budget(self, builder):
+        messages = builder.build(
+            "system", "What is 2+2?", "some selected text", MODEL_CONFIG,
+            memories=["Prefers short answers"], chat_history=history(50)
+        )
+
+        assert prompt_tokens(messages) <= builder.prompt_budget(MODEL_CONFIG)
+        assert messages[1]['content'].endswith("- Prefers short answers")
+        assert messages[2]['content'].startswith("Summary of the earlier conversation:")
+        # Most recent turn is kept verbatim right before the question
+        assert messages[-2]['content'].startswith("Answer 49.")
+
+    def test_budget_reserves_the_completion(self):
+        builder = ContextBuilder(max_prompt_tokens=100000)
+        assert builder.prompt_budget(MODEL_CONFIG) == 8192 - 2000
+
+    def test_oversized_selected_text_is_truncated(self, builder):
+        messages = builder.build("system", "Explain this", "word " * 5000, MODEL_CONFIG)
+
+        assert messages[-1]['content'].endswith("Question: Explain this")
+        assert prompt_tokens(messages) <= builder.prompt_budget(MODEL_CONFIG)
+
+    def test_digest_rolls_forward_per_session(self, builder):
+        session = ('user-1', 'session-1')
+        builder.build("system", "next", "", MODEL_CONFIG, chat_history=history(30), session_key=session)
+        first = builder._digests[session]
+
+        builder.build("system", "next", "", MODEL_CONFIG, chat_history=history(31), session_key=session)
+        second = builder._digests[session]
+
+        assert second.folded_through > first.folded_through
+        assert len({key for key, _ in second.lines}) == len(second.lines)
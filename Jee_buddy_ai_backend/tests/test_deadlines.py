@@ -0,0 +1,215 @@
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+from django.core.handlers.asgi import ASGIHandler
+from django.test import override_settings
+
+from main.utils import deadlines
+from main.utils.deadlines import (
+    DeadlineExceeded, call_timeout, http_timeout, is_retryable, model_timeout, remaining, request_budget,
+    retry_async, within_budget
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class TestRequestBudget:
+    def test_timeouts_come_from_the_remaining_budget(self):
+        assert remaining() is None
+        assert call_timeout(30) == 30
+        with request_budget(10):
+            assert 9 < call_timeout(30) <= 10
+            with request_budget(60):
+                # An inner budget can't extend the outer one
+                assert call_timeout(30) <= 10
+        assert remaining() is None
+
+    @override_settings(LLM_MODEL_TIMEOUTS={'deepseek-r1-distill-llama-70b': 90}, LLM_CALL_TIMEOUT=30)
+    def test_caps_are_per_model(self):
+        assert model_timeout('deepseek-r1-distill-llama-70b') == 90
+        assert model_timeout('llama3-70b-8192') == 30
+        with request_budget(60):
+            assert 59 < call_timeout(model_timeout('deepseek-r1-distill-llama-70b')) <= 60
+
+    @override_settings(LLM_CONNECT_TIMEOUT=5, LLM_READ_TIMEOUT=20)
+    def test_connect_and_read_timeouts_are_separate(self):
+        timeout = http_timeout(90)
+        assert (timeout.connect, timeout.read) == (5, 20)
+        # Neither phase may outlast the call itself
+        assert http_timeout(3).read == 3
+
+    def test_exhausted_budget_raises(self):
+        with request_budget(0.001):
+            asyncio.run(asyncio.sleep(0.01))
+            with pytest.raises(DeadlineExceeded):
+                call_timeout(30)
+
+
+class TestRetryAsync:
+    @pytest.fixture(autouse=True)
+    def no_sleep(self):
+        with mock.patch.object(deadlines, 'backoff_delay', return_value=0):
+            yield
+
+    def test_transient_errors_are_retried(self):
+        calls = mock.AsyncMock(side_effect=[ConnectionError('reset'), StatusError(503), 'ok'])
+        assert asyncio.run(retry_async(calls, retries=2)) == 'ok'
+        assert calls.await_count == 3
+
+    def test_retries_are_bounded(self):
+        calls = mock.AsyncMock(side_effect=StatusError(429))
+        with pytest.raises(StatusError):
+            asyncio.run(retry_async(calls, retries=2))
+        assert calls.await_count == 3
+
+    def test_client_errors_are_not_retried(self):
+        calls = mock.AsyncMock(side_effect=StatusError(400))
+        with pytest.raises(StatusError):
+            asyncio.run(retry_async(calls, retries=2))
+        assert calls.await_count == 1
+
+    def test_timeouts_are_not_retried(self):
+        """A generation that ran out of time would start over with less time left"""
+        for error in (asyncio.TimeoutError(), httpx.ReadTimeout('idle')):
+            calls = mock.AsyncMock(side_effect=error)
+            with pytest.raises(type(error)):
+                asyncio.run(retry_async(calls, retries=2))
+            assert calls.await_count == 1
+
+    def test_connect_failures_are_retried(self):
+        calls = mock.AsyncMock(side_effect=[httpx.ConnectTimeout('connect'), httpx.ConnectError('refused'), 'ok'])
+        assert asyncio.run(retry_async(calls, retries=2)) == 'ok'
+
+    def test_sdk_errors_are_judged_by_their_cause(self):
+        class APITimeoutError(Exception):
+            pass
+
+        read_timeout = APITimeoutError()
+        read_timeout.__cause__ = httpx.ReadTimeout('idle')
+        connect_timeout = APITimeoutError()
+        connect_timeout.__cause__ = httpx.ConnectTimeout('connect')
+        assert not is_retryable(read_timeout)
+        assert is_retryable(connect_timeout)
+
+    def test_attempts_are_capped_per_call(self):
+        timeouts = []
+
+        async def call(timeout):
+            timeouts.append(timeout)
+            return 'ok'
+
+        asyncio.run(retry_async(call, cap=7))
+        assert timeouts == [7]
+
+    def test_hung_call_times_out_within_the_budget(self):
+        async def hang(timeout):
+            await asyncio.sleep(10)
+
+        async def run():
+            with request_budget(0.05):
+                await retry_async(hang, retries=3)
+
+        with pytest.raises((asyncio.TimeoutError, DeadlineExceeded)):
+            asyncio.run(asyncio.wait_for(run(), 1))
+
+
+class TestStreamBudget:
+    def test_stream_calls_see_the_stream_budget(self):
+        async def stream():
+            yield remaining()
+            yield remaining()
+
+        async def run():
+            return [left async for left in within_budget(stream(), 30)]
+
+        assert all(left is not None and 29 < left <= 30 for left in asyncio.run(run()))
+
+    def test_slow_stream_is_cut_off_at_the_deadline(self):
+        closed = asyncio.Event()
+
+        async def stream():
+            try:
+                yield 'first'
+                await asyncio.sleep(10)
+                yield 'never'
+            finally:
+                closed.set()
+
+        async def run():
+            items = []
+            with pytest.raises(DeadlineExceeded):
+                async for item in within_budget(stream(), 0.05):
+                    items.append(item)
+            return items, closed.is_set()
+
+        assert asyncio.run(asyncio.wait_for(run(), 1)) == (['first'], True)
+
+
+class TestDisconnectCancellation:
+    def test_disconnect_cancels_the_request(self):
+        from core.asgi import CustomASGIHandler
+
+        cancelled = asyncio.Event()
+
+        async def slow_view(self, scope, receive, send):
+            await receive()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def run():
+            incoming = [{'type': 'http.request', 'body': b'', 'more_body': False}, {'type': 'http.disconnect'}]
+
+            async def receive():
+                await asyncio.sleep(0.01)
+                return incoming.pop(0)
+
+            with mock.patch.object(ASGIHandler, '__call__', slow_view):
+                await asyncio.wait_for(
+                    CustomASGIHandler().handle_until_disconnect({'type': 'http', 'path': '/'}, receive, mock.AsyncMock()),
+                    1
+                )
+            return cancelled.is_set()
+
+        assert asyncio.run(run())
+
+    def test_disconnect_after_the_response_keeps_the_cleanup(self):
+        from core.asgi import CustomASGIHandler
+
+        cleaned_up = asyncio.Event()
+
+        async def view(self, scope, receive, send):
+            await receive()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'done', 'more_body': False})
+            await asyncio.sleep(0.05)  # request_finished handlers, closing files, ...
+            cleaned_up.set()
+
+        async def run():
+            incoming = [{'type': 'http.request', 'body': b'', 'more_body': False}, {'type': 'http.disconnect'}]
+            response_sent = asyncio.Event()
+
+            async def receive():
+                if len(incoming) == 1:
+                    await response_sent.wait()  # Servers report the disconnect once the response is out
+                return incoming.pop(0)
+
+            async def send(message):
+                if message['type'] == 'http.response.body':
+                    response_sent.set()
+
+            with mock.patch.object(ASGIHandler, '__call__', view):
+                await asyncio.wait_for(
+                    CustomASGIHandler().handle_until_disconnect({'type': 'http', 'path': '/'}, receive, send),
+                    1
+                )
+            return cleaned_up.is_set()
+
+        assert asyncio.run(run())
@@ -0,0 +1,114 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.test import AsyncRequestFactory, RequestFactory
+from django.utils import timezone
+
+from main import views
+from main.models import ChatHistory
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+@pytest.fixture
+def turns():
+    """Five turns in session s1 and one in s2, oldest first"""
+    start = timezone.now() - timedelta(hours=1)
+    for i, session_id in enumerate(['s1'] * 5 + ['s2']):
+        chat = ChatHistory.add_interaction('u1', session_id, f"question {i}()", f"answer {i}", {'topic': 't'})
+        ChatHistory.objects.filter(pk=chat.pk).update(timestamp=start + timedelta(minutes=i))
+
+
+async def session_page(**params):
+    response = await views.get_session_history(AsyncRequestFactory().get('/api/chat/session/', params))
+    return response.status_code, json.loads(response.content)
+
+
+def user_page(**params):
+    response = views.get_chat_history_by_user(RequestFactory().get('/api/chat/history/', params))
+    response.render()
+    return response.status_code, json.loads(response.content)
+
+
+class TestSessionHistoryView:
+    async def test_pages_back_through_a_session(self, turns):
+        status, first = await session_page(user_id='u1', session_id='s1', limit=3)
+        assert status == 200
+        assert [turn['question'] for turn in first['turns']] == ['question 4()', 'question 3()', 'question 2()']
+
+        status, second = await session_page(user_id='u1', session_id='s1', limit=3, before=first['next_cursor'])
+        assert [turn['question'] for turn in second['turns']] == ['question 1()', 'question 0()']
+        assert second['next_cursor'] is None
+
+    async def test_default_page_size(self, turns):
+        status, page = await session_page(user_id='u1', session_id='s1')
+        assert status == 200 and len(page['turns']) == 5
+
+    @pytest.mark.parametrize('limit, size', [('0', 1), ('-3', 1), ('1000', 5)])
+    async def test_limit_is_clamped(self, turns, limit, size):
+        status, page = await session_page(user_id='u1', session_id='s1', limit=limit)
+        assert status == 200 and len(page['turns']) == size
+
+    async def test_limit_must_be_an_integer(self):
+        status, body = await session_page(user_id='u1', session_id='s1', limit='ten')
+        assert status == 400 and 'limit' in body['error']
+
+    async def test_requires_user_and_session(self):
+        status, _ = await session_page(user_id='u1')
+        assert status == 400
+
+    async def test_bad_cursor(self):
+        status, body = await session_page(user_id='u1', session_id='s1', before='garbage')
+        assert status == 400 and 'Invalid cursor' in body['error']
+
+
+class TestUserHistoryView:
+    def test_full_entries_carry_messages(self, turns):
+        status, body = user_page(user_id='u1', limit=2)
+
+        assert status == 200
+        assert body['total_count'] == 2 and body['next_cursor']
+        chats = [chat for period in body['chat_history'] for chat in period['chats']]
+        assert [chat['question'] for chat in chats] == ['question 5', 'question 4']
+        assert [message['sender'] for message in chats[0]['messages']] == ['user', 'assistant']
+
+    def test_summary_pages_cover_the_history(self, turns):
+        seen, cursor = [], None
+        while True:
+            params = {'user_id': 'u1', 'summary': 'true', 'limit': 4}
+            if cursor:
+                params['before'] = cursor
+            status, body = user_page(**params)
+            assert status == 200
+            for period in body['chat_history']:
+                for chat in period['chats']:
+                    assert set(chat) == {'id', 'session_id', 'preview', 'timestamp'}
+                    seen.append(chat['preview'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+
+        assert seen == [f"question {i}" for i in reversed(range(6))]
+
+    @pytest.mark.parametrize('limit, size', [('0', 1), ('-3', 1), ('1000', 6)])
+    def test_limit_is_clamped(self, turns, limit, size):
+        status, body = user_page(user_id='u1', limit=limit)
+        assert status == 200 and body['total_count'] == size
+
+    def test_limit_must_be_an_integer(self):
+        status, body = user_page(user_id='u1', limit='ten')
+        assert status == 400 and 'limit' in body['error']
+
+    def test_summary_preview_of_a_row_not_yet_backfilled(self, turns):
+        ChatHistory.objects.filter(question='question 5()').update(preview=None)
+        _, body = user_page(user_id='u1', summary='true', limit=1)
+        assert body['chat_history'][0]['chats'][0]['preview'] == 'question 5'
+
+    def test_session_filter(self, turns):
+        _, body = user_page(user_id='u1', session_id='s2')
+        assert body['total_count'] == 1
+
+    def test_requires_user(self):
+        status, _ = user_page()
+        assert status == 400
@@ -0,0 +1,130 @@
+import io
+import random
+
+import pytest
+
+
+from django.core.cache import caches
+from PIL import Image, ImageDraw, ImageEnhance
+
+from main.utils.image_hash_cache import ImageHashCache, content_key, fingerprint, hamming
+from main.utils.image_preprocessing import preprocess_image
+
+
+def worksheet(seed: int) -> Image.Image:
+    """A printed 'problem': lines of dark blocks on light paper, laid out by the seed"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (1600, 1200), (240, 238, 230))
+    draw = ImageDraw.Draw(image)
+    for row in range(12):
+        x = 300
+        while x < 1300:
+            width = rng.randint(20, 120)
+            draw.rectangle((x, 300 + row * 50, x + width, 330 + row * 50), fill=(25, 25, 25))
+            x += width + rng.randint(10, 40)
+    return image
+
+
+def numbered_worksheet(numbers: str) -> Image.Image:
+    """The same printed layout with different numbers filled in"""
+    image = worksheet(1)
+    draw = ImageDraw.Draw(image)
+    for row in range(3):
+        draw.text((900, 334 + row * 100), f"v = {numbers} m/s", fill=(25, 25, 25))  # In the gaps between lines
+    return image
+
+
+def rephotograph(image: Image.Image) -> Image.Image:
+    """Another photo of the same page: darker, slightly rotated and rescaled"""
+    image = ImageEnhance.Brightness(image).enhance(0.85)
+    image = image.rotate(1.0, fillcolor=(200, 198, 190))
+    return image.resize((1500, 1125))
+
+
+def jpeg(image: Image.Image) -> bytes:
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=80)
+    return out.getvalue()
+
+
+class TestFingerprint:
+    def test_same_page_is_near_and_other_pages_are_far(self):
+        original = preprocess_image(jpeg(worksheet(1))).fingerprint
+        again = preprocess_image(jpeg(rephotograph(worksheet(1)))).fingerprint
+        other = preprocess_image(jpeg(worksheet(2))).fingerprint
+
+        assert hamming(original[0], again[0]) <= 6 and hamming(original[1], again[1]) <= 10
+        assert hamming(original[0], other[0]) > 6 and hamming(original[1], other[1]) > 10
+
+    def test_hashes_are_64_bit(self):
+        dhash, phash = fingerprint(worksheet(3).convert('L'))
+        assert 0 <= dhash < 1 << 64 and 0 <= phash < 1 << 64
+
+
+class TestImageHashCache:
+    @pytest.fixture(autouse=True)
+    def clear(self):
+        caches['default'].clear()
+
+    def test_near_duplicates_hit(self):
+        cache = ImageHashCache(max_distance=6, max_phash_distance=10)
+        cache.set((0b1011 << 60, 0xFFFF), 'text:a', 'stored solution')
+
+        # Three bits off on the dHash, eight on the pHash
+        assert cache.get(((0b1011 << 60) ^ 0b111, 0xFFFF ^ 0xFF), 'text:a') == 'stored solution'
+        assert cache.get(((0b1011 << 60) ^ 0xFF, 0xFFFF), 'text:a') is None
+        assert cache.get((0b1011 << 60, 0xFFFF ^ 0xFFF), 'text:a') is None
+        assert cache.stats()['hits'] == 1
+
+    def test_closest_entry_wins(self):
+        cache = ImageHashCache(max_distance=6)
+        cache.set((0, 0), 'text:a', 'far')
+        cache.set((0b1, 0), 'text:a', 'near')
+        assert cache.get((0b11, 0), 'text:a') == 'near'
+
+    def test_band_lists_are_bounded(self):
+        cache = ImageHashCache(bucket_size=2)
+        for i in range(1, 5):
+            cache.set((i << 56, 0), 'text:a', f"solution {i}")
+        # Every entry shares the low bands; only the newest two stay indexed there
+        assert len(caches['default'].get('imghash:band:0:00')) == 2
+
+    def test_disabled_cache_never_hits(self):
+        cache = ImageHashCache(alias=None)
+        cache.set((1, 1), 'text:a', 'solution')
+        assert cache.get((1, 1), 'text:a') is None
+
+    def test_same_layout_with_different_numbers_misses(self):
+        """Pages that only differ in their numbers hash alike, but never share a solution"""
+        first = preprocess_image(jpeg(numbered_worksheet('20')))
+        second = preprocess_image(jpeg(numbered_worksheet('45')))
+        assert hamming(first.fingerprint[0], second.fingerprint[0]) <= 6
+        assert hamming(first.fingerprint[1], second.fingerprint[1]) <= 10
+
+        cache = ImageHashCache()
+        cache.set(first.fingerprint, content_key(first.data), 'v is 20 m/s')
+        assert cache.get(second.fingerprint, content_key(second.data)) is None
+        # An OCR reading of the numbers tells them apart too
+        cache.set(first.fingerprint, content_key(first.data, 'v = 20 m/s'), 'v is 20 m/s')
+        assert cache.get(second.fingerprint, content_key(second.data, 'v = 45 m/s')) is None
+        assert cache.stats()['hits'] == 0
+
+    def test_rephotographed_page_hits_when_its_numbers_match(self):
+        original = preprocess_image(jpeg(numbered_worksheet('20')))
+        again = preprocess_image(jpeg(rephotograph(numbered_worksheet('20'))))
+
+        cache = ImageHashCache()
+        cache.set(original.fingerprint, content_key(original.data, 'v = 20 m/s'), 'v is 20 m/s')
+        # Different bytes alone don't confirm a hit; the same numbers read from both photos do
+        assert cache.get(again.fingerprint, content_key(again.data)) is None
+        assert cache.get(again.fingerprint, content_key(again.data, 'v = 20 m/s')) == 'v is 20 m/s'
+
+    def test_content_key(self):
+        assert content_key(b'a', 'v = 20 m/s') == content_key(b'b', 'v  =  20 m/s')
+        assert content_key(b'a', 'v = 20 m/s') != content_key(b'a', 'v = 20 km/s')
+        # A reading without numbers isn't evidence; fall back to the exact bytes
+        assert content_key(b'a', 'prove it') == content_key(b'a') != content_key(b'b')
+
+    def test_distance_must_fit_the_bands(self):
+        with pytest.raises(ValueError):
+            ImageHashCache(max_distance=8)
@@ -0,0 +1,121 @@
+import asyncio
+import io
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from PIL import Image, ImageDraw
+
+from main.utils import image_ocr
+from main.utils.image_ocr import ImageTextReader, OcrResult
+
+
+def page(rule=None):
+    """A blank page, optionally with a horizontal rule (x0, y, x1) drawn on it"""
+    image = Image.new('L', (400, 200), 255)
+    if rule:
+        ImageDraw.Draw(image).line((rule[0], rule[1], rule[2], rule[1]), fill=0, width=2)
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def tesseract(words):
+    """A stand-in pytesseract returning image_to_data rows for (text, conf, line, left, top, width, height)"""
+    columns = ('text', 'conf', 'line_num', 'left', 'top', 'width', 'height')
+    data = {column: [word[i] for word in words] for i, column in enumerate(columns)}
+    data['block_num'] = data['par_num'] = [1] * len(words)
+    return SimpleNamespace(image_to_data=mock.Mock(return_value=data), Output=SimpleNamespace(DICT='dict'))
+
+
+def line(number, top, *texts, conf=95, height=20):
+    return [(text, conf, number, 10 + 70 * i, top, 60, height) for i, text in enumerate(texts)]
+
+
+PRINTED = OcrResult("A block of mass 2 kg slides down a smooth incline of angle 30°. Find its acceleration.", 93.0, 16)
+
+
+class TestImageTextReader:
+    @pytest.fixture
+    def reader(self):
+        reader = ImageTextReader(min_confidence=85, min_words=4)
+        reader._available = True
+        return reader
+
+    def test_confident_printed_text_is_accepted(self, reader):
+        assert reader.accepts(PRINTED)
+
+    @pytest.mark.parametrize('result', [
+        None,
+        OcrResult(PRINTED.text, 70.0, 16),  # Low confidence
+        OcrResult("x = 2", 96.0, 3),  # Too little text
+        OcrResult("~~§ ¤¤ ‡‡ @@ ¶¶ ~~ §§ ¤¤", 90.0, 8),  # Garbled symbols
+        OcrResult(PRINTED.text, 93.0, 16, numeric_confidence=60.0),  # One shaky number
+        OcrResult(PRINTED.text, 93.0, 16, math_layout=True),
+        OcrResult("Find the value of V(x + 1) when x = 3", 95.0, 10),  # A radical read as V
+        OcrResult("Evaluate x² + 3x when x = 2", 95.0, 7),
+    ])
+    def test_weak_readings_fall_back_to_vision(self, reader, result):
+        assert not reader.accepts(result)
+
+    def test_read_runs_in_the_pool_and_counts_outcomes(self, reader):
+        with mock.patch.object(reader, '_ocr', return_value=PRINTED):
+            assert asyncio.run(reader.read(b'jpeg')) == PRINTED
+        with mock.patch.object(reader, '_ocr', side_effect=RuntimeError('Tesseract process timeout')):
+            assert asyncio.run(reader.read(b'jpeg')) is None
+
+        stats = reader.stats()
+        assert stats['accepted'] == 1 and stats['failed'] == 1
+        assert stats['avg_confidence'] == 93.0
+        assert 'p95_latency_ms' in stats
+
+    def test_missing_engine_disables_ocr(self):
+        reader = ImageTextReader()
+        with mock.patch.object(image_ocr, 'pytesseract', None):
+            assert not reader.available
+            assert asyncio.run(reader.read(b'jpeg')) is None
+
+    def test_disabled_reader_is_unavailable(self):
+        assert not ImageTextReader(enabled=False).available
+
+
+class TestMathLayout:
+    @pytest.fixture
+    def reader(self):
+        return ImageTextReader(min_confidence=85, min_words=4)
+
+    def read(self, reader, words, image=None):
+        with mock.patch.object(image_ocr, 'pytesseract', tesseract(words)):
+            return reader._ocr(image or page())
+
+    def test_plain_lines_are_flat(self, reader):
+        result = self.read(reader, line(1, 20, 'A', 'car', 'moves', 'at') + line(2, 60, '20', 'm/s', 'for', '5', 's'))
+
+        assert result.text == 'A car moves at\n20 m/s for 5 s'
+        assert result.words == 9 and not result.math_layout
+        assert reader.accepts(result)
+
+    def test_numeric_confidence_is_the_weakest_number(self, reader):
+        words = line(1, 20, 'Find', 'x', 'if', 'x', '+') + line(2, 60, '17', conf=62) + line(3, 100, '=', '40')
+        result = self.read(reader, words)
+
+        assert result.numeric_confidence == 62
+        assert result.confidence > 85
+        assert not reader.accepts(result)
+
+    def test_superscript_is_layout(self, reader):
+        # 'x' then a small '2' raised above the line: x²
+        words = line(1, 40, 'Evaluate', 'x', '+', '1') + [('2', 95, 1, 160, 28, 10, 10)]
+        assert self.read(reader, words).math_layout
+
+    def test_rule_between_lines_is_a_fraction(self, reader):
+        words = line(1, 20, 'numerator', 'over') + line(2, 80, 'the', 'denominator')
+        assert self.read(reader, words, page(rule=(20, 60, 120))).math_layout
+
+    def test_rule_read_as_dashes_is_a_fraction(self, reader):
+        words = line(1, 20, 'a', '+', 'b') + line(2, 45, '———') + line(3, 70, 'c', 'd')
+        assert self.read(reader, words).math_layout
+
+    def test_stray_mark_between_lines_is_not_a_rule(self, reader):
+        words = line(1, 20, 'A', 'block', 'of', 'mass') + line(2, 80, '2', 'kg', 'rests', 'here')
+        assert not self.read(reader, words, page(rule=(20, 60, 26))).math_layout
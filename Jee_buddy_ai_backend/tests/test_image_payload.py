@@ -0,0 +1,96 @@
+import asyncio
+import base64
+import io
+import os
+import tracemalloc
+
+import pytest
+
+
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from PIL import Image
+
+from main.utils.image_payload import ImagePayload, to_data_url
+from main.utils.image_preprocessing import prepare_image
+
+
+def phone_photo() -> bytes:
+    """A ~12 MP noisy JPEG, roughly what a phone camera uploads"""
+    image = Image.effect_noise((4000, 3000), 40).convert('RGB')
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+
+def disk_upload(data: bytes) -> TemporaryUploadedFile:
+    upload = TemporaryUploadedFile('photo.jpg', 'image/jpeg', len(data), None)
+    upload.write(data)
+    upload.flush()
+    return upload
+
+
+def peak_allocated(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestImagePayload:
+    def test_repr_never_contains_the_image(self):
+        payload = ImagePayload.from_upload(SimpleUploadedFile('p.jpg', b'\xff\xd8\xff' + b'x' * 10000, 'image/jpeg'))
+        logged = f"Context received: {{'image': {payload!r}}}"
+        assert len(logged) < 100
+        assert 'xxxx' not in logged
+
+    def test_disk_uploads_are_not_read_until_needed(self):
+        payload = ImagePayload.from_upload(disk_upload(b'\xff\xd8\xff' + b'x' * 1000))
+        assert payload.path and os.path.exists(payload.path)
+        assert payload.size == 1003
+        assert payload.read()[:3] == b'\xff\xd8\xff'
+
+    def test_base64_and_data_urls_are_decoded(self):
+        encoded = base64.b64encode(b'GIF89a...').decode()
+        assert ImagePayload.from_base64(encoded).read() == b'GIF89a...'
+        payload = ImagePayload.from_base64(f"data:image/gif;base64,{encoded}")
+        assert payload.content_type == 'image/gif'
+        with pytest.raises(ValueError):
+            ImagePayload.from_base64('not base64!')
+
+    def test_stray_characters_are_rejected_not_dropped(self):
+        encoded = base64.b64encode(b'GIF89a...').decode()
+        with pytest.raises(ValueError):
+            ImagePayload.from_base64(f"{encoded[:4]}*{encoded[4:]}")
+        wrapped = '\n'.join(encoded[i:i + 4] for i in range(0, len(encoded), 4))
+        assert ImagePayload.from_base64(wrapped).read() == b'GIF89a...'
+
+    def test_data_url_round_trips(self):
+        url = to_data_url(b'\x00\x01\x02', 'image/png')
+        assert url == 'data:image/png;base64,AAEC'
+
+
+class TestMemoryBenchmark:
+    def test_solve_path_holds_fewer_copies(self):
+        photo = phone_photo()
+
+        def before():
+            # read() -> base64 str -> context logged in full -> f-string data URL
+            image = base64.b64encode(SimpleUploadedFile('p.jpg', photo).read()).decode('utf-8')
+            context = {'image': image}
+            logged = f"Context received: {context}"
+            url = f"data:image/png;base64,{context['image']}"
+            return logged, url
+
+        def after():
+            # Disk-backed upload -> short repr in the log -> preprocessed once -> one data URL
+            context = {'image': ImagePayload.from_upload(disk_upload(photo))}
+            logged = f"Context received: {context}"
+            url = asyncio.run(prepare_image(context['image'])).data_url()
+            return logged, url
+
+        old_peak, new_peak = peak_allocated(before), peak_allocated(after)
+        print(f"\nphoto {len(photo) // 1024} KB: peak {old_peak // 1024} KB before, {new_peak // 1024} KB after")
+        assert old_peak > 4 * len(photo)
+        assert new_peak < len(photo)
@@ -0,0 +1,117 @@
+import asyncio
+import io
+
+import pytest
+
+
+from django.test import override_settings
+from PIL import Image, ImageDraw
+
+from main.utils.image_preprocessing import prepare_image, preprocess_image, size_limits, sniff_mime_type
+
+
+def photo(width=4000, height=3000, orientation=None) -> bytes:
+    """A phone-sized JPEG: light paper with a block of 'writing' in the middle"""
+    image = Image.new('RGB', (width, height), (235, 232, 225))
+    draw = ImageDraw.Draw(image)
+    for row in range(10):
+        top = height // 3 + row * 60
+        draw.rectangle((width // 3, top, 2 * width // 3, top + 25), fill=(20, 20, 30))
+    out = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(out, format='JPEG', quality=92, exif=exif)
+    return out.getvalue()
+
+
+def diagram(width=1600, height=1200) -> bytes:
+    """A colour-coded graph: red and blue curves with a green shaded region"""
+    image = Image.new('RGB', (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((200, 600, 700, 1000), fill=(120, 220, 120))
+    for offset, colour in ((0, (220, 30, 30)), (200, (30, 60, 220))):
+        draw.line([(100 + x, 900 - offset - (x * x) // 2000) for x in range(0, 1400, 20)], fill=colour, width=12)
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=92)
+    return out.getvalue()
+
+
+def transparent(label, mode='RGBA') -> bytes:
+    """A screenshot-style PNG: black text on a fully transparent background"""
+    image = Image.new('RGBA', (600, 200), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text((20, 80), label, fill=(0, 0, 0, 255))
+    if mode == 'P':
+        image = image.convert('P')  # PIL keeps the transparent index in info['transparency']
+    elif mode == 'LA':
+        image = image.convert('LA')
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+class TestPreprocessImage:
+    def test_output_fits_the_provider_resolution(self):
+        prepared = preprocess_image(photo())
+        assert prepared.mime_type == 'image/jpeg'
+        assert max(prepared.width, prepared.height) <= 2048
+        assert min(prepared.width, prepared.height) <= 768
+        assert Image.open(io.BytesIO(prepared.data)).mode == 'L'
+
+    def test_crops_to_the_content(self):
+        prepared = preprocess_image(photo(width=1200, height=900))
+        # The writing spans a third of the width; the crop keeps it plus a margin
+        assert prepared.width < 600
+        assert prepared.height < 900
+
+    def test_exif_orientation_is_applied(self):
+        upright = preprocess_image(photo(width=1200, height=900))
+        rotated = preprocess_image(photo(width=1200, height=900, orientation=6))
+        assert rotated.width == pytest.approx(upright.height, abs=2)
+        assert rotated.height == pytest.approx(upright.width, abs=2)
+
+    def test_colour_diagrams_keep_their_colour(self):
+        prepared = preprocess_image(diagram())
+        assert Image.open(io.BytesIO(prepared.data)).mode == 'RGB'
+        assert prepared.fingerprint == preprocess_image(diagram()).fingerprint
+
+    @pytest.mark.parametrize('mode', ['RGBA', 'LA', 'P'])
+    def test_transparent_images_are_flattened_onto_white(self, mode):
+        prepared = preprocess_image(transparent('x = 2y + 3', mode))
+        lightest, darkest = Image.open(io.BytesIO(prepared.data)).convert('L').getextrema()[::-1]
+        assert lightest > 240 and darkest < 60
+        assert prepared.data != preprocess_image(transparent('v = u + at', mode)).data
+
+    @override_settings(IMAGE_COLOR_CHROMA_THRESHOLD=255)
+    def test_colour_can_be_turned_off(self):
+        assert Image.open(io.BytesIO(preprocess_image(diagram()).data)).mode == 'L'
+
+    @override_settings(IMAGE_MODEL_SIZE_LIMITS={'small-vision': (1024, 512)},
+                       IMAGE_MAX_LONG_SIDE=2048, IMAGE_MAX_SHORT_SIDE=768)
+    def test_size_limits_are_per_model(self):
+        assert size_limits('small-vision') == (1024, 512)
+        assert size_limits('unlisted-model') == (2048, 768)
+
+        prepared = preprocess_image(photo(), model='small-vision')
+        assert max(prepared.width, prepared.height) <= 1024
+        assert min(prepared.width, prepared.height) <= 512
+
+    def test_garbage_is_rejected(self):
+        with pytest.raises(ValueError):
+            preprocess_image(b'not an image')
+
+
+class TestPrepareImage:
+    def test_large_photos_shrink(self):
+        original = photo()
+        prepared = asyncio.run(prepare_image(original))
+        assert len(prepared.data) < len(original)
+
+    def test_falls_back_to_the_original(self):
+        prepared = asyncio.run(prepare_image(b'not an image'))
+        assert prepared.data == b'not an image'
+        assert prepared.mime_type == 'image/png'
+
+    def test_mime_type_sniffing(self):
+        assert sniff_mime_type(photo(64, 64)) == 'image/jpeg'
+        assert sniff_mime_type(b'GIF89a...') == 'image/gif'
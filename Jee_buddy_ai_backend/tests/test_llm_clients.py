@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from main.utils import llm_clients
+
+
+class TestPooledClients:
+    @pytest.fixture(autouse=True)
+    def api_keys(self, monkeypatch):
+        monkeypatch.setenv('GROQ_DEEPSEEK_API_KEY', 'test-groq-key')
+        monkeypatch.setenv('OPENAI_API_KEY', 'test-openai-key')
+        yield
+        llm_clients.close_clients()
+
+    def test_sync_client_is_built_once_per_provider(self):
+        groq = llm_clients.get_client('groq')
+        assert llm_clients.get_client('groq') is groq
+        assert llm_clients.get_client('openai') is not groq
+
+    def test_sync_client_shares_one_connection_pool(self):
+        client = llm_clients.get_client('groq')
+        assert client._client is llm_clients.get_client('groq')._client
+        assert client.max_retries == 0
+
+    async def test_async_client_is_reused_within_a_loop(self):
+        client = llm_clients.get_async_client('groq')
+        assert llm_clients.get_async_client('groq') is client
+
+    def test_async_clients_are_per_event_loop(self):
+        async def build():
+            return llm_clients.get_async_client('groq')
+
+        first, second = asyncio.run(build()), asyncio.run(build())
+        assert first is not second
+
+    def test_unknown_provider(self):
+        with pytest.raises(ValueError):
+            llm_clients.get_client('nope')
+
+    def test_missing_api_key(self, monkeypatch):
+        monkeypatch.delenv('OPENAI_API_KEY')
+        llm_clients.close_clients()
+        with pytest.raises(ValueError):
+            llm_clients.get_client('openai')
@@ -0,0 +1,58 @@
+from unittest import mock
+
+import pytest
+
+
+from main.utils.long_term_memory import LocalMemoryBackend, LongTermMemory
+
+
+USER = 'user-1'
+
+
+class TestLongTermMemory:
+    @pytest.fixture
+    def memory(self):
+        return LongTermMemory(LocalMemoryBackend(), top_k=2, token_budget=50)
+
+    def remember(self, memory, *notes):
+        for note in notes:
+            memory.remember(USER, [{"role": "user", "content": note}])
+        memory.drain()
+
+    @pytest.mark.asyncio
+    async def test_recall_is_ranked_by_relevance(self, memory):
+        self.remember(
+            memory,
+            "Struggles with integration by parts",
+            "Prefers short answers",
+            "Asked about integration of trigonometric functions",
+        )
+
+        memories = await memory.recall(USER, "integration of sin x cos x")
+        assert memories == [
+            "Asked about integration of trigonometric functions",
+            "Struggles with integration by parts",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_recall_respects_token_budget(self, memory):
+        self.remember(memory, "limits " * 30, "limits " * 30)
+        assert len(await memory.recall(USER, "limits")) == 1
+
+    @pytest.mark.asyncio
+    async def test_recall_is_cached_until_next_write(self, memory):
+        self.remember(memory, "Working on projectile motion")
+        with mock.patch.object(memory.backend, 'search', wraps=memory.backend.search) as search:
+            await memory.recall(USER, "projectile motion range")
+            await memory.recall(USER, "projectile motion range")
+            assert search.call_count == 1
+
+            self.remember(memory, "Projectile motion on an incline is next")
+            assert len(await memory.recall(USER, "projectile motion range")) == 2
+            assert search.call_count == 2
+
+    def test_remember_does_not_wait_for_the_backend(self, memory):
+        """Writes are queued; a failing backend never reaches the caller"""
+        with mock.patch.object(memory.backend, 'add', side_effect=Exception("mem0 down")):
+            memory.remember(USER, [{"role": "user", "content": "hello"}])
+            memory.drain()
@@ -0,0 +1,47 @@
+from unittest import mock
+
+import pytest
+
+
+from django.core.cache import caches
+
+from main.utils.profile_cache import ProfileCache
+
+
+USER = '11111111-1111-1111-1111-111111111111'
+PROFILE = {'id': USER, 'name': 'a', 'payment_status': '', 'total_tokens': 40}
+
+
+class TestProfileCache:
+    @pytest.fixture
+    def cache(self):
+        caches['default'].clear()
+        return ProfileCache(local_ttl=60, shared_ttl=60, shared_alias='default')
+
+    def test_repeated_lookups_hit_the_cache(self, cache):
+        load = mock.Mock(return_value=dict(PROFILE))
+        assert cache.get(USER, load) == PROFILE
+        assert cache.get(USER, load) == PROFILE
+        load.assert_called_once_with(USER)
+
+    def test_shared_tier_serves_other_workers(self, cache):
+        cache.get(USER, lambda _: dict(PROFILE))
+        other_worker = ProfileCache(local_ttl=60, shared_ttl=60, shared_alias='default')
+        load = mock.Mock()
+        assert other_worker.get(USER, load) == PROFILE
+        load.assert_not_called()
+
+    def test_invalidate_clears_both_tiers_and_lookups(self, cache):
+        cache.get(USER, lambda _: dict(PROFILE), lookup='id')
+        cache.get(USER, lambda _: dict(PROFILE), lookup='uuid')
+        cache.invalidate(USER)
+
+        updated = {**PROFILE, 'payment_status': 'completed'}
+        assert cache.get(USER, lambda _: updated, lookup='id') == updated
+        assert cache.get(USER, lambda _: updated, lookup='uuid') == updated
+
+    def test_missing_profiles_are_not_cached(self, cache):
+        load = mock.Mock(return_value=None)
+        assert cache.get(USER, load) is None
+        assert cache.get(USER, load) is None
+        assert load.call_count == 2
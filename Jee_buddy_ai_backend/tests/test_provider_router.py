@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from main.utils.provider_router import (
+    CLOSED, HALF_OPEN, OPEN, AllProvidersFailed, Candidate, ProviderRouter, RouteHealth
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProvider:
+    """Answers after `delay` seconds, or raises when `fail` is set"""
+
+    def __init__(self, name, delay=0.0, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    def candidate(self):
+        return Candidate(self.name, self.complete)
+
+    async def complete(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise ConnectionError(f"{self.name} down")
+        return self.name
+
+    async def stream(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError(f"{self.name} down")
+        for part in ('a', 'b'):
+            yield f"{self.name}:{part}"
+
+
+class TestRouteHealth:
+    def test_opens_on_error_rate_and_probes_after_cooldown(self):
+        clock = FakeClock()
+        health = RouteHealth(window=10, error_rate=0.5, min_samples=4, cooldown=30, clock=clock)
+        for ok in (True, False, True, False):
+            health.record(1.0, ok)
+        assert health.state == OPEN
+        assert not health.acquire()
+
+        clock.now = 31
+        assert health.state == HALF_OPEN
+        assert health.acquire()
+        assert not health.acquire()  # One probe at a time
+
+        health.record(0.5, True)
+        assert health.state == CLOSED
+        assert health.error_rate() == 0.0
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        health = RouteHealth(min_samples=1, cooldown=30, clock=clock)
+        health.record(1.0, False)
+        clock.now = 31
+        assert health.acquire()
+        health.record(1.0, False)
+        assert health.state == OPEN
+
+    def test_p95_ignores_failures(self):
+        health = RouteHealth(window=200, min_samples=1000)
+        for latency in range(1, 101):
+            health.record(float(latency), True)
+        health.record(500.0, False)
+        assert health.p95() == 95.0
+
+
+class TestProviderRouter:
+    def test_falls_back_in_preference_order(self):
+        router = ProviderRouter()
+        primary, fallback = FakeProvider('groq', fail=True), FakeProvider('openai')
+        assert asyncio.run(router.call([primary.candidate(), fallback.candidate()])) == 'openai'
+        assert (primary.calls, fallback.calls) == (1, 1)
+
+    def test_open_circuit_is_skipped(self):
+        router = ProviderRouter(min_samples=2)
+        primary, fallback = FakeProvider('groq', fail=True), FakeProvider('openai')
+        for _ in range(2):
+            asyncio.run(router.call([primary.candidate(), fallback.candidate()]))
+        assert router.health('groq').state == OPEN
+
+        asyncio.run(router.call([primary.candidate(), fallback.candidate()]))
+        assert (primary.calls, fallback.calls) == (2, 3)
+
+    def test_all_failures_are_reported(self):
+        router = ProviderRouter()
+        with pytest.raises(AllProvidersFailed) as error:
+            asyncio.run(router.call([FakeProvider('groq', fail=True).candidate(),
+                                     FakeProvider('openai', fail=True).candidate()]))
+        assert set(error.value.errors) == {'groq', 'openai'}
+
+    def test_hedges_slow_primary_after_its_p95(self):
+        router = ProviderRouter(hedge=True, hedge_min_delay=0.01, hedge_max_delay=0.05)
+        slow, fast = FakeProvider('groq', delay=1.0), FakeProvider('openai', delay=0.01)
+        assert asyncio.run(router.call([slow.candidate(), fast.candidate()])) == 'openai'
+        assert slow.cancelled == 1
+        # The cancelled loser isn't counted as a provider failure
+        assert router.health('groq').error_rate() == 0.0
+
+    def test_fast_primary_is_not_hedged(self):
+        router = ProviderRouter(hedge=True, hedge_min_delay=0.05, hedge_max_delay=0.1)
+        primary, fallback = FakeProvider('groq', delay=0.0), FakeProvider('openai')
+        assert asyncio.run(router.call([primary.candidate(), fallback.candidate()])) == 'groq'
+        assert fallback.calls == 0
+
+    def test_stream_fails_over_before_first_item(self):
+        router = ProviderRouter()
+        primary, fallback = FakeProvider('groq', fail=True), FakeProvider('openai')
+
+        async def collect():
+            return [item async for item in router.stream([
+                Candidate('groq', primary.stream), Candidate('openai', fallback.stream)
+            ])]
+
+        assert asyncio.run(collect()) == ['openai:a', 'openai:b']
+        assert router.health('groq').error_rate() == 1.0
@@ -0,0 +1,71 @@
+import pytest
+
+
+from main.utils.question_router import DEEP, FORMULA, SMALL, STANDARD, QuestionRouter, lookup_formula
+
+
+class TestQuestionRouter:
+    @pytest.fixture
+    def router(self):
+        return QuestionRouter(small_model='small-model')
+
+    @pytest.mark.parametrize('question, route', [
+        ("What is the formula of kinetic energy?", FORMULA),
+        ("formula for the area of a circle", STANDARD),  # Not phrased as a lookup
+        ("state ohm's law", FORMULA),
+        ("what is kinetic energy", SMALL),
+        ("what is the SI unit of force", SMALL),
+        ("find the kinetic energy of a 2 kg ball moving at 3 m/s", STANDARD),
+        ("what is the formula of kinetic energy when mass doubles", STANDARD),
+        ("solve x^2 + 3x + 2 = 0", STANDARD),
+    ])
+    def test_classification(self, router, question, route):
+        assert router.classify(question, {'deep_think': False}) == route
+
+    def test_context_dependent_questions_are_not_downgraded(self, router):
+        assert router.classify("what is kinetic energy", {'selected_text': 'some passage'}) == STANDARD
+        assert router.classify("what is kinetic energy", {}, has_image=True) == STANDARD
+
+    @pytest.mark.parametrize('interaction_type', ['explain', 'test', 'similar', 'basics', 'keypoints'])
+    def test_only_the_solve_mode_is_routed_locally(self, router, interaction_type):
+        context = {'interaction_type': interaction_type}
+        assert router.classify("What is the formula of kinetic energy?", context) == STANDARD
+        assert router.classify("what is kinetic energy", context) == STANDARD
+        assert router.classify("what is kinetic energy", {**context, 'deep_think': True}) == DEEP
+
+    def test_solve_mode_is_routed_locally(self, router):
+        assert router.classify("What is the formula of kinetic energy?", {'interaction_type': 'solve'}) == FORMULA
+        assert router.classify("what is kinetic energy", {'interaction_type': 'solve'}) == SMALL
+
+    @pytest.mark.parametrize('interaction_type, answered', [
+        ('solve', True), ('explain', False), ('test', False), ('similar', False),
+    ])
+    def test_agent_answers_locally_only_when_solving(self, math_agent, interaction_type, answered):
+        answer = math_agent._answer_locally(
+            "What is the formula of kinetic energy?", {'interaction_type': interaction_type}
+        )
+        assert (answer is not None) == answered
+
+    def test_deep_think_always_uses_the_full_model(self, router):
+        assert router.classify("what is the formula of kinetic energy", {'deep_think': True}) == DEEP
+        assert router.classify("what is kinetic energy", {'interaction_type': 'solve', 'deep_think': True}) == DEEP
+        assert router.classify("prove that root 2 is irrational", {'deep_think': True}) == DEEP
+
+    def test_small_route_overrides_the_model(self, router):
+        assert router.model_config(SMALL, False)['model'] == 'small-model'
+        assert router.model_config(STANDARD, False) is None
+
+    def test_formula_lookup_uses_aliases(self):
+        assert 'F = ma' in lookup_formula("what is the formula of newton's second law")
+        assert lookup_formula("what is the formula of happiness") is None
+
+    def test_counters_track_latency_tokens_and_cost(self, router):
+        router.record(SMALL, 'llama-3.1-8b-instant', 0.2, {'prompt_tokens': 1_000_000, 'completion_tokens': 0})
+        router.record(SMALL, 'llama-3.1-8b-instant', 0.4, {'prompt_tokens': 0, 'completion_tokens': 1_000_000})
+        router.record(FORMULA, None, 0.001)
+
+        stats = router.stats()
+        assert stats[SMALL]['requests'] == 2
+        assert stats[SMALL]['avg_latency_ms'] == pytest.approx(300.0)
+        assert stats[SMALL]['cost_usd'] == pytest.approx(0.13)
+        assert stats[FORMULA]['cost_usd'] == 0
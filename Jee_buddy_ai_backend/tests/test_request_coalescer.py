@@ -0,0 +1,118 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from django.test import override_settings
+
+from main.utils.request_coalescer import RequestCoalescer
+
+
+class TestRequestCoalescer:
+    def test_identical_requests_share_one_call(self):
+        coalescer = RequestCoalescer()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'answer'
+
+        async def run():
+            return await asyncio.gather(*(coalescer.run('q', compute) for _ in range(10)))
+
+        results = asyncio.run(run())
+        assert [value for value, _ in results] == ['answer'] * 10
+        assert [leader for _, leader in results].count(True) == 1
+        assert len(calls) == 1
+        assert coalescer.stats == {'leaders': 1, 'followers': 9}
+
+    def test_different_keys_are_not_coalesced(self):
+        coalescer = RequestCoalescer()
+
+        async def run():
+            return await asyncio.gather(
+                coalescer.run('a', lambda: asyncio.sleep(0.01, 'a')),
+                coalescer.run('b', lambda: asyncio.sleep(0.01, 'b')),
+            )
+
+        assert asyncio.run(run()) == [('a', True), ('b', True)]
+
+    def test_cancelled_leader_does_not_cancel_followers(self):
+        coalescer = RequestCoalescer()
+
+        async def run():
+            leader = asyncio.ensure_future(coalescer.run('q', lambda: asyncio.sleep(0.05, 'answer')))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(coalescer.run('q', lambda: asyncio.sleep(0, 'other')))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        assert asyncio.run(run()) == ('answer', False)
+
+    def test_errors_fan_out_and_clear_the_key(self):
+        coalescer = RequestCoalescer()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('provider down')
+
+        async def run():
+            results = await asyncio.gather(*(coalescer.run('q', fail) for _ in range(3)), return_exceptions=True)
+            assert coalescer.join('q') is None
+            return results
+
+        assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+    def test_abandoned_claim_lets_followers_compute(self):
+        coalescer = RequestCoalescer()
+
+        async def run():
+            claimed = coalescer.claim('q')
+            follower = asyncio.ensure_future(coalescer.run('q', lambda: asyncio.sleep(0, 'own')))
+            await asyncio.sleep(0)
+            coalescer.abandon(claimed)
+            return await follower
+
+        assert asyncio.run(run()) == ('own', True)
+
+    def test_claim_result_reaches_followers(self):
+        coalescer = RequestCoalescer()
+
+        async def run():
+            claimed = coalescer.claim('q')
+            follower = asyncio.ensure_future(coalescer.run('q', lambda: asyncio.sleep(0, 'own')))
+            await asyncio.sleep(0)
+            claimed.set_result('streamed')
+            return await follower
+
+        assert asyncio.run(run()) == ('streamed', False)
+
+
+@pytest.mark.usefixtures('db')
+class TestAgentCoalescing:
+    @override_settings(ANSWER_CACHE_ENABLED=False)
+    async def test_leader_prompt_carries_no_user_context(self, math_agent):
+        math_agent.memory = mock.Mock(
+            recall=mock.AsyncMock(side_effect=lambda user_id, question: [f"{user_id} prefers cricket examples"]),
+        )
+        prompts, release = [], asyncio.Event()
+
+        async def api_call(messages, model_config, context=None, usage=None):
+            prompts.append(str(messages))
+            await release.wait()
+            return "shared answer"
+
+        math_agent._make_api_call = api_call
+        question = "Find the escape velocity from the surface of the Earth"
+        solves = [
+            asyncio.ensure_future(math_agent.solve(question, {'user_id': user_id, 'session_id': 's1'}))
+            for user_id in ('alice', 'bob')
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        answers = await asyncio.gather(*solves)
+
+        assert [answer['solution'] for answer in answers] == ["shared answer"] * 2
+        assert len(prompts) == 1 and 'alice' not in prompts[0] and 'bob' not in prompts[0]
+        math_agent.memory.recall.assert_not_called()
@@ -0,0 +1,57 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+
+from main import scheduler
+
+
+@pytest.fixture(autouse=True)
+def clean_scheduler(monkeypatch):
+    caches['default'].clear()
+    monkeypatch.setattr(scheduler, 'scheduler', None)
+    yield
+    caches['default'].clear()
+
+
+class TestJobGates:
+    @override_settings(SCHEDULER_ENABLED=True, CHAT_HISTORY_RETENTION_ENABLED=False,
+                       ANSWER_CACHE_PERSIST=False, IMAGE_STORE_GC_ENABLED=True)
+    def test_each_job_has_its_own_setting(self):
+        assert scheduler.enabled_jobs() == ['collect_image_garbage']
+
+    @override_settings(SCHEDULER_ENABLED=True, CHAT_HISTORY_RETENTION_ENABLED=False,
+                       ANSWER_CACHE_PERSIST=False, IMAGE_STORE_GC_ENABLED=True)
+    def test_image_gc_runs_without_history_retention(self):
+        background = mock.MagicMock()
+        background.return_value.get_job.return_value = None
+        with mock.patch.object(scheduler, 'BackgroundScheduler', background), \
+                mock.patch.object(scheduler, 'DjangoJobStore'):
+            scheduler.start()
+
+        instance = background.return_value
+        assert [call.kwargs['id'] for call in instance.add_job.call_args_list] == ['collect_image_garbage']
+        instance.start.assert_called_once()
+
+    @override_settings(SCHEDULER_ENABLED=False, IMAGE_STORE_GC_ENABLED=True)
+    def test_disabled_process_starts_no_scheduler(self):
+        with mock.patch.object(scheduler, 'BackgroundScheduler') as background:
+            scheduler.start()
+        background.assert_not_called()
+
+
+class TestRunJob:
+    def test_one_process_runs_a_job_per_interval(self):
+        job = mock.Mock(return_value=3)
+        with mock.patch.dict(scheduler.JOBS, {'job': (job, 'SCHEDULER_ENABLED', 'NOT_SET', 60)}):
+            assert scheduler.run_job('job') == 3
+            assert scheduler.run_job('job') is None  # Another worker's turn comes after the lock expires
+        job.assert_called_once()
+
+    def test_runs_when_the_cache_is_down(self):
+        job = mock.Mock(return_value=1)
+        broken = mock.Mock(add=mock.Mock(side_effect=ConnectionError('redis down')))
+        with mock.patch.dict(scheduler.JOBS, {'job': (job, 'SCHEDULER_ENABLED', 'NOT_SET', 60)}), \
+                mock.patch.object(scheduler, 'caches', {'default': broken}):
+            assert scheduler.run_job('job') == 1
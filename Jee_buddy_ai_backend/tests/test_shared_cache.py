@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+
+from django.core.cache import caches
+
+from main.utils import shared_cache
+from main.utils.shared_cache import aget_or_compute, cache_delete, get_or_compute
+
+
+class TestGetOrCompute:
+    @pytest.fixture(autouse=True)
+    def clear(self):
+        caches['default'].clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_compute('k', compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ['value'] * 8
+        assert len(calls) == 1
+
+    def test_waits_for_another_workers_lock(self):
+        caches['default'].add('k:lock', 'other-worker', 30)
+        threading.Timer(0.1, lambda: caches['default'].set('k', 'theirs')).start()
+        compute = mock.Mock(return_value='mine')
+
+        assert get_or_compute('k', compute) == 'theirs'
+        compute.assert_not_called()
+
+    def test_stale_lock_falls_back_to_computing(self):
+        caches['default'].add('k:lock', 'dead-worker', 30)
+        with mock.patch.object(shared_cache, 'WAIT_TIMEOUT', 0.1):
+            assert get_or_compute('k', lambda: 'mine') == 'mine'
+
+    def test_none_is_only_cached_when_asked(self):
+        compute = mock.Mock(return_value=None)
+        get_or_compute('k', compute)
+        get_or_compute('k', compute)
+        assert compute.call_count == 2
+
+        get_or_compute('n', compute, cache_none=True)
+        get_or_compute('n', compute, cache_none=True)
+        assert compute.call_count == 3
+
+        cache_delete('n')
+        get_or_compute('n', compute, cache_none=True)
+        assert compute.call_count == 4
+
+    def test_async_concurrent_misses_compute_once(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        async def run():
+            return await asyncio.gather(*(aget_or_compute('a', compute) for _ in range(5)))
+
+        assert asyncio.run(run()) == ['value'] * 5
+        assert len(calls) == 1
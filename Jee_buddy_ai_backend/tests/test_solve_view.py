@@ -0,0 +1,183 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import connection
+from django.test import AsyncRequestFactory
+
+from main import views
+from main.agents.math_agent import MathAgent
+from main.models import ChatHistory
+from main.agents import math_token_set_limit_agent
+from main.utils.admission import AdmissionController, AdmissionRejected
+from main.utils.token_usage import TokenUsageBuffer
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+class FakeAgent:
+    """Stands in for the shared MathAgent; answers without a provider call"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def solve(self, question, context):
+        self.calls.append((question, context))
+        return {'solution': f"answer to {question}", 'context': {}, 'usage': {'total_tokens': 12}}
+
+    async def solve_stream(self, question, context):
+        self.calls.append((question, context))
+        for part in ('x = ', '4'):
+            yield {'type': 'delta', 'content': part}
+        yield {'type': 'done', 'solution': 'x = 4', 'context': {}, 'usage': {'total_tokens': 12}}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    fake = FakeAgent()
+
+    async def create():
+        return fake
+
+    monkeypatch.setattr(MathAgent, 'create', staticmethod(create))
+    return fake
+
+
+@pytest.fixture
+def usage(monkeypatch):
+    """A private usage buffer, so charged tokens are never flushed to the test database"""
+    buffer = TokenUsageBuffer(flush_interval=3600)
+    monkeypatch.setattr(math_token_set_limit_agent, 'usage_buffer', buffer)
+    return buffer
+
+
+@pytest.fixture
+def user_id(usage):
+    caches['default'].clear()
+    user_id = str(uuid.uuid4())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO profiles (id, uuid, name, payment_status, total_tokens) VALUES (%s, %s, 'a', '', 0)",
+            [user_id, user_id],
+        )
+    return user_id
+
+
+def total_tokens(user_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT total_tokens FROM profiles WHERE id = %s", [user_id])
+        return cursor.fetchone()[0]
+
+
+def post(body, headers=None):
+    return AsyncRequestFactory().post(
+        '/api/solve-math/', data=json.dumps(body), content_type='application/json', headers=headers
+    )
+
+
+async def read_events(response):
+    events = []
+    async for chunk in response.streaming_content:
+        for message in chunk.decode('utf-8').strip().split('\n\n'):
+            event, data = message.split('\n', 1)
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+class TestSolveView:
+    def test_view_is_native_async(self):
+        assert asyncio.iscoroutinefunction(views.solve_math_problem)
+        assert views.solve_math_problem.csrf_exempt
+
+    async def test_solution_comes_with_the_saved_turn(self, agent, user_id, usage):
+        response = await views.solve_math_problem(
+            post({'question': 'Solve x + 1 = 5', 'user_id': user_id, 'session_id': 's1'})
+        )
+
+        assert response.status_code == 200
+        body = json.loads(response.content)
+        assert body['solution'] == 'answer to Solve x + 1 = 5'
+        turn = body['context']['turn']
+        assert turn['id'] == (await ChatHistory.objects.aget()).id
+        assert body['context']['history_cursor']
+        # The quota check reserved 8 tokens (six words) up front; the flush settles the provider-reported rest
+        assert usage.pending(user_id) == 12 - 8
+
+    async def test_agent_is_shared_across_requests(self, agent, user_id):
+        for question in ('first', 'second'):
+            await views.solve_math_problem(post({'question': question, 'user_id': user_id, 'session_id': 's1'}))
+        assert [question for question, _ in agent.calls] == ['first', 'second']
+
+    async def test_missing_question(self, agent, user_id):
+        response = await views.solve_math_problem(post({'user_id': user_id}))
+        assert response.status_code == 400
+        assert agent.calls == []
+
+    async def test_invalid_base64_image(self, agent, user_id):
+        response = await views.solve_math_problem(
+            post({'question': 'q', 'user_id': user_id, 'image': 'not base64!'})
+        )
+        assert response.status_code == 400
+
+    async def test_limit_reached_after_reservations(self, agent, user_id):
+        def use_up_quota():
+            with connection.cursor() as cursor:
+                cursor.execute("UPDATE profiles SET total_tokens = 96 WHERE id = %s", [user_id])
+        await sync_to_async(use_up_quota)()
+
+        response = await views.solve_math_problem(post({'question': 'Solve x + 1 = 5', 'user_id': user_id}))
+        assert response.status_code == 403
+        assert agent.calls == []
+
+    async def test_rejected_request_reserves_nothing(self, agent, user_id, monkeypatch):
+        async def reject(user_id, paid=False):
+            raise AdmissionRejected("Server is busy", 1)
+        monkeypatch.setattr(views.admission, 'admit', reject)
+
+        response = await views.solve_math_problem(post({'question': 'Solve x + 1 = 5', 'user_id': user_id}))
+
+        assert response.status_code == 429
+        assert await sync_to_async(total_tokens)(user_id) == 0
+        assert agent.calls == []
+
+    async def test_failed_quota_check_frees_the_slot(self, agent, monkeypatch):
+        controller = AdmissionController(per_user=1)
+        monkeypatch.setattr(views, 'admission', controller)
+
+        for _ in range(2):
+            response = await views.solve_math_problem(post({'question': 'q', 'user_id': 'not-a-uuid'}))
+            assert response.status_code == 400
+        assert controller.stats()['active'] == 0
+
+    async def test_get_is_rejected(self):
+        response = await views.solve_math_problem(AsyncRequestFactory().get('/api/solve-math/'))
+        assert response.status_code == 405
+
+
+class TestSolveStream:
+    async def test_streams_deltas_then_done(self, agent, user_id):
+        response = await views.solve_math_problem(
+            post({'question': 'Solve x', 'user_id': user_id, 'session_id': 's1', 'stream': True})
+        )
+
+        assert response['Content-Type'] == 'text/event-stream'
+        assert response['Cache-Control'] == 'no-cache'
+        events = await read_events(response)
+        assert events[:2] == [('delta', {'content': 'x = '}), ('delta', {'content': '4'})]
+        name, done = events[-1]
+        assert name == 'done' and done['solution'] == 'x = 4'
+        # The turn is saved before the done event is sent
+        assert done['context']['turn']['id'] == (await ChatHistory.objects.aget()).id
+
+    async def test_accept_header_selects_streaming(self, agent, user_id):
+        response = await views.solve_math_problem(
+            post({'question': 'Solve x', 'user_id': user_id}, headers={'Accept': 'text/event-stream'})
+        )
+        assert response.streaming
+        assert [name for name, _ in await read_events(response)] == ['delta', 'delta', 'done']
+
+    def test_sse_event_format(self):
+        assert views.sse_event('delta', {'content': 'a'}) == 'event: delta\ndata: {"content": "a"}\n\n'
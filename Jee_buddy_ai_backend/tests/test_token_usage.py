@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from django.db import connection, connections
+
+
+from main.agents import math_token_set_limit_agent
+from main.agents.math_token_set_limit_agent import LIMIT_REACHED_MESSAGE, MathTokenLimitAgent
+from main.utils import token_usage as token_usage_module
+from main.utils.profile_cache import ProfileCache
+from main.utils.token_usage import TokenUsageBuffer, add_usage
+
+
+USER = '11111111-1111-1111-1111-111111111111'
+PROFILE = {'id': USER, 'name': 'a', 'payment_status': '', 'total_tokens': 40}
+
+
+class TestTokenUsageBuffer:
+    @pytest.fixture
+    def buffer(self):
+        return TokenUsageBuffer(flush_interval=60, profiles=ProfileCache(local_ttl=60))
+
+    @pytest.fixture
+    def cursor(self):
+        cursor = mock.MagicMock()
+        connection = mock.MagicMock()
+        connection.cursor.return_value.__enter__.return_value = cursor
+        with mock.patch.object(token_usage_module, 'connections', {'default': connection}), \
+                mock.patch.object(token_usage_module, 'close_old_connections'):
+            yield cursor
+
+    def test_add_usage_accumulates_provider_blocks(self):
+        usage = {}
+        add_usage(usage, mock.Mock(prompt_tokens=30, completion_tokens=20, total_tokens=50))
+        add_usage(usage, mock.Mock(prompt_tokens=5, completion_tokens=5, total_tokens=10))
+        assert usage == {'prompt_tokens': 35, 'completion_tokens': 25, 'total_tokens': 60}
+
+    def test_pending_usage_counts_towards_quota(self, buffer):
+        """Unflushed usage is added to the cached snapshot without reloading it"""
+        load_profile = mock.Mock(return_value=dict(PROFILE))
+        buffer.record(USER, 25)
+        buffer.record(USER, 5)
+
+        assert buffer.get_profile(USER, load_profile)['total_tokens'] == 70
+        assert buffer.get_profile(USER, load_profile)['total_tokens'] == 70
+        load_profile.assert_called_once_with(USER)
+
+    def test_flush_writes_one_batch(self, buffer, cursor):
+        buffer.get_profile(USER, lambda _: dict(PROFILE))
+        buffer.record(USER, 30)
+        buffer.record('22222222-2222-2222-2222-222222222222', 7)
+
+        assert buffer.flush() == 2
+        cursor.execute.assert_called_once()
+        ids, deltas = cursor.execute.call_args[0][1]
+        assert dict(zip(ids, deltas)) == {USER: 30, '22222222-2222-2222-2222-222222222222': 7}
+        # The cached profile is invalidated, so flushed tokens are read back from the database once
+        assert buffer.pending(USER) == 0
+        assert buffer.get_profile(USER, lambda _: {**PROFILE, 'total_tokens': 70})['total_tokens'] == 70
+
+    def test_usage_being_flushed_still_counts(self, buffer, cursor):
+        buffer.get_profile(USER, lambda _: dict(PROFILE))
+        buffer.record(USER, 30)
+
+        def check_during_flush(*args):
+            assert buffer.get_profile(USER, mock.Mock())['total_tokens'] == 70
+        cursor.execute.side_effect = check_during_flush
+
+        assert buffer.flush() == 1
+
+    def test_flush_releases_its_connection(self, buffer, cursor):
+        buffer.record(USER, 30)
+        with mock.patch.object(token_usage_module, 'close_old_connections') as close:
+            cursor.execute.side_effect = lambda *args: close.assert_called_once()
+            buffer.flush()
+        assert close.call_count == 2
+
+    def test_refund_in_flight_survives_an_overlapping_flush(self, buffer, cursor):
+        buffer.record(USER, 0, reserved=10)  # A failed solve gives its reservation back
+        seen = []
+
+        def overlapping_flush(*args):
+            if not seen:
+                seen.append(None)
+                buffer.record(USER, 30)
+                buffer.flush()  # The timer flush runs while the exit flush is still committing
+                seen.append(buffer.pending(USER))
+        cursor.execute.side_effect = overlapping_flush
+
+        assert buffer.flush() == 1
+        assert seen[1] == -10
+        assert buffer.pending(USER) == 0
+
+    def test_failed_flush_keeps_usage_pending(self, buffer, cursor):
+        cursor.execute.side_effect = Exception("connection lost")
+        buffer.record(USER, 30)
+
+        assert buffer.flush() == 0
+        assert buffer.pending(USER) == 30
+
+    def test_reservations_are_settled_by_the_difference(self, buffer):
+        buffer.record(USER, 30, reserved=10)
+        buffer.record(USER, 4, reserved=10)
+        assert buffer.pending(USER) == 14
+
+        buffer.record(USER, 0, reserved=14)
+        assert buffer.pending(USER) == 0
+
+    def test_flush_skips_settled_users(self, buffer, cursor):
+        buffer.record(USER, 10, reserved=10)
+        buffer.record(USER, 0, reserved=5)
+        buffer.record('22222222-2222-2222-2222-222222222222', 5, reserved=5)
+
+        assert buffer.flush() == 1
+        ids, deltas = cursor.execute.call_args[0][1]
+        assert dict(zip(ids, deltas)) == {USER: -5}
+
+
+@pytest.mark.usefixtures('db')
+class TestQuotaReservation:
+    @pytest.fixture(autouse=True)
+    def usage(self, monkeypatch):
+        buffer = TokenUsageBuffer(flush_interval=3600)
+        monkeypatch.setattr(math_token_set_limit_agent, 'usage_buffer', buffer)
+        return buffer
+
+    def add_profile(self, total_tokens):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO profiles (id, uuid, name, payment_status, total_tokens) VALUES (%s, %s, 'a', '', %s)",
+                [USER, USER, total_tokens],
+            )
+
+    def total_tokens(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT total_tokens FROM profiles WHERE id = %s", [USER])
+            return cursor.fetchone()[0]
+
+    def test_reservation_stops_at_the_limit(self):
+        self.add_profile(95)
+        agent = MathTokenLimitAgent()
+
+        assert agent.reserve_tokens(USER, 5) == 100
+        assert agent.reserve_tokens(USER, 1) is None
+        assert self.total_tokens() == 100
+
+    def test_concurrent_reservations_never_overshoot(self):
+        self.add_profile(0)
+
+        def reserve(_):
+            try:
+                return MathTokenLimitAgent().reserve_tokens(USER, 20)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(reserve, range(12)))
+
+        assert sorted(total for total in results if total is not None) == [20, 40, 60, 80, 100]
+        assert self.total_tokens() == 100
+
+    def test_unflushed_usage_counts_against_the_limit(self, usage):
+        self.add_profile(50)
+        usage.record(USER, 45)
+
+        assert MathTokenLimitAgent().reserve_tokens(USER, 10) is None
+        assert MathTokenLimitAgent().reserve_tokens(USER, 5) == 55
+
+    def test_process_query_reserves_the_estimate(self):
+        self.add_profile(0)
+        response = MathTokenLimitAgent().process_query(USER, 'Solve x + 1 = 5')
+
+        assert response == {'total_tokens': 8, 'remaining_tokens': 92, 'reserved_tokens': 8}
+        assert self.total_tokens() == 8
+
+    def test_process_query_blocks_at_the_limit(self):
+        self.add_profile(95)
+        assert MathTokenLimitAgent().process_query(USER, 'Solve x + 1 = 5') == {'message': LIMIT_REACHED_MESSAGE}
+        assert self.total_tokens() == 95